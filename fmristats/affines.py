@@ -52,23 +52,58 @@ def is_rotation_matrix(a, **kwargs):
 
     Parameters
     ----------
-    a : ndarray, shape (n,n)
-        an darray
+    a : ndarray, shape (3,3) or (…,3,3)
+        an darray, or a stack of them
     **kwargs :
         parameters passed on to `np.close`.
 
     Returns
     -------
-    bool :
-        True or False.
+    bool or ndarray, shape (…), dtype: bool :
+        True or False (for each matrix in the stack).
 
     Notes
     -----
     The function assumes that `a` is square.
     """
     return np.isclose(
-            np.dot(np.transpose(a), a),
-            np.identity(3), **kwargs).all()
+            np.matmul(np.swapaxes(a, -1, -2), a),
+            np.identity(3), **kwargs).all(axis=(-1,-2))
+
+def mat2euler_stacked(m, cy_thresh=None):
+    """
+    Euler angles of a stack of rotation matrices
+
+    The same as nibabel.eulerangles.mat2euler, applied to each matrix
+    in the stack.
+
+    Parameters
+    ----------
+    m : ndarray, shape (…,3,3)
+        Rotation matrices.
+    cy_thresh : None or float
+        Threshold below which to give up on straightforward arctan for
+        estimating x rotation.
+
+    Returns
+    -------
+    ndarray, shape (…,3)
+        The angles z, y, x of each rotation.
+    """
+    if cy_thresh is None:
+        cy_thresh = np.finfo(m.dtype).eps * 4
+
+    cy = np.sqrt(m[...,2,2]*m[...,2,2] + m[...,1,2]*m[...,1,2])
+    standard = cy > cy_thresh
+
+    euler = np.empty(m.shape[:-2] + (3,))
+    euler[...,0] = np.where(standard,
+            np.arctan2(-m[...,0,1], m[...,0,0]),
+            np.arctan2( m[...,1,0], m[...,1,1]))
+    euler[...,1] = np.arctan2(m[...,0,2], cy)
+    euler[...,2] = np.where(standard,
+            np.arctan2(-m[...,1,2], m[...,2,2]), 0.)
+    return euler
 
 def isclose(x, y, **kwargs):
     """
@@ -233,10 +268,7 @@ class Affine:
             return Affine(self.affine.dot(x.affine))
 
         if type(x) is Affines:
-            results = np.empty_like(x.affines)
-            for t in range(x.n):
-                results[t] = self.affine.dot(x.affines[t])
-            return Affines(results)
+            return Affines(np.matmul(self.affine, x.affines))
 
     def euler(self):
         """
@@ -359,10 +391,7 @@ class Affines:
         n, x, y = affines.shape
         assert (x,y) == (4,4), 'affines must be given in homologous coordinates'
         assert np.isclose(affines[:,3], np.array((0,0,0,1))).all(), 'last row must be [0,0,0,1]'
-        rigid = np.repeat(False, n)
-        for t in range(n):
-            rigid[t] = is_rotation_matrix(affines[t,:3,:3])
-        self.are_rigid = rigid.all()
+        self.are_rigid = is_rotation_matrix(affines[:,:3,:3]).all()
         self.affines = affines
         self.n = n
 
@@ -413,28 +442,73 @@ class Affines:
         Calculates the mean rigid transformation of the rigid
         transformation within a window of [-r,r] around each
         transformation.
+
+        Parameters
+        ----------
+        r : int or sequence of int
+            Radius of the window; if a sequence of radii is given, the
+            means are calculated for each of them.
+        skip : None or ndarray, shape (n,), dtype: bool
+            True for transformations which shall not enter any mean.
+
+        Returns
+        -------
+        Affines or list of Affines :
+            The mean rigid transformations (for each radius).
+
+        Notes
+        -----
+        The sums within the windows are obtained from running sums of
+        the transformations, which are shared by all radii, such that
+        the cost is linear in the number of transformations. Only the
+        projection of the mean onto the rotations is done for each
+        transformation. If a window contains no transformation which is
+        not skipped, the transformation is left as it is.
         """
         assert self.are_rigid, 'affines must be rigid'
-        assert r >= 0, 'r must be non-negative'
-
-        mean_affines = self.affines.copy()
-
-        if r > 0:
-            if skip is None:
-                for t in range(self.n):
-                    xs = self.affines[max(0,t-r):t+r+1]
-                    if xs.shape[0] > 0:
-                        mean_affines[t] = Affines(xs).mean_rigid().affine
-            else:
-                for t in range(self.n):
-                    xs = self.affines[max(0,t-r):t+r+1]
-                    wh = np.where(~skip[max(0,t-r):t+r+1])
-                    xs = xs[wh]
-                    if xs.shape[0] > 0:
-                        mean_affines[t] = Affines(xs).mean_rigid().affine
-
-        mean_affines[:,3] = (0,0,0,1)
-        return Affines(mean_affines)
+
+        radii = np.atleast_1d(r)
+        assert radii.ndim == 1, 'r must be an int or a sequence of int'
+        assert (radii >= 0).all(), 'r must be non-negative'
+
+        if skip is None:
+            weights = np.ones(self.n)
+        else:
+            assert skip.shape == (self.n,), 'skip must be of shape (n,)'
+            weights = (~skip).astype(float)
+
+        # running sums of the transformations relative to their mean,
+        # which keeps the rounding errors of the differences small
+        centre = self.affines.mean(axis=0)
+        sums = np.zeros((self.n+1,4,4))
+        np.cumsum(weights[:,None,None] * (self.affines - centre), axis=0,
+                out=sums[1:])
+        counts = np.hstack((0, np.cumsum(weights)))
+
+        t = np.arange(self.n)
+        results = []
+        for radius in radii:
+            mean_affines = self.affines.copy()
+
+            if radius > 0:
+                lower = np.maximum(t-radius, 0)
+                upper = np.minimum(t+radius+1, self.n)
+                count = counts[upper] - counts[lower]
+                some = count > 0
+
+                m = centre + (sums[upper[some]] - sums[lower[some]]) \
+                        / count[some,None,None]
+                u, _, v = svd(m[:,:3,:3])
+                m[:,:3,:3] = np.matmul(u, v)
+                mean_affines[some] = m
+
+            mean_affines[:,3] = (0,0,0,1)
+            results.append(Affines(mean_affines))
+
+        if np.ndim(r) == 0:
+            return results[0]
+
+        return results
 
     def euler(self):
         """
@@ -445,10 +519,7 @@ class Affines:
         This only makes sense, if the affine transformations are rigid.
         """
         assert self.are_rigid, 'affines must be rigid'
-        euler = np.zeros((self.n,3))
-        for t in range(self.n):
-            euler[t] = mat2euler(self.affines[t,:3,:3])
-        return euler
+        return mat2euler_stacked(self.affines[:,:3,:3])
 
     def apply(self, x):
         """
@@ -485,6 +556,26 @@ class Affines:
         """
         return self.apply(np.array(index))
 
+    def apply_to_indices(self, indices):
+        """
+        Apply affine transformations to indices
+
+        Parameters
+        ----------
+        index : 3-tuple
+            3-tuple of Slice or Ellipse objects.
+
+        Returns
+        -------
+        ndarray, shape (n,…,3):
+            The result of each affine applied to the indices; the same
+            as Affine.apply_to_indices for each affine.
+        """
+        grid = np.moveaxis(np.mgrid[indices], 0, -1)
+        tmp = np.append(grid, np.ones(grid.shape[:-1] + (1,)), axis=-1)
+        affines = self.affines.reshape((self.n,) + (1,)*(grid.ndim-1) + (4,4))
+        return np.einsum('...ij,...j', affines, tmp)[...,:3]
+
     def inv(self):
         """
         Calculates the inverse of an affine transformation
@@ -503,17 +594,13 @@ class Affines:
             uT = np.moveaxis(u, [1,2], [2,1])
 
             inverses = np.empty_like(self.affines)
-            for t in range(self.n):
-                inverses[t,:3,:3] =  uT[t]
-                inverses[t,:3, 3] = -uT[t].dot(p[t])
-
+            inverses[:,:3,:3] =  uT
+            inverses[:,:3, 3] = -np.matmul(np.ascontiguousarray(uT),
+                    np.ascontiguousarray(p)[...,None])[...,0]
             inverses[:,3] = (0,0,0,1)
             return Affines(inverses)
         else:
-            inverses = np.empty_like(self.affines)
-            for t in range(self.n):
-                inverses[t] = inv(self.affines[t])
-            return Affines(inverses)
+            return Affines(inv(self.affines))
 
     def dot(self, x):
         """
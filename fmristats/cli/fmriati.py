@@ -86,7 +86,9 @@ from .. import load
 
 from ..diffeomorphisms import Image
 
-from ..fit import fit_field, extract_field
+from ..fit import fit_field
+
+from ..neighbours import CellIndex
 
 import pandas as pd
 
@@ -120,31 +122,31 @@ def call(args):
     coord  = coordinates.reshape((-1,3))
     greys  = img.data.reshape((-1,))[...,None]
     data   = np.hstack((coord, greys))
-    design = np.ones_like(greys)
+    data   = data[np.isfinite(greys[...,0])]
+    design = np.ones_like(data[...,3:4])
+
+    radius = args.factor * args.scale
+    index  = CellIndex(data, width=radius)
 
     old_settings = np.seterr(divide='raise', invalid='raise')
     time0 = time.time()
 
-    result, parameter_dict, value_dict = fit_field(
+    params, cov_params, mse = fit_field(
             coordinates,
             mask,
             data,
             design,
             epi_code=1,
             scale=args.scale,
-            radius=args.factor * args.scale,
+            radius=radius,
             verbose=args.verbose,
-            backend='numba')
+            backend='numba',
+            index=index)
 
     time1 = time.time()
     np.seterr(**old_settings)
 
-    field = extract_field(
-            field=result,
-            param='intercept',
-            value='point',
-            parameter_dict={'intercept':0},
-            value_dict=value_dict)
+    field = params[...,0]
 
     ati = Image(reference=img.reference, data=field, name=name)
     ati.save(args.output)
@@ -252,15 +252,50 @@ def define_parser():
 
     backends = parser.add_argument_group(
         """Backends""",
-        """Currently, two backends are supported: Numba and
-        Statsmodels.""")
+        """Currently, four backends are supported: Numba, parallel
+        Numba, convolution (approximate), and Statsmodels.""")
 
     backends.add_argument('--backend',
         default='numba',
-        choices=['numba', 'jit', 'statsmodels'],
+        choices=['numba', 'jit', 'parallel', 'convolution', 'statsmodels'],
         help="""Choose your backend. Backends numba and jit are two
         names for the same backend. JIT is fast, statsmodels is slow.
-        Statsmodels also calculates a Durbin-Watson type statistics.""")
+        Statsmodels also calculates a Durbin-Watson type statistics.
+        The parallel backend fits the voxels of a single session on
+        CORES threads; protocol entries are then processed
+        sequentially. Results do not depend on the number of
+        threads. The convolution backend is APPROXIMATE: it does
+        not fit each voxel separately, but convolves the sufficient
+        statistics of the fits on a fine grid with the Gaussian
+        kernel. It is much faster, but while the weights of the
+        observations are off by at most 0.06, no such bound holds
+        for the estimates: parameters may differ by a sixth of
+        their standard error, and standard errors, error variances,
+        and degrees of freedom by several percent (standard errors
+        by up to 30% at sharp edges of the signal). Use it for
+        previews, not for inference.""")
+
+    backends.add_argument('--solver',
+        default='pinv',
+        choices=['pinv', 'cholesky'],
+        help="""Choose how the weighted least squares problem at each
+        voxel is solved. The default pinv uses the Moore-Penrose
+        pseudo-inverse of the weighted design matrix. The solver
+        cholesky solves the (much smaller) normal equations instead,
+        and only falls back to the pseudo-inverse at voxels at which
+        these are ill-conditioned. The number of such voxels is
+        reported.""")
+
+    backends.add_argument('--engine',
+        default='cells',
+        choices=['cells', 'scanner'],
+        help="""Choose how the observations in the neighbourhood of a
+        voxel are found. The default cells builds a
+        spatial index over the coordinates of all observations. The
+        engine scanner never calculates these coordinates;
+        observations are looked up in the index space of each scan
+        cycle instead, which needs less memory. Estimates agree up to
+        rounding error.""")
 
     ####################################################################
     # File handling
@@ -281,6 +316,30 @@ def define_parser():
         help="""Ignore lock, if file is locked. Together with -s/--skip
         this will also remove orphan locks.""")
 
+    lock_handling.add_argument('--resume',
+        action='store_true',
+        help="""Resume interrupted fits. If the file is locked but a
+        checkpoint of the fit exists next to it (because the fit has
+        been killed), take over the lock and continue the fit from the
+        checkpoint. Only use this if the fit is not running anymore.""")
+
+    file_handling.add_argument('--checkpoint-interval',
+        type=float,
+        help="""Minutes between two checkpoints of a fit. The checkpoint
+        is saved next to the result with the suffix .checkpoint.npz and
+        removed when the fit is complete. A fit with checkpoints will
+        always continue from a matching checkpoint. By default, fits
+        are not checkpointed, unless --resume is given, in which case
+        checkpoints are saved every 10 minutes. Set to 0 to disable
+        checkpoints. Checkpoints are not available together with
+        --memory.""")
+
+    file_handling.add_argument('--cov-dtype',
+        default='float64',
+        choices=['float64', 'float32'],
+        help="""Data type in which the (packed) covariance matrices of
+        the parameters are saved. float32 halves their size on disk.""")
+
     skip_force = file_handling.add_mutually_exclusive_group()
 
     skip_force.add_argument('-f', '--force',
@@ -333,7 +392,30 @@ def define_parser():
         is the default). It is possible, however, to generate a thread
         for each protocol entry. Note that this may generate a lot of
         I/O-operations. If you set CORES to 0, then the number of cores
-        on the machine will be used.""")
+        on the machine will be used. If the backend is parallel, CORES
+        is the number of threads used to fit the voxels of each
+        session.""")
+
+    ####################################################################
+    # Memory
+    ####################################################################
+
+    control_memory = parser.add_argument_group(
+        """Memory""",
+        """Fit sessions which do not fit into memory.""")
+
+    control_memory.add_argument('--memory',
+        type=float,
+        help="""Memory budget in GB. If given, the observations of a
+        session are written to a scratch directory and memory-mapped
+        from there, and the standard space is fitted in slabs, such
+        that the observations needed for a slab approximately fit into
+        this budget. Only available for the cells engine.""")
+
+    control_memory.add_argument('--scratch',
+        help="""Directory in which to create the temporary scratch
+        directories of --memory. Defaults to the temporary directory of
+        the system.""")
 
     return parser
 
@@ -359,6 +441,10 @@ from os.path import isfile, isdir, join
 
 import math
 
+import shutil
+
+import tempfile
+
 from multiprocessing.dummy import Pool as ThreadPool
 
 import numpy as np
@@ -423,11 +509,20 @@ def call(args):
     ####################################################################
 
     remove_lock       = args.remove_lock
+    resume            = args.resume
     ignore_lock       = args.ignore_lock
     force             = args.force
     skip              = args.skip
     verbose           = args.verbose
 
+    # checkpoints are only saved if asked for
+    if args.checkpoint_interval is not None:
+        interval = args.checkpoint_interval * 60
+    elif resume:
+        interval = 10 * 60
+    else:
+        interval = 0
+
     scale_type           = study.scale_type
 
     stimulus_block       = args.stimulus_block
@@ -459,6 +554,23 @@ def call(args):
     slice_object         = slice_object
 
     backend              = args.backend
+    solver               = args.solver
+    engine               = args.engine
+    cov_dtype            = args.cov_dtype
+    scratch              = args.scratch
+
+    if args.memory is None:
+        memory = None
+    else:
+        memory = int(args.memory * 1024**3)
+
+    if args.cores == 0:
+        args.cores = None
+
+    if backend == 'parallel':
+        cores = args.cores
+    else:
+        cores = None
 
     design_by_formula    = not args.use_custom_design
 
@@ -490,7 +602,18 @@ def call(args):
     def wm(index, name, session, reference_maps, population_map, result,
             design, file_result):
 
-        if type(result) is Lock:
+        if (interval > 0) and (memory is None):
+            checkpoint = file_result + '.checkpoint.npz'
+        else:
+            checkpoint = None
+
+        if type(result) is Lock and resume and (checkpoint is not None) \
+                and isfile(checkpoint):
+            if verbose:
+                print('{}: Resume from checkpoint {}'.format(name.name(),
+                    checkpoint))
+
+        elif type(result) is Lock:
             if remove_lock or ignore_lock:
                 if verbose:
                     print('{}: Remove lock'.format(name.name()))
@@ -500,6 +623,9 @@ def call(args):
             else:
                 if verbose:
                     print('{}: Locked'.format(name.name()))
+                    if isfile(file_result + '.checkpoint.npz'):
+                        print('{}: Checkpoint found. Use --resume to continue an interrupted fit'.format(
+                            name.name()))
                 return
 
         elif result is not None and not force:
@@ -589,114 +715,158 @@ def call(args):
             print('{}: Create the observation matrix'.format(
                 name.name()))
 
-        smodel.set_data(
-                burn_in = burn_in,
-                demean = demean,
-                include_background = include_background,
-                verbose = verbose)
-
-        if design_by_formula:
-            if verbose:
-                print('{}: Create the experimental design matrix'.format(
-                    name.name()))
-            smodel.set_design(formula = formula, parameter = parameter, verbose=verbose)
-
+        if memory is None:
+            directory = None
         else:
+            directory = tempfile.mkdtemp(dir=scratch)
             if verbose:
-                print('{}: Parse the experimental design matrix'.format(
-                    name.name()))
+                print('{}: Scratch directory: {}'.format(name.name(),
+                    directory))
 
-            design_array = np.asarray(design)
-            smodel.set_design_to(design_array, hasconst=True, verbose=verbose)
+        # the scratch directory holds the memory-mapped observations and
+        # fits, which are removed however the fit ends
+        try:
+            smodel.set_data(
+                    burn_in = burn_in,
+                    demean = demean,
+                    include_background = include_background,
+                    directory = None if directory is None \
+                            else join(directory, 'observations'),
+                    verbose = verbose)
+
+            if design_by_formula:
+                if verbose:
+                    print('{}: Create the experimental design matrix'.format(
+                        name.name()))
+                smodel.set_design(formula = formula, parameter = parameter, verbose=verbose)
 
-            if verbose:
-                print('{}: Parse the description of the design matrix'.format(
-                    name.name()))
+            else:
+                if verbose:
+                    print('{}: Parse the experimental design matrix'.format(
+                        name.name()))
 
-            p = design_array.shape[1]
-            commands = {}
-            with open(parameter_dict_file) as fh:
-                for line in fh:
-                    line = line.strip()
-                    if line == '' or line[0] in '#':
-                        continue
-                    command, description = line.split(':', 1)
-                    command = command.strip()
-                    try:
-                        description = [int(p) for p in description.split(',')]
-                    except:
-                        print('Not a valid entry: {}: {}'.format(
-                            command, description))
-                        continue
-                    if len(description) == 1:
-                        contrast = description[0]
-                    else:
-                        contrast = np.zeros(p, dtype=int)
-                        contrast[:len(description)] = description
-                    commands[command] = contrast
-
-            smodel.parameter_dict = commands
+                design_array = np.asarray(design)
+                smodel.set_design_to(design_array, hasconst=True, verbose=verbose)
 
-        if verbose:
-            print('{}: Set the hyperparameter: scale'.format(
+                if verbose:
+                    print('{}: Parse the description of the design matrix'.format(
                         name.name()))
 
-        smodel.set_hyperparameters(
-                scale_type=scale_type,
-                scale=scale,
-                factor=factor,
-                mass=mass)
+                p = design_array.shape[1]
+                commands = {}
+                with open(parameter_dict_file) as fh:
+                    for line in fh:
+                        line = line.strip()
+                        if line == '' or line[0] in '#':
+                            continue
+                        command, description = line.split(':', 1)
+                        command = command.strip()
+                        try:
+                            description = [int(p) for p in description.split(',')]
+                        except:
+                            print('Not a valid entry: {}: {}'.format(
+                                command, description))
+                            continue
+                        if len(description) == 1:
+                            contrast = description[0]
+                        else:
+                            contrast = np.zeros(p, dtype=int)
+                            contrast[:len(description)] = description
+                        commands[command] = contrast
+
+                smodel.parameter_dict = commands
 
-        if verbose > 2:
-            print("""{}: {}""".format(name.name(), smodel.describe()))
+            if verbose:
+                print('{}: Set the hyperparameter: scale'.format(
+                            name.name()))
 
-        ########################################################################
-        # Fit
-        ########################################################################
+            smodel.set_hyperparameters(
+                    scale_type=scale_type,
+                    scale=scale,
+                    factor=factor,
+                    mass=mass)
 
-        if fit_at_slice:
-            if verbose:
-                print('{}: Fit at {}'.format(name.name(), slice_object))
+            if verbose > 2:
+                print("""{}: {}""".format(name.name(), smodel.describe()))
 
-            coordinates = smodel.population_map.diffeomorphism.coordinates()
-            coordinates = coordinates[slice_object]
+            ########################################################################
+            # Fit
+            ########################################################################
 
-            result = smodel.fit_at_subject_coordinates(
-                    coordinates=coordinates,
-                    mask=mask,
-                    verbose=verbose,
-                    backend=backend)
+            if fit_at_slice:
+                if verbose:
+                    print('{}: Fit at {}'.format(name.name(), slice_object))
+
+                coordinates = smodel.population_map.diffeomorphism.coordinates()
+                coordinates = coordinates[slice_object]
+
+                result = smodel.fit_at_subject_coordinates(
+                        coordinates=coordinates,
+                        mask=mask,
+                        verbose=verbose,
+                        backend=backend,
+                        cores=cores,
+                        solver=solver,
+                        engine=engine,
+                        memory=memory,
+                        directory=None if directory is None \
+                                else join(directory, 'fit'),
+                        checkpoint=checkpoint,
+                        interval=interval)
 
-            if verbose:
-                print('{}: Done fitting'.format(name.name()))
+                if verbose:
+                    print('{}: Done fitting'.format(name.name()))
 
-        else:
-            result = smodel.fit(
-                    mask=mask,
-                    verbose=verbose,
-                    backend=backend)
+            else:
+                result = smodel.fit(
+                        mask=mask,
+                        verbose=verbose,
+                        backend=backend,
+                        cores=cores,
+                        solver=solver,
+                        engine=engine,
+                        memory=memory,
+                        directory=None if directory is None \
+                                else join(directory, 'fit'),
+                        checkpoint=checkpoint,
+                        interval=interval)
 
-            if verbose:
-                print('{}: Done fitting'.format(name.name()))
+                if verbose:
+                    print('{}: Done fitting'.format(name.name()))
 
-        ###############################################################
-        # Save the result to disk
-        ###############################################################
+            if cov_dtype != 'float64':
+                result.set_cov_dtype(cov_dtype)
 
-        try:
-            if verbose:
-                print('{}: Save: {}'.format(name.name(),
-                    file_result))
+            if solver != 'pinv':
+                print('{}: Voxels solved by the pseudo-inverse fallback: {:,d}'.format(
+                    name.name(), smodel.fallback.sum()))
 
-            result.save(file_result)
-            df.ix[index,'locked'] = False
+            ###############################################################
+            # Save the result to disk
+            ###############################################################
 
-        except Exception as e:
-            df.ix[index,'valid'] = False
-            print('{}: Unable to create: {}, {}'.format(name.name(),
-                file_result, e))
+            try:
+                if verbose:
+                    print('{}: Save: {}'.format(name.name(),
+                        file_result))
+
+                result.save(file_result)
+                df.ix[index,'locked'] = False
+
+            except Exception as e:
+                df.ix[index,'valid'] = False
+                print('{}: Unable to create: {}, {}'.format(name.name(),
+                    file_result, e))
+                lock.conditional_unlock(df, index, verbose, True)
+                return
+
+        except Exception:
             lock.conditional_unlock(df, index, verbose, True)
-            return
+            raise
+
+        finally:
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors=True)
 
         if verbose > 2:
             print("""{}: {}""".format(name.name(), result.describe()))
@@ -705,10 +875,8 @@ def call(args):
 
     ####################################################################
 
-    if args.cores == 0:
-        args.cores = None
-
-    if len(df) > 1 and ((args.cores is None) or (args.cores > 1)):
+    if len(df) > 1 and (backend != 'parallel') and \
+            ((args.cores is None) or (args.cores > 1)):
         try:
             pool = ThreadPool(args.cores)
             for index, name, files, instances in study_iterator:
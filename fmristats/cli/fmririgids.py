@@ -158,7 +158,8 @@ def define_parser():
         is the default). It is possible, however, to generate a thread
         for each protocol entry. Note that this may generate a lot of
         I/O-operations. If you set CORES to 0, then the number of cores
-        on the machine will be used.""")
+        on the machine will be used. If there is only a single protocol
+        entry, its scan cycles are distributed over CORES threads.""")
 
     return parser
 
@@ -288,7 +289,7 @@ def call(args):
             print('{}: Start fit of rigid body transformations'.format(name.name()))
 
         reference_maps = ReferenceMaps(name)
-        reference_maps.fit(session)
+        reference_maps.fit(session, cores=cores)
         reference_maps.reset_reference_space()
 
         ####################################################################
@@ -365,6 +366,12 @@ def call(args):
     if args.cores == 0:
         args.cores = None
 
+    # a single session distributes its scan cycles over the cores
+    if len(df) == 1:
+        cores = args.cores
+    else:
+        cores = 1
+
     if len(df) > 1 and ((args.cores is None) or (args.cores > 1)):
         try:
             pool = ThreadPool(args.cores)
@@ -50,6 +50,13 @@ def define_parser():
             action='store_true',
             help="""Force re-writing the sample file.""")
 
+    specific.add_argument('-u', '--update',
+            action='store_true',
+            help="""Update an existing sample file. The fields of
+            subjects whose result files have not changed since the
+            sample file has been written are taken from the existing
+            sample, only new or changed results are read.""")
+
     specific.add_argument('--mask',
         help="""Set the mask to use. If yes, true, apply or not given,
         both vb and vb_mask will apply. If no, false or ignore, neither
@@ -68,6 +75,21 @@ def define_parser():
         default=0,
         help="""Increase output verbosity""")
 
+    ####################################################################
+    # Multiprocessing
+    ####################################################################
+
+    control_multiprocessing  = parser.add_argument_group(
+        """Multiprocessing""")
+
+    control_multiprocessing.add_argument('-j', '--cores',
+        type=int,
+        default=1,
+        help="""Number of threads to use. The results of the subjects
+        are read and written into the sample concurrently by CORES
+        threads. If you set CORES to 0, then the number of cores on the
+        machine will be used.""")
+
     ####################################################################
     # Push
     ####################################################################
@@ -101,6 +123,8 @@ cmd.__doc__ = __doc__
 
 import os
 
+import time
+
 from os.path import isfile, isdir, join
 
 from multiprocessing.dummy import Pool as ThreadPool
@@ -115,16 +139,17 @@ from ..lock import Lock
 
 from ..study import Study
 
-from ..smodel import Result
+from ..smodel import Result, SignalFit
 
-from ..sample import Sample
+from ..sample import Sample, fingerprint, settings_fingerprint
 
 ########################################################################
 
 def call(args):
 
-    if isfile(args.sample) and not args.force:
-        print('Sample file already exists, use -f/--force to overwrite.')
+    if isfile(args.sample) and not (args.force or args.update):
+        print('Sample file already exists, use -f/--force to overwrite '
+                'or -u/--update to update.')
         if args.verbose:
             print('Parse: {}'.format(args.sample))
         sample = load(args.sample)
@@ -136,6 +161,18 @@ def call(args):
     else:
         sample_file = args.sample
 
+    previous = None
+    if args.update and isfile(sample_file):
+        if args.verbose:
+            print('Parse: {}'.format(sample_file))
+        try:
+            previous = load(sample_file)
+            assert type(previous) is Sample, 'file does not contain Sample'
+        except Exception as e:
+            previous = None
+            print('Unable to read {}, create new sample: {}'.format(
+                sample_file, e))
+
     ###################################################################
 
     study = get_study(args)
@@ -182,11 +219,17 @@ def call(args):
     force   = args.force
     verbose = args.verbose
 
+    if args.cores == 0:
+        args.cores = None
+
     ####################################################################
     # Create the iterator
     ####################################################################
 
-    study_iterator = study.iterate('result',
+    # results are read by the workers, the iterator only provides the
+    # file names
+    study_iterator = study.iterate(
+            new=['result'],
             verbose=args.verbose,
             integer_index=True)
 
@@ -198,45 +241,163 @@ def call(args):
     if args.verbose:
         print('Create population sample: {}'.format(sample_file))
 
-    statistics = np.empty(study.vb.shape + (3,len(df),))
-    statistics [ ... ] = np.nan
-
-    for index, name, instances in study_iterator:
-        result = instances['result']
-        if result is not None:
-            if type(result) is Lock:
-                print('{}: Result file is locked. Still fitting?'.format(
-                    name.name()))
-            elif type(result) is not Result:
-                print('{}: File does not contain Result. Skipping.'.format(
-                    name.name()))
-            else:
-                if verbose > 2:
-                    print("""{}: Description of the fit:
-                        {}
-                        {}""".format(name.name(), result.describe(),
-                            result.population_map.describe()))
-
-                result.mask(mask=mask, verbose=verbose)
-                intercept = result.get_field('intercept','point')
-                c = study.vb_ati.data / intercept.data
-
-                beta = result.get_field('task','point')
-                beta_stderr = result.get_field('task','stderr')
-
-                statistics[...,0,index] = c*beta.data
-                statistics[...,1,index] = c*beta_stderr.data
-                statistics[...,2,index] = c
+    # the statistics are collected subject by subject in a memory-mapped
+    # scratch file, such that they never need to be held in memory
+    dfile = os.path.dirname(sample_file)
+    if dfile and not isdir(dfile):
+       os.makedirs(dfile)
+
+    scratch_file = sample_file + '.scratch.npy'
+    scratch = np.lib.format.open_memmap(scratch_file, mode='w+',
+            dtype=float, shape=(len(df),) + tuple(study.vb.shape) + (3,))
+    statistics = np.moveaxis(scratch, 0, -1)
+    fingerprints = np.empty(len(df), dtype=object)
+
+    # the fields also depend on the templates and on the mask, which are
+    # therefore part of the fingerprint of each field
+    settings = settings_fingerprint(study.vb, study.vb_ati, mask)
+
+    # fields of the previous sample by the file they have been extracted
+    # from
+    if previous is None:
+        fields = {}
+    elif previous.statistics.shape[:3] != study.vb.shape:
+        print('Shape of the existing sample does not match, create new sample')
+        fields = {}
+    else:
+        fields = previous.get_fields()
+        if any(field[1][3:] != (settings,) for field in fields.values()):
+            print('Mask or templates of the existing sample differ, collect all subjects')
+            fields = {}
+        elif verbose:
+            print('Fields in the existing sample: {:d}'.format(len(fields)))
+
+    def wm(index, name, file_result):
+        """
+        Read the result of a subject and write the statistics into the
+        slot of the subject in the sample
+
+        Returns
+        -------
+        str or None
+            The reason why no statistics have been collected, or None.
+        """
+        if not isfile(file_result):
+            return 'No Result found'
+
+        try:
+            result = load(file_result)
+        except Exception as e:
+            return 'Unable to read {}, {}'.format(file_result, e)
+
+        if type(result) is Lock:
+            return 'Result file is locked. Still fitting?'
+
+        if type(result) not in [Result, SignalFit]:
+            return 'File does not contain Result. Skipping.'
+
+        if verbose > 2:
+            print("""{}: Description of the fit:
+                {}
+                {}""".format(name.name(), result.describe(),
+                    result.population_map.describe()))
+
+        # the mask is applied to the extracted fields only, such that
+        # the fields of the fit are never written to
+        region = result.get_mask(mask=mask, verbose=verbose > 1)
+
+        if type(result) is SignalFit:
+            # only the parameters and covariances which enter intercept
+            # and task are read from disk
+            point, varerr = result.evaluate_contrasts(['intercept', 'task'])
+            intercept = point[...,0]
+            beta = point[...,1]
+            beta_stderr = np.sqrt(varerr[...,1])
         else:
-            study_iterator.df.ix[index,'valid'] = False
+            intercept = np.array(result.get_field('intercept','point').data)
+            beta = np.array(result.get_field('task','point').data)
+            beta_stderr = np.array(result.get_field('task','stderr').data)
+
+        if region is not None:
+            intercept[~region] = np.nan
+            beta[~region] = np.nan
+            beta_stderr[~region] = np.nan
+
+        c = study.vb_ati.data / intercept
+
+        statistics[...,0,index] = c*beta
+        statistics[...,1,index] = c*beta_stderr
+        statistics[...,2,index] = c
+
+    def collect(entry):
+        index, name, file_result = entry
+        start = time.time()
+        fingerprints[index] = fingerprint(file_result, settings)
+        if (file_result in fields) and \
+                (fields[file_result][1] == fingerprints[index]):
+            # unchanged since the previous sample has been written
+            statistics[...,index] = previous.statistics[
+                    ...,fields[file_result][0]]
+            return index, name, None, True, time.time() - start
+        try:
+            failure = wm(index, name, file_result)
+        except Exception as e:
+            failure = 'Unable to collect {}, {}'.format(file_result, e)
+        return index, name, failure, False, time.time() - start
+
+    entries = [(index, name, files['result'])
+            for index, name, files, instances in study_iterator]
+
+    start = time.time()
+    collected = 0
+    reused = 0
+
+    if len(entries) > 1 and ((args.cores is None) or (args.cores > 1)):
+        pool = ThreadPool(args.cores)
+        outcomes = pool.imap_unordered(collect, entries)
+    else:
+        pool = None
+        outcomes = map(collect, entries)
+
+    try:
+        for index, name, failure, unchanged, elapsed in outcomes:
+            if failure is None:
+                collected += 1
+                if unchanged:
+                    reused += 1
+                if verbose and not (unchanged and verbose < 2):
+                    print('{}: {} ({:.2f} s, {:d}/{:d})'.format(
+                        name.name(), 'Unchanged' if unchanged else 'Collected',
+                        elapsed, collected, len(entries)))
+            else:
+                print('{}: {}'.format(name.name(), failure))
+                statistics[...,index] = np.nan
+                fingerprints[index] = None
+                study_iterator.df.loc[index,'valid'] = False
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = time.time() - start
+    if verbose:
+        print('Collected {:d} of {:d} subjects in {:.1f} s ({:.2f} subjects/s)'.format(
+            collected, len(entries), elapsed, collected / max(elapsed, 1e-9)))
+        if previous is not None:
+            print('Unchanged since the existing sample: {:d}'.format(reused))
+
+    # the previous sample is memory-mapped from the sample file, which
+    # is about to be replaced
+    del previous, fields
 
     df = study_iterator.df.copy()
     del df['result']
 
     sample = Sample(
-            covariates = df,
-            statistics = statistics,
-            study      = study)
+            covariates   = df,
+            statistics   = statistics,
+            study        = study,
+            fingerprints = fingerprints)
 
     sample = sample.filter()
 
@@ -250,14 +411,12 @@ def call(args):
         if verbose:
             print('Save: {}'.format(sample_file))
 
-        dfile = os.path.dirname(sample_file)
-        if dfile and not isdir(dfile):
-           os.makedirs(dfile)
-
-        sample.save(sample_file)
+        sample.save(sample_file + '.tmp')
+        os.replace(sample_file + '.tmp', sample_file)
     except Exception as e:
-        print('{}: Unable to create: {}, {}'.format(name.name(),
-            sample_file, e))
+        print('Unable to create: {}, {}'.format(sample_file, e))
+    finally:
+        os.remove(scratch_file)
 
     ####################################################################
     # Write study to disk
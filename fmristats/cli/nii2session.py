@@ -330,7 +330,7 @@ def call(args):
         if detect_foreground:
             if verbose:
                 print('{}: Detect foreground'.format(name.name()))
-            session.fit_foreground()
+            session.fit_foreground(cores=cores)
 
         elif get_foreground:
 
@@ -383,6 +383,12 @@ def call(args):
     if args.cores == 0:
         args.cores = None
 
+    # a single session distributes its scan cycles over the cores
+    if len(df) == 1:
+        cores = args.cores
+    else:
+        cores = 1
+
     if len(df) > 1 and ((args.cores is None) or (args.cores > 1)):
         try:
             pool = ThreadPool(args.cores)
@@ -36,10 +36,16 @@ import numpy.ma as ma
 
 from numpy.linalg import inv
 
-from scipy.ndimage import label, map_coordinates, \
+from scipy.ndimage import label, spline_filter, \
         maximum_filter, generate_binary_structure, binary_erosion, \
         maximum_position
 
+from multiprocessing.dummy import Pool as ThreadPool
+
+from multiprocessing import cpu_count
+
+from numba import jit
+
 class Diffeomorphism:
     """
     A diffeomorphism ψ from standard space to subject space
@@ -139,6 +145,87 @@ class Diffeomorphism:
         indices = ((slice(0,x), slice(0,y), slice(0,z)))
         return self.apply_to_indices(indices)
 
+    def __getstate__(self):
+        # cached results are not saved
+        state = self.__dict__.copy()
+        state.pop('cache', None)
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        state['cache'] = {}
+        self.__dict__.update(state)
+
+    def get_inverse(self):
+        """
+        Inverse of the reference (cached)
+
+        Returns
+        -------
+        Affine
+            The affine transformation which maps coordinates in the
+            domain to the index space of the template.
+
+        Notes
+        -----
+        The inverse is recomputed whenever the reference (or its affine
+        matrix) has been replaced by another object since it has been
+        cached. Changes of the matrix in place are not detected.
+        """
+        if getattr(self, 'cache', None) is None:
+            self.cache = {}
+        sources = (self.reference, self.reference.affine)
+        if not self.is_cached('inverse', sources):
+            self.cache['inverse'] = (sources, self.reference.inv())
+        return self.cache['inverse'][1]
+
+    def get_coefficients(self, field, dtype=np.float64):
+        """
+        Spline coefficients of a vector field (cached)
+
+        Parameters
+        ----------
+        field : ndarray, shape (x,y,z,3)
+            A vector field over the index space of the template.
+        dtype : dtype
+            Data type of the coefficients.
+
+        Returns
+        -------
+        ndarray, shape (x,y,z,3)
+            The coefficients of the cubic spline interpolation of each
+            component of the field, as calculated by map_coordinates.
+
+        Notes
+        -----
+        The coefficients are recomputed whenever another field than the
+        one they have been cached for is given (e.g. after the field
+        has been replaced by W.warp = 2*W.warp). Changes of the field in
+        place are not detected.
+        """
+        if getattr(self, 'cache', None) is None:
+            self.cache = {}
+        key = ('coefficients', np.dtype(dtype).str)
+        if not self.is_cached(key, (field,)):
+            coefficients = np.empty(field.shape, dtype=dtype)
+            for c in range(3):
+                coefficients[...,c] = spline_filter(field[...,c], order=3,
+                        output=np.float64, mode='constant')
+            self.cache[key] = ((field,), coefficients)
+        return self.cache[key][1]
+
+    def is_cached(self, key, sources):
+        """
+        Whether a value has been cached for the given sources
+
+        Cached values are stored together with the objects they have
+        been computed from, which are compared by identity (holding
+        them in the cache ensures that their ids cannot be reused).
+        """
+        cached = self.cache.get(key)
+        return cached is not None and len(cached[0]) == len(sources) and \
+                all(a is b for a, b in zip(cached[0], sources))
+
     def coordinates_domain(self):
         """
         Coordinates in the domain
@@ -687,29 +774,34 @@ class Warp(Diffeomorphism):
     def apply_to_indices(self, indices):
         return self.warp[indices]
 
-    def apply(self, coordinates):
+    def apply(self, coordinates, dtype=np.float64, cores=1):
         """
         Apply diffeomorphism to the point at given coordinate
 
         Parameters
         ----------
-        index : tuple
-            Should be a tuple of integers
+        coordinates : ndarray, shape (3,) or (n,3)
+            Coordinates in the domain.
+        dtype : dtype
+            Data type in which the warp field is interpolated.
+        cores : None or int
+            Number of threads among which the points are distributed;
+            if None, use all cores.
 
         Returns
         -------
-        ndarray
+        ndarray, shape (n,3)
 
         Notes
         -----
         There are interpolations at place here, which makes this
-        potentially slow for large queries.
+        potentially slow for large queries. The inverse of the reference
+        and the spline coefficients of the warp field are cached, such
+        that only the first call has to pay for them.
         """
-        indices = self.reference.inv().apply(coordinates)
-        newx = map_coordinates(self.warp[...,0], indices.T.reshape(3,-1))
-        newy = map_coordinates(self.warp[...,1], indices.T.reshape(3,-1))
-        newz = map_coordinates(self.warp[...,2], indices.T.reshape(3,-1))
-        return np.vstack((newx, newy, newz)).T
+        indices = self.get_inverse().apply(coordinates)
+        return interpolate(self.get_coefficients(self.warp, dtype),
+                indices.reshape((-1,3)), cores)
 
 class Displacement(Diffeomorphism):
     """
@@ -749,7 +841,8 @@ class Displacement(Diffeomorphism):
         path/which/defined/the/image,}``.
     """
 
-    def __init__(self, reference, displacement, vb=None, nb=None, name=None):
+    def __init__(self, reference, displacement, vb=None, nb=None, name=None,
+            metadata=None):
         assert type(displacement) is np.ndarray, 'displacement must be numpy.ndarray'
         assert 3 == displacement.shape[-1], 'last dimension of displacement must be 3'
 
@@ -774,26 +867,146 @@ class Displacement(Diffeomorphism):
         return self.reference.apply_to_indices(indices) + self.displacement[indices]
 
     # TODO: test this function
-    def apply(self, coordinates):
+    def apply(self, coordinates, dtype=np.float64, cores=1):
         """
         Apply diffeomorphism to the point at given coordinate
 
         Parameters
         ----------
-        index : tuple
-            Should be a tuple of integers
+        coordinates : ndarray, shape (3,) or (n,3)
+            Coordinates in the domain.
+        dtype : dtype
+            Data type in which the displacement field is interpolated.
+        cores : None or int
+            Number of threads among which the points are distributed;
+            if None, use all cores.
 
         Returns
         -------
-        ndarray
+        ndarray, shape (n,3)
 
         Notes
         -----
         There are interpolations at place here, which makes this
-        potentially slow for large queries.
+        potentially slow for large queries. The inverse of the reference
+        and the spline coefficients of the displacement field are
+        cached, such that only the first call has to pay for them.
         """
-        indices = self.reference.inv().apply(coordinates)
-        newx = map_coordinates(self.displacement[...,0], indices.T.reshape(3,-1))
-        newy = map_coordinates(self.displacement[...,1], indices.T.reshape(3,-1))
-        newz = map_coordinates(self.displacement[...,2], indices.T.reshape(3,-1))
-        return coordinates + np.vstack((newx, newy, newz)).T
+        indices = self.get_inverse().apply(coordinates)
+        return np.reshape(coordinates, (-1,3)) + interpolate(
+                self.get_coefficients(self.displacement, dtype),
+                indices.reshape((-1,3)), cores)
+
+########################################################################
+#
+# Interpolation of vector fields
+#
+########################################################################
+
+def interpolate(coefficients, indices, cores=1):
+    """
+    Interpolate a vector field at indices
+
+    All three components are interpolated in a single pass, i.e., the
+    spline weights of a point are calculated once for all components.
+    The result agrees with `map_coordinates` (cubic spline, constant
+    mode) up to rounding errors.
+
+    Parameters
+    ----------
+    coefficients : ndarray, shape (x,y,z,3)
+        Spline coefficients of the components of the vector field (see
+        Diffeomorphism.get_coefficients).
+    indices : ndarray, shape (n,3)
+        Points in the index space of the field.
+    cores : None or int
+        Number of threads among which the points are distributed; if
+        None, use all cores.
+
+    Returns
+    -------
+    ndarray, shape (n,3)
+        The interpolated vector field, in the data type of the
+        coefficients; zero for points outside of the field.
+    """
+    indices = np.ascontiguousarray(indices, dtype=np.float64)
+    n = len(indices)
+    output = np.empty((n,3), dtype=coefficients.dtype)
+
+    def chunk(bounds):
+        lower, upper = bounds
+        interpolate_kernel(coefficients, indices[lower:upper],
+                output[lower:upper])
+
+    if (n > 1) and ((cores is None) or (cores > 1)):
+        size = -(-n // (cpu_count() if cores is None else cores))
+        with ThreadPool(cores) as pool:
+            pool.map(chunk, [(lower, min(lower+size, n))
+                for lower in range(0, n, size)])
+    else:
+        chunk((0, n))
+
+    return output
+
+@jit(nopython=True)
+def mirror(i, n):
+    """
+    Index i reflected into [0,n) at the edges (without repeating the
+    edge)
+    """
+    if n == 1:
+        return 0
+    period = 2*(n-1)
+    i = abs(i) % period
+    if i >= n:
+        return period - i
+    return i
+
+@jit(nopython=True, nogil=True)
+def interpolate_kernel(coefficients, indices, output):
+    """
+    Cubic spline interpolation of the vector field with the given
+    coefficients at indices, written to output
+    """
+    shape = coefficients.shape
+    weights = np.empty((3,4))
+    start = np.empty(3, dtype=np.int64)
+    for p in range(indices.shape[0]):
+        inside = True
+        for a in range(3):
+            x = indices[p,a]
+            if not ((x >= 0) and (x <= shape[a]-1)):
+                inside = False
+                break
+            f = np.floor(x)
+            t = x - f
+            s = 1. - t
+            weights[a,0] = s*s*s / 6.
+            weights[a,1] = (4. - 6.*t*t + 3.*t*t*t) / 6.
+            weights[a,2] = (4. - 6.*s*s + 3.*s*s*s) / 6.
+            weights[a,3] = t*t*t / 6.
+            start[a] = int(f) - 1
+
+        if not inside:
+            output[p,0] = 0.
+            output[p,1] = 0.
+            output[p,2] = 0.
+            continue
+
+        v0 = 0.
+        v1 = 0.
+        v2 = 0.
+        for i in range(4):
+            ii = mirror(start[0]+i, shape[0])
+            for j in range(4):
+                jj = mirror(start[1]+j, shape[1])
+                wij = weights[0,i]*weights[1,j]
+                for k in range(4):
+                    kk = mirror(start[2]+k, shape[2])
+                    w = wij*weights[2,k]
+                    v0 += w*coefficients[ii,jj,kk,0]
+                    v1 += w*coefficients[ii,jj,kk,1]
+                    v2 += w*coefficients[ii,jj,kk,2]
+        output[p,0] = v0
+        output[p,1] = v1
+        output[p,2] = v2
@@ -23,11 +23,89 @@ This module contains methods for foreground detection.
 
 import numpy as np
 
-from skimage import filters
-
 from pandas import DataFrame
 
-def fit_foreground(data, ep):
+from numba import jit
+
+from multiprocessing.dummy import Pool as ThreadPool
+
+def threshold_otsu(images, nbins=256):
+    """
+    Otsu's threshold for each of a stack of images
+
+    Gives the same thresholds as `skimage.filters.threshold_otsu` applied
+    to each image, but builds the histograms of all images in a single
+    compiled pass and evaluates the between-class variances of all
+    images at once.
+
+    Parameters
+    ----------
+    images : ndarray, shape (k,…), dtype: float
+        Stack of k images (without NaN).
+    nbins : int
+        Number of bins used to calculate the histograms.
+
+    Returns
+    -------
+    ndarray, shape (k,)
+        The threshold of each image.
+    """
+    images = np.ascontiguousarray(images, dtype=float).reshape(
+            (len(images),-1))
+    k = len(images)
+
+    first = images.min(axis=1)
+    last  = images.max(axis=1)
+    constant = first == last
+    last  = np.where(constant, first+0.5, last)
+    first = np.where(constant, first-0.5, first)
+
+    # the bins of np.histogram, for all images
+    edges = np.linspace(first, last, nbins+1, endpoint=True, axis=1)
+    counts = histograms(images, edges)
+    centers = (edges[:,:-1] + edges[:,1:]) / 2.0
+
+    # class probabilities and class means for all possible thresholds
+    weight1 = np.cumsum(counts, axis=1)
+    weight2 = np.cumsum(counts[:,::-1], axis=1)[:,::-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean1 = np.cumsum(counts * centers, axis=1) / weight1
+        mean2 = (np.cumsum((counts * centers)[:,::-1], axis=1)
+                / weight2[:,::-1])[:,::-1]
+
+    variance12 = weight1[:,:-1] * weight2[:,1:] \
+            * (mean1[:,:-1] - mean2[:,1:]) ** 2
+
+    thresholds = centers[np.arange(k), np.argmax(variance12, axis=1)]
+    thresholds[constant] = images[constant,0]
+    return thresholds
+
+@jit(nopython=True, nogil=True)
+def histograms(images, edges):
+    """
+    Histogram of each image (row) of images for the given (equally
+    spaced) bin edges, binned exactly as by np.histogram
+    """
+    k, m = images.shape
+    nbins = edges.shape[1] - 1
+    counts = np.zeros((k,nbins), dtype=np.int64)
+    for r in range(k):
+        first = edges[r,0]
+        norm = edges[r,nbins] - first
+        for j in range(m):
+            x = images[r,j]
+            i = int(((x - first) / norm) * nbins)
+            if i == nbins:
+                i -= 1
+            # the index computation may be off by one at the bin edges
+            if x < edges[r,i]:
+                i -= 1
+            if (x >= edges[r,i+1]) and (i != nbins-1):
+                i += 1
+            counts[r,i] += 1
+    return counts
+
+def fit_foreground(data, ep, cores=1):
     """
     Fit foreground
 
@@ -35,6 +113,9 @@ def fit_foreground(data, ep):
     ----------
     data : ndarray, shape (n,a,b,c)
     ep : int
+    cores : None or int
+        Number of threads among which the scan cycles are distributed;
+        if None, use all cores.
 
     Returns
     -------
@@ -58,10 +139,21 @@ def fit_foreground(data, ep):
     ct = np.zeros(cn)
     pt = np.zeros((pn,cn))
 
-    for c in range(cn):
-        ct[c] = filters.threshold_otsu(dat[c])
-        for p in range(pn):
-            pt[p,c] = filters.threshold_otsu(dat[c,p])
+    # the histograms of a chunk of scan cycles are built at once
+    chunk = max(1, 2**24 // max(dat[0].size, 1))
+
+    def thresholds(c):
+        ct[c:c+chunk] = threshold_otsu(dat[c:c+chunk])
+        pt[:,c:c+chunk] = threshold_otsu(
+                dat[c:c+chunk].reshape((-1,) + dat.shape[2:])
+                ).reshape((-1,pn)).T
+
+    if (cn > chunk) and ((cores is None) or (cores > 1)):
+        with ThreadPool(cores) as pool:
+            pool.map(thresholds, range(0, cn, chunk))
+    else:
+        for c in range(0, cn, chunk):
+            thresholds(c)
 
     dat = np.moveaxis(dat, (0,1), (-1,-2))
     msk = (dat < ct) | (dat < pt)
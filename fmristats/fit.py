@@ -23,14 +23,29 @@ Fit signal model to signal data
 
 """
 
+from .neighbours import CellIndex, ScannerIndex, cell_query, \
+        scanner_query
+
+from .observations import Observations
+
+from .lazy import resolve
+
 import time
 
-from numba import jit, njit
+import os
+
+import hashlib
+
+from numba import jit, njit, prange, config, set_num_threads
 
 import numpy as np
 
 from numpy.linalg import solve, inv
 
+from scipy.ndimage import map_coordinates
+
+from scipy.signal import fftconvolve
+
 from pandas import DataFrame
 
 import statsmodels.api as sm
@@ -41,12 +56,39 @@ from statsmodels.stats.stattools import durbin_watson
 
 ########################################################################
 
-def design_AT(coordinate, data, design, scale:float, radius:float):
-    r = radius**2
+def neighbourhood(coordinate, data, radius:float, index=None):
+    """
+    Observations in the neighbourhood of a coordinate
+
+    Parameters
+    ----------
+    coordinate : ndarray, shape (3,)
+    data : ndarray, shape (…,9), dtype: float
+        The array of observations.
+    radius : float
+    index : None or CellIndex
+        A spatial index over the coordinates of the observations. If
+        None, the squared distances to all observations are computed.
+
+    Returns
+    -------
+    valid : ndarray, dtype: int
+        Indices of the observations within radius of the coordinate.
+    squared_distances : ndarray, dtype: float
+        Their squared distances to the coordinate.
+    """
+    if index is None:
+        squared_distances = ((data[...,:3] - coordinate)**2).sum(axis=1)
+        valid, = np.where(squared_distances < radius**2)
+        return valid, squared_distances[valid]
+    else:
+        return index.query(coordinate, radius)
+
+def design_AT(coordinate, data, design, scale:float, radius:float,
+        index=None):
     s = -2*scale**2
-    squared_distances = ((data[...,:3] - coordinate)**2).sum(axis=1)
-    valid = np.where(squared_distances < r)
-    weights = np.exp(squared_distances[valid] / s)
+    valid, squared_distances = neighbourhood(coordinate, data, radius, index)
+    weights = np.exp(squared_distances / s)
     data = data[valid]
     design = design[valid]
     return data, design, weights
@@ -65,12 +107,11 @@ def fit_AT(hasconst, **kwargs):
 
 ########################################################################
 
-def data_at(coordinate, data, epi_code:int, scale:float, radius:float):
-    r = radius**2
+def data_at(coordinate, data, epi_code:int, scale:float, radius:float,
+        index=None):
     s = -2*scale**2
-    squared_distances = ((data[...,:3] - coordinate)**2).sum(axis=1)
-    valid = np.where(squared_distances < r)
-    weights = np.exp(squared_distances[valid] / s)
+    valid, squared_distances = neighbourhood(coordinate, data, radius, index)
+    weights = np.exp(squared_distances / s)
     data = data[valid]
 
     df = DataFrame({
@@ -121,7 +162,9 @@ def extract_field(field, param, value, parameter_dict, value_dict):
     return field[..., value_dict[value], parameter_dict[param]]
 
 def fit_field(coordinates, mask, data, design, epi_code:int,
-        scale:float, radius:float, verbose=True, backend='numba'):
+        scale:float, radius:float, verbose=True, backend='numba',
+        index=None, cores=None, solver='pinv', return_fallback=False,
+        codes=None, checkpoint=None, interval=600):
     """
     Parameters
     ----------
@@ -132,8 +175,9 @@ def fit_field(coordinates, mask, data, design, epi_code:int,
         A boolean array of the same »layout« as coordinates. The first
         dimensions must match the dimensions of coordinates. If None,
         the model is fitted at all coordinates.
-    data : ndarray, shape (…,9), dtype: float
-        The array of observations:
+    data : Observations or ndarray, shape (…,9) or (n,x,y,z)
+        The observations; either an Observations store or the array of
+        observations:
             - [...,:3] = coordinates of observation
             - [..., 3] = MR signal response
             - [..., 4] = time of observation
@@ -141,12 +185,72 @@ def fit_field(coordinates, mask, data, design, epi_code:int,
             - [..., 6] = block number during time of observation
             - [..., 7] = scan cycle
             - [..., 8] = slice number
+        If index is a ScannerIndex, data is instead the MR signal on
+        the acquisition lattice of the n scan cycles, e.g. the data
+        array of the Session.
     design : ndarray, shape (…,p), dtype: float
-        The design matrix.
+        The design matrix. If codes is given, the distinct rows of the
+        design matrix.
     epi_code : int
     scale : float
     radius : float
     verbose : bool
+    index : None or CellIndex or ScannerIndex
+        An index of the observations. A CellIndex is a spatial index
+        over the coordinates of the observations in data. If None, it
+        will be created. A ScannerIndex finds the observations in the
+        index space of each scan cycle, such that no coordinates of
+        observations need to be stored at all.
+    backend : str
+        One of numba (or jit), parallel, convolution, or statsmodels.
+        The parallel backend distributes the coordinates over multiple
+        threads. The convolution backend is approximate: it
+        convolves sufficient statistics on a grid, and its estimates
+        (in particular standard errors, error variances, and degrees of
+        freedom) differ from those of the exact backends (see
+        fit_field_by_convolution).
+    cores : None or int
+        Number of threads used by the parallel backend. If None, all
+        threads available to Numba are used.
+    solver : str
+        Either pinv (default) or cholesky. The solver pinv computes the
+        Moore-Penrose pseudo-inverse of the weighted design matrix. The
+        solver cholesky solves the p×p weighted normal equations by a
+        Cholesky decomposition, and falls back to the pseudo-inverse
+        only if the normal equations are ill-conditioned.
+    return_fallback : bool
+        If True, also return a boolean field which is True at
+        coordinates where the solver fell back to the pseudo-inverse.
+    codes : None or ndarray, shape (…,), dtype: int
+        For each observation, the row of the design matrix in design.
+        Rows of the design are only expanded for the observations in the
+        neighbourhood of a coordinate when fitting at this coordinate.
+    checkpoint : None or str
+        If given, the fits of the coordinates done so far are saved to
+        this file (in npz format) every interval seconds. If the file
+        exists when calling fit_field and belongs to the same fit (same
+        coordinates, mask, design, hyperparameters, and number of
+        observations), the fit continues from where it stopped. The file
+        is removed when the fit is complete.
+    interval : float
+        Seconds between two checkpoints.
+
+    Returns
+    -------
+    params : ndarray, shape (…,p)
+    cov_params : ndarray, shape (…,p,p)
+    mse : ndarray, shape (…,2)
+        The estimated error variance and the residual degrees of
+        freedom.
+    fallback : ndarray, shape (…), dtype: bool
+        Only returned if return_fallback is True.
+
+    Notes
+    -----
+    Each coordinate is fitted independently of all others, and the
+    parallel backend only changes which thread fits which coordinate.
+    The fitted fields are therefore bit-identical for any number of
+    threads.
     """
 
     ###################################################################
@@ -155,9 +259,56 @@ def fit_field(coordinates, mask, data, design, epi_code:int,
 
     assert coordinates.shape[:-1] == mask.shape, \
             'shapes of coordinates and mask do not match'
-    assert data.shape[:-1] == design.shape[:-1], \
-            'shapes of data and design do not match'
+
+    # attributes of a lazily loaded signal model may still be proxies
+    data = resolve(data)
+    index = resolve(index)
+
+    if codes is None:
+        codes = np.arange(design.shape[0])
+    else:
+        assert codes.max() < design.shape[0], \
+                'codes do not match the rows of the design'
+    if type(data) is Observations:
+        assert data.n == codes.shape[0], \
+                'shapes of data and design do not match'
+    elif type(index) is ScannerIndex:
+        assert data.shape == index.rows.shape, \
+                'shapes of data and index do not match'
+    else:
+        assert data.shape[:-1] == codes.shape, \
+                'shapes of data and design do not match'
     assert epi_code in [-3,-2,-1,1,2,3], 'epi_code must be within [-3,3] but not 0'
+    assert solver in ['pinv', 'cholesky'], 'solver must be pinv or cholesky'
+
+    ###################################################################
+    # Sufficient statistics backend
+    ###################################################################
+
+    if backend == 'convolution':
+        if type(index) is CellIndex:
+            points = index.points
+        elif type(data) is Observations:
+            points = data.coordinates()
+        else:
+            assert type(index) is not ScannerIndex, \
+                    'the convolution backend needs coordinates of observations'
+            points = data.reshape((-1,data.shape[-1]))[:,:3]
+
+        if type(data) is Observations:
+            signal = data.signal
+        else:
+            signal = data.reshape((-1,data.shape[-1]))[:,3]
+
+        params, cov_params, mse = fit_field_by_convolution(
+                coordinates, mask, points, signal, design, scale, radius,
+                codes=codes)
+
+        if return_fallback:
+            return params, cov_params, mse, \
+                    np.zeros(coordinates.shape[:-1], dtype=bool)
+        else:
+            return params, cov_params, mse
 
     ###################################################################
     # In case you need the Durbin-Watson statistics
@@ -191,6 +342,8 @@ def fit_field(coordinates, mask, data, design, epi_code:int,
     cov_params [...] = np.nan
     mse        [...] = np.nan
 
+    fallback   = np.zeros(coordinates.shape[:-1], dtype=bool)
+
     ###################################################################
     # Reshape
     ###################################################################
@@ -199,20 +352,161 @@ def fit_field(coordinates, mask, data, design, epi_code:int,
     rparams      = params.reshape((-1,p))
     rcov_params  = cov_params.reshape((-1,p,p))
     rmse         = mse.reshape((-1,2))
+    rfallback    = fallback.reshape((-1,))
 
     if mask is None:
         to_fit = np.ones(rcoordinates.shape[0]).astype(bool)
     else:
         to_fit = mask.reshape((-1,))
 
+    # only hand the coordinates to fit to the backend, such that threads
+    # receive a balanced share of the work
+    to_fit, = np.where(to_fit)
+
+    ###################################################################
+    # Spatial index of the observations
+    ###################################################################
+
+    if index is None:
+        if type(data) is Observations:
+            index = CellIndex(data.coordinates(), width=radius)
+        else:
+            index = CellIndex(data, width=radius)
+
+    assert index.n == codes.shape[0], \
+            'index does not match the number of observations'
+
+    # the signal of the observations in the order of the rows of the
+    # design matrix
+    if type(data) is Observations:
+        signal = data.signal
+    elif type(index) is ScannerIndex:
+        signal = data[index.rows >= 0]
+    else:
+        signal = data.reshape((-1,data.shape[-1]))[:,3]
+
     ###################################################################
     # Fit the model
     ###################################################################
 
-    fit_nb(rcoordinates, rparams, rcov_params, rmse, to_fit, data,
-            design, r, s)
+    parallel = backend == 'parallel'
 
-    return params, cov_params, mse
+    if parallel and (cores is not None):
+        set_num_threads(max(1, min(cores, config.NUMBA_NUM_THREADS)))
+
+    if type(index) is ScannerIndex:
+        kernel = fit_scanner_nb_parallel if parallel else fit_scanner_nb
+        arguments = (signal, design, codes, r, s, solver == 'cholesky') \
+                + index.arrays()
+    else:
+        kernel = fit_nb_parallel if parallel else fit_nb
+        arguments = (index.points, signal, design, codes, r, s,
+                solver == 'cholesky') + index.arrays()
+
+    if checkpoint is None:
+        kernel(rcoordinates, rparams, rcov_params, rmse, rfallback,
+                to_fit, *arguments)
+    else:
+        fingerprint = checkpoint_fingerprint(coordinates, mask, design,
+                codes, scale=scale, radius=radius, solver=solver,
+                engine=type(index).__name__, n=len(signal))
+
+        done = load_checkpoint(checkpoint, fingerprint, to_fit, rparams,
+                rcov_params, rmse, rfallback)
+
+        if verbose and done > 0:
+            print('Resume from checkpoint: {:,d} of {:,d} coordinates done'.format(
+                done, len(to_fit)))
+
+        saved = time.time()
+        for start in range(done, len(to_fit), CHECKPOINT_BLOCK):
+            stop = min(start + CHECKPOINT_BLOCK, len(to_fit))
+            kernel(rcoordinates, rparams, rcov_params, rmse, rfallback,
+                    to_fit[start:stop], *arguments)
+            if (time.time() - saved > interval) and (stop < len(to_fit)):
+                save_checkpoint(checkpoint, fingerprint, stop, to_fit,
+                        rparams, rcov_params, rmse, rfallback)
+                saved = time.time()
+
+        if os.path.isfile(checkpoint):
+            os.remove(checkpoint)
+
+    if return_fallback:
+        return params, cov_params, mse, fallback
+    else:
+        return params, cov_params, mse
+
+###################################################################
+# Checkpoints
+###################################################################
+
+# Number of coordinates which are fitted between two looks at the clock
+CHECKPOINT_BLOCK = 4096
+
+def checkpoint_fingerprint(*arrays, **values):
+    """
+    Fingerprint of a fit
+
+    Returns
+    -------
+    str
+        A hash of the arrays and values.
+    """
+    fingerprint = hashlib.sha1()
+    for array in arrays:
+        if array is not None:
+            fingerprint.update(np.ascontiguousarray(array).tobytes())
+    fingerprint.update(repr(sorted(values.items())).encode())
+    return fingerprint.hexdigest()
+
+def save_checkpoint(file, fingerprint, done, to_fit, rparams, rcov_params,
+        rmse, rfallback):
+    """
+    Save the fits of the first done coordinates in to_fit to file
+
+    The file is replaced atomically, such that it is never left behind
+    half written.
+    """
+    fitted = to_fit[:done]
+    temporary = file + '.tmp'
+    with open(temporary, 'wb') as output:
+        np.savez(output,
+                fingerprint = fingerprint,
+                done        = done,
+                params      = rparams[fitted],
+                cov_params  = rcov_params[fitted],
+                mse         = rmse[fitted],
+                fallback    = rfallback[fitted])
+    os.replace(temporary, file)
+
+def load_checkpoint(file, fingerprint, to_fit, rparams, rcov_params, rmse,
+        rfallback):
+    """
+    Load the fits of a checkpoint into the fields
+
+    Returns
+    -------
+    int
+        The number of coordinates in to_fit which have been done, 0 if
+        there is no matching checkpoint in file.
+    """
+    if not os.path.isfile(file):
+        return 0
+
+    try:
+        with np.load(file) as checkpoint:
+            if str(checkpoint['fingerprint']) != fingerprint:
+                return 0
+            done = int(checkpoint['done'])
+            fitted = to_fit[:done]
+            rparams     [fitted] = checkpoint['params']
+            rcov_params [fitted] = checkpoint['cov_params']
+            rmse        [fitted] = checkpoint['mse']
+            rfallback   [fitted] = checkpoint['fallback']
+    except (OSError, ValueError, KeyError):
+        return 0
+
+    return done
 
 ###################################################################
 # Backend
@@ -235,21 +529,509 @@ def penrose_fit(endog, exog, weights):
     cov_params    = mse * np.dot(pinv_wexog, np.transpose(pinv_wexog))
     return params, cov_params, mse, df_resid
 
-@jit(nopython=True, fastmath=True) #, parallel=True)
-def fit_nb(rcoordinates:np.array, rparams:np.array,
-        rcov_params:np.array, rmse:np.array, to_fit:np.array,
-        data:np.array, design:np.array, r:float, s:float):
-    for i in range(rcoordinates.shape[0]):
-        if to_fit[i]:
-            squared_distances = ((data[...,:3] - rcoordinates[i])**2).sum(axis=1)
-            valid = np.where(squared_distances < r)
-            weights = np.exp(squared_distances[valid] / s)
-            endog   = data[valid][...,3]
-            exog    = design[valid]
-            n = exog.shape[0]
-            p = exog.shape[1]
-            if (p < n-1) and (np.linalg.matrix_rank(exog) == p):
-                params, cov_params, mse, df_resid = penrose_fit(endog, exog, weights)
+# Smallest admissible ratio of the smallest to the largest eigenvalue of
+# the equilibrated normal equations. This corresponds to a condition
+# number of the weighted design matrix of about 10^5.
+RCOND_NORMAL = 1e-10
+
+@jit(nopython=True)
+def cholesky_fit(endog, exog, weights):
+    """
+    Solve the weighted normal equations by a Cholesky decomposition
+
+    Returns None if the (equilibrated) normal equations are
+    ill-conditioned, in which case the caller should fall back to
+    penrose_fit.
+    """
+    p             = exog.shape[1]
+    endog         = np.ascontiguousarray(endog)
+    wexog         = weights.reshape((-1,1)) * exog
+    xtwx          = np.dot(np.ascontiguousarray(exog.T), wexog)
+    xtwy          = np.dot(endog, wexog)
+    # equilibrate, such that the check does not depend on the units of
+    # the columns in the design matrix
+    d             = np.sqrt(np.diag(xtwx))
+    if (d <= 0).any():
+        return None
+    a             = xtwx / d.reshape((-1,1)) / d.reshape((1,-1))
+    eigenvalues   = np.linalg.eigvalsh(a)
+    if eigenvalues[0] <= RCOND_NORMAL * eigenvalues[-1]:
+        return None
+    # calculation
+    chol          = np.linalg.cholesky(a)
+    chol_inv      = np.linalg.solve(chol, np.eye(p))
+    a_inv         = np.dot(chol_inv.T, chol_inv)
+    xtwx_inv      = a_inv / d.reshape((-1,1)) / d.reshape((1,-1))
+    params        = np.dot(xtwx_inv, xtwy)
+    resid         = endog - exog.dot(params)
+    df_resid      = exog.shape[0] - p
+    mse           = np.dot(weights * resid, resid) / df_resid
+    # variances, covariances, and standard errors
+    cov_params    = mse * xtwx_inv
+    return params, cov_params, mse, df_resid
+
+@jit(nopython=True)
+def fit_voxel(i, endog, exog, weights, normal, rparams, rcov_params,
+        rmse, rfallback):
+    """
+    Fit the model to the observations in the neighbourhood of the i-th
+    coordinate and store the result in the i-th slot of the fields
+    """
+    n = exog.shape[0]
+    p = exog.shape[1]
+    if p < n-1:
+        if normal:
+            fit = cholesky_fit(endog, exog, weights)
+            if fit is not None:
+                params, cov_params, mse, df_resid = fit
                 rparams[i] = params
                 rcov_params[i] = cov_params
                 rmse[i] = mse, float(df_resid)
+                return
+            rfallback[i] = True
+        if np.linalg.matrix_rank(exog) == p:
+            params, cov_params, mse, df_resid = penrose_fit(endog, exog, weights)
+            rparams[i] = params
+            rcov_params[i] = cov_params
+            rmse[i] = mse, float(df_resid)
+
+def fit_kernel(rcoordinates:np.array, rparams:np.array,
+        rcov_params:np.array, rmse:np.array, rfallback:np.array,
+        to_fit:np.array, points:np.array, signal:np.array,
+        design:np.array, codes:np.array, r:float, s:float, normal:bool,
+        origin:np.array, width:float, shape:np.array,
+        offsets:np.array, order:np.array):
+    for l in prange(to_fit.shape[0]):
+        i = to_fit[l]
+        valid, squared_distances = cell_query(rcoordinates[i],
+                points, origin, width, shape, offsets, order, r)
+        weights = np.exp(squared_distances / s)
+        endog   = signal[valid].astype(np.float64)
+        exog    = design[codes[valid]]
+        fit_voxel(i, endog, exog, weights, normal, rparams,
+                rcov_params, rmse, rfallback)
+
+def fit_scanner_kernel(rcoordinates:np.array, rparams:np.array,
+        rcov_params:np.array, rmse:np.array, rfallback:np.array,
+        to_fit:np.array, signal:np.array, design:np.array,
+        codes:np.array, r:float, s:float, normal:bool, rows:np.array,
+        affines:np.array, inverses:np.array):
+    for l in prange(to_fit.shape[0]):
+        i = to_fit[l]
+        valid, squared_distances, positions = scanner_query(
+                rcoordinates[i], rows, affines, inverses, r)
+        weights = np.exp(squared_distances / s)
+        endog   = signal[valid].astype(np.float64)
+        exog    = design[codes[valid]]
+        fit_voxel(i, endog, exog, weights, normal, rparams,
+                rcov_params, rmse, rfallback)
+
+fit_nb = jit(nopython=True, fastmath=True)(fit_kernel)
+
+fit_nb_parallel = jit(nopython=True, fastmath=True, parallel=True)(fit_kernel)
+
+fit_scanner_nb = jit(nopython=True, fastmath=True)(fit_scanner_kernel)
+
+fit_scanner_nb_parallel = jit(nopython=True, fastmath=True,
+        parallel=True)(fit_scanner_kernel)
+
+###################################################################
+# Sufficient statistics backend
+###################################################################
+
+def convolution_error_bound(scale:float, radius:float, width=None):
+    """
+    Bound on the error of the weights of the convolution backend
+
+    Parameters
+    ----------
+    scale : float
+        Scale of the Gaussian kernel.
+    radius : float
+        Radius at which the Gaussian kernel is truncated.
+    width : None or float
+        Width of the cells of the auxiliary grid. Defaults to scale/4.
+
+    Returns
+    -------
+    float
+        Upper bound on |w̃ - w| for the weight w̃ which the convolution
+        backend gives to any observation (at any coordinate) compared to
+        the exact weight w of the observation, where 0 ≤ w ≤ 1.
+
+    Notes
+    -----
+    This only bounds the discretisation of the kernel weights. It is
+    not a bound on the error of the estimated parameters, covariances,
+    or error variances, which depends on the data and may be much
+    larger than the error of the weights (see
+    fit_field_by_convolution).
+
+    The convolution backend distributes each observation to the eight
+    surrounding points of the auxiliary grid by trilinear weights,
+    convolves with the Gaussian kernel on the grid, and interpolates
+    trilinearly at the coordinate. The effective weight of an
+    observation is thus the kernel interpolated trilinearly twice, once
+    in the position of the observation and once in the position of the
+    coordinate. The error of trilinear interpolation of a function f is
+    at most width²/8 ⋅ max(|f_xx| + |f_yy| + |f_zz|), and for the
+    Gaussian kernel exp(-|d|²/(2⋅scale²)) the latter maximum is
+    3/scale². Both interpolations together contribute at most
+    3⋅width²/(4⋅scale²).
+
+    The kernel is truncated at the ball of the given radius, as the
+    neighbourhoods of the exact fit. As the interpolations mix grid
+    points inside and outside of this ball, observations close to the
+    sphere of this radius obtain a weight of at most
+    exp(-radius²/(2⋅scale²)) which they should not have (or lose one
+    which they should have).
+
+    As the effective weights are non-negative (up to rounding), the
+    backend computes an exact weighted least squares fit for slightly
+    different weights. In particular, the estimated error variance is
+    never negative.
+    """
+    if width is None:
+        width = scale / 4
+
+    return 3 * width**2 / (4 * scale**2) + np.exp(radius**2 / (-2*scale**2))
+
+# Number of float64 arrays of the size of the auxiliary grid (padded by
+# the kernel) which the convolution backend holds at most at once: the
+# scattered and the convolved field, and the padded fields and spectra
+# of the FFT convolution.
+CONVOLUTION_GRID_ARRAYS = 8
+
+def available_memory():
+    """
+    Available physical memory in bytes
+
+    Returns
+    -------
+    None or int
+        None if the available memory cannot be determined on this
+        platform.
+    """
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+class ConvolutionGrid:
+    """
+    Auxiliary grid of the convolution backend
+
+    Kernel weighted sums Σ w(c,pᵢ)⋅vᵢ of per-observation values vᵢ are
+    obtained for all coordinates c at once by scattering the values onto
+    a regular grid (trilinearly), convolving them with the Gaussian
+    kernel truncated at the ball of the given radius, and interpolating
+    the result at the coordinates (trilinearly). Up to the two
+    interpolations, the weights w(c,p) are those of the exact fit,
+    exp(-|c-p|²/(2⋅scale²)) for |c-p| < radius and 0 otherwise (see
+    convolution_error_bound).
+
+    Parameters
+    ----------
+    coordinates : ndarray, shape (k,3), dtype: float
+        The coordinates at which the sums are needed.
+    points : ndarray, shape (n,3), dtype: float
+        The coordinates of the observations. Observations which are
+        not within radius of the bounding box of the coordinates never
+        enter a sum.
+    scale : float
+    radius : float
+    width : None or float
+        Width of the cells of the grid. Defaults to scale/4.
+
+    Raises
+    ------
+    MemoryError
+        If the grid would not fit into the available memory. The grid
+        covers the bounding box of the coordinates in cells of the given
+        width, so use fewer coordinates (or a larger width).
+    """
+    def __init__(self, coordinates, points, scale:float, radius:float,
+            width=None):
+        if width is None:
+            width = scale / 4
+
+        assert width > 0, 'width must be strictly positive'
+
+        margin = radius + 2*width
+        origin = coordinates.min(axis=0) - margin
+        shape = (np.ceil((coordinates.max(axis=0) + margin - origin) / width)
+                + 2).astype(int)
+
+        m = int(np.ceil(radius / width))
+
+        # fail before allocating a grid which does not fit into memory
+        needed = CONVOLUTION_GRID_ARRAYS * 8 * np.prod(shape + 2*m,
+                dtype=float)
+        available = available_memory()
+        if available is not None and needed > available:
+            raise MemoryError(
+                    'the auxiliary grid of the convolution backend ({} cells) '
+                    'needs about {:.1f} GB, but only {:.1f} GB are available'
+                    .format('×'.join(str(d) for d in shape), needed / 1024**3,
+                        available / 1024**3))
+
+        strides = np.array([shape[1]*shape[2], shape[2], 1])
+
+        u = (points - origin) / width
+        with np.errstate(invalid='ignore'):
+            base = np.floor(u)
+            inside = np.isfinite(u).all(axis=-1) & (base >= 0).all(axis=-1) \
+                    & (base <= shape - 2).all(axis=-1)
+
+        base = base[inside].astype(np.int64)
+
+        # the kernel is truncated at the ball, as the neighbourhoods of
+        # the exact fit
+        t = np.arange(-m, m+1) * width
+        squared_distances = t[:,None,None]**2 + t[None,:,None]**2 \
+                + t[None,None,:]**2
+        ball = squared_distances < radius**2
+
+        self.scale     = scale
+        self.radius    = radius
+        self.width     = width
+        self.origin    = origin
+        self.shape     = shape
+        self.strides   = strides
+        self.inside    = inside
+        self.flat      = base.dot(strides)
+        self.frac      = u[inside] - base
+        self.positions = ((coordinates - origin) / width).T
+        self.ball      = ball.astype(float)
+        self.kernel    = np.where(ball,
+                np.exp(squared_distances / (-2*scale**2)), 0)
+
+    def scatter(self, values, selection=None):
+        """
+        Distribute values of the observations onto the grid
+
+        Parameters
+        ----------
+        values : ndarray, shape (n,)
+            A value for each observation.
+        selection : None or ndarray, shape (n,), dtype: bool
+            If given, only the values of these observations.
+
+        Returns
+        -------
+        ndarray
+            The field on the grid.
+        """
+        values = values[self.inside]
+        flat, frac = self.flat, self.frac
+        if selection is not None:
+            selection = selection[self.inside]
+            flat, frac, values = flat[selection], frac[selection], \
+                    values[selection]
+        field = np.zeros(self.shape.prod())
+        for corner in np.ndindex(2,2,2):
+            corner = np.array(corner)
+            weights = values * np.where(corner, frac, 1-frac).prod(axis=-1)
+            field += np.bincount(flat + corner.dot(self.strides),
+                    weights=weights, minlength=field.size)
+        return field.reshape(self.shape)
+
+    def gather(self, field):
+        """
+        Interpolate a field on the grid at the coordinates
+        """
+        return map_coordinates(field, self.positions, order=1,
+                mode='nearest')
+
+    def sums(self, values, selection=None):
+        """
+        Kernel weighted sums of values at the coordinates
+
+        Parameters
+        ----------
+        values : ndarray, shape (n,)
+            A value for each observation.
+        selection : None or ndarray, shape (n,), dtype: bool
+            If given, only sum over these observations.
+
+        Returns
+        -------
+        ndarray, shape (k,)
+        """
+        return self.gather(fftconvolve(self.scatter(values, selection),
+            self.kernel, mode='same'))
+
+    def count(self):
+        """
+        Number of observations in the neighbourhood of the coordinates
+
+        Returns
+        -------
+        ndarray, shape (k,)
+            The number of observations within radius of each coordinate
+            (up to the interpolations).
+        """
+        ones = np.ones(len(self.inside))
+        return np.round(self.gather(fftconvolve(self.scatter(ones),
+            self.ball, mode='same')))
+
+def fit_field_by_convolution(coordinates, mask, points, signal, design,
+        scale:float, radius:float, codes=None, width=None):
+    """
+    Approximate the fit of the signal model by convolution
+
+    The weighted least squares fit at a coordinate only depends on the
+    kernel weighted sums of x⋅xᵀ, x⋅y, and y² over the observations in
+    its neighbourhood (and on the number of these observations). These
+    sums are obtained for all coordinates at once on an auxiliary grid
+    (see ConvolutionGrid).
+
+    Parameters
+    ----------
+    coordinates : ndarray, shape (…,3)
+        The coordinates at which the models shall be fitted.
+    mask : None or ndarray, shape (…)
+        If not None, the model is only fitted where mask is True.
+    points : ndarray, shape (n,3), dtype: float
+        The coordinates of the observations.
+    signal : ndarray, shape (n,), dtype: float
+        The MR signal of the observations.
+    design : ndarray, shape (…,p), dtype: float
+        The design matrix. If codes is given, the distinct rows of the
+        design matrix.
+    scale : float
+    radius : float
+    codes : None or ndarray, shape (n,), dtype: int
+        For each observation, the row of the design matrix in design.
+    width : None or float
+        Width of the cells of the auxiliary grid. Defaults to scale/4,
+        for which the weights are off by at most 0.06 (at a radius of
+        three times the scale).
+
+    Returns
+    -------
+    params : ndarray, shape (…,p)
+    cov_params : ndarray, shape (…,p,p)
+    mse : ndarray, shape (…,2)
+
+    Raises
+    ------
+    MemoryError
+        If the auxiliary grid would not fit into the available memory.
+
+    Notes
+    -----
+    If the design has only few distinct rows (as for the default design
+    of intercept, task, and blocks), the sums are accumulated per
+    distinct row, which needs three convolutions per row. Otherwise one
+    convolution per entry of x⋅xᵀ and x⋅y is needed.
+
+    The kernel has the support of the exact fit (the ball of the given
+    radius), and the weights w̃ which the backend gives to the
+    observations differ from the exact weights w by at most
+    convolution_error_bound. As the weights w̃ are non-negative, the
+    estimates are those of the exact weighted least squares fit with
+    weights w̃, and differ from those of the exact backends (numba,
+    parallel, and statsmodels) by
+
+        β̃ - β = (Xᵀ⋅W̃⋅X)⁻¹ ⋅ Xᵀ⋅(W̃ - W)⋅r,
+
+    where r are the residuals of the exact fit. This difference is not
+    bounded by the error of the weights alone, but also depends on the
+    residuals, i.e. on the data. The residual degrees of freedom are
+    derived from an interpolated count of the observations in the
+    neighbourhood. Compared to the numba backend at the default width:
+
+        - on data of homogeneous variance, the parameters differ by up
+          to a sixth of their standard error, the standard errors by up
+          to 3%, the error variance by up to 5%, and the residual
+          degrees of freedom by up to 5%;
+        - close to sharp edges of the signal (e.g. at the boundary of
+          the brain), where few observations with large residuals
+          dominate the fit, the parameters differ by up to a tenth of
+          their standard error, the error variance by up to 10%, but
+          the standard errors by up to 30% and the residual degrees of
+          freedom by up to 8%.
+
+    Use the convolution backend for a fast preview, and an exact backend
+    for inference. Coordinates at which the (equilibrated) normal
+    equations are ill-conditioned are not fitted.
+    """
+    p = design.shape[-1]
+
+    params     = np.full(coordinates.shape[:-1] + (p,), np.nan)
+    cov_params = np.full(coordinates.shape[:-1] + (p, p), np.nan)
+    mse        = np.full(coordinates.shape[:-1] + (2,), np.nan)
+
+    rcoordinates = coordinates.reshape((-1,3))
+    if mask is None:
+        to_fit, = np.where(np.isfinite(rcoordinates).all(axis=-1))
+    else:
+        to_fit, = np.where(mask.reshape((-1,)))
+
+    if len(to_fit) == 0:
+        return params, cov_params, mse
+
+    grid = ConvolutionGrid(rcoordinates[to_fit], points, scale, radius,
+            width)
+
+    y = np.asarray(signal, dtype=float)
+    if codes is None:
+        codes = np.arange(len(design))
+
+    ###################################################################
+    # Sufficient statistics at the coordinates
+    ###################################################################
+
+    k = len(to_fit)
+    xtwx = np.zeros((k,p,p))
+    xtwy = np.zeros((k,p))
+    ytwy = np.zeros(k)
+
+    ones = np.ones(len(y))
+
+    if len(design) <= p*(p+3)//2:
+        for c, row in enumerate(design):
+            selection = codes == c
+            if not selection[grid.inside].any():
+                continue
+            xtwx += grid.sums(ones, selection)[:,None,None] \
+                    * np.outer(row, row)
+            xtwy += grid.sums(y, selection)[:,None] * row
+            ytwy += grid.sums(y*y, selection)
+    else:
+        exog = design[codes]
+        for j in range(p):
+            for l in range(j, p):
+                xtwx[:,j,l] = grid.sums(exog[:,j]*exog[:,l])
+                xtwx[:,l,j] = xtwx[:,j,l]
+            xtwy[:,j] = grid.sums(exog[:,j]*y)
+        ytwy = grid.sums(y*y)
+
+    count = grid.count()
+
+    ###################################################################
+    # Solve the normal equations
+    ###################################################################
+
+    d = np.sqrt(np.maximum(np.diagonal(xtwx, axis1=1, axis2=2), 0))
+    valid = (count > p + 1) & (d > 0).all(axis=-1)
+
+    d = d[valid]
+    a = xtwx[valid] / d[:,:,None] / d[:,None,:]
+    eigenvalues = np.linalg.eigvalsh(a)
+    well = eigenvalues[:,0] > RCOND_NORMAL * eigenvalues[:,-1]
+    valid[valid] = well
+
+    xtwx_inv = inv(a[well]) / d[well,:,None] / d[well,None,:]
+    xtwy = xtwy[valid]
+    rparams = np.einsum('...ij,...j', xtwx_inv, xtwy)
+    df_resid = count[valid] - p
+    rmse = np.maximum(ytwy[valid] - (rparams * xtwy).sum(axis=-1), 0) / df_resid
+
+    fitted = to_fit[valid]
+    params.reshape((-1,p))[fitted] = rparams
+    cov_params.reshape((-1,p,p))[fitted] = rmse[:,None,None] * xtwx_inv
+    mse.reshape((-1,2))[fitted] = np.stack((rmse, df_resid), axis=-1)
+
+    return params, cov_params, mse
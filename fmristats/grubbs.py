@@ -23,6 +23,8 @@ Methods for outlier detection.
 
 """
 
+from functools import lru_cache
+
 import numpy as np
 
 from scipy.stats.distributions import t
@@ -62,28 +64,172 @@ def grubbs_test(xvec, sgnf, null='equal'):
     else:
         return None
 
+@lru_cache(maxsize=None)
+def esd_critical_values(n, sgnf):
+    """
+    Critical values of the generalized ESD test
+
+    Parameters
+    ----------
+    n : int
+        Number of (non-missing) sample values.
+    sgnf : float
+        Level of significance for the test.
+
+    Returns
+    -------
+    ndarray, shape (max(n-6,0),)
+        The critical value for the i-th most extreme value (i=1,…),
+        i.e. the critical value of Grubbs' test for the sample of the
+        n-i+1 remaining values. At least 7 values must remain.
+
+    Notes
+    -----
+    Results are cached for each combination of n and sgnf. The returned
+    array must not be modified.
+    """
+    m = n - np.arange(max(n-6,0))
+    tstat = t.ppf(q=1-(sgnf / (2*m)), df=m-2)**2
+    crval = ((m-1)/np.sqrt(m)) * np.sqrt(tstat / (m-2+tstat))
+    crval.setflags(write=False)
+    return crval
+
+def generalized_esd(x, sgnf, max_outliers=None):
+    """
+    The generalized ESD test for outlier detection
+
+    Tests for up to `max_outliers` outliers in each column of x.
+
+    Parameters
+    ----------
+    x : ndarray, shape (n,) or (n,k)
+        Array of sample values (k samples of size n).
+    sgnf : float
+        Level of significance for the test.
+    max_outliers : None or int
+        Upper bound for the number of outliers. If None, up to half of
+        the non-missing values of a sample may be outliers.
+
+    Returns
+    -------
+    ndarray, shape like x, dtype: bool
+        True for outliers and missings.
+
+    Notes
+    -----
+    Missings (i.e. NaN values) are ignored, such that samples of
+    different sizes can be tested in a single call by padding them with
+    NaN. At least 7 non-missing values must remain in a sample for a
+    value to be tested.
+
+    Each sample is sorted once. The most extreme of the remaining values
+    is then always either the smallest or the largest of them, and the
+    mean and variance of the remaining values are updated from running
+    sums. All samples are tested at the same time.
+    """
+    x = np.asarray(x, dtype=float)
+    vector = x.ndim == 1
+    if vector:
+        x = x[:,None]
+    assert x.ndim == 2, 'x must be of shape (n,) or (n,k)'
+    n, k = x.shape
+
+    missing = np.isnan(x)
+    count = n - missing.sum(axis=0)
+
+    if max_outliers is None:
+        bound = count // 2
+    else:
+        bound = np.minimum(max_outliers, count)
+    steps = int(np.minimum(bound, np.maximum(count-6, 0)).max(initial=0))
+
+    # missings are sorted to the end
+    order = np.argsort(x, axis=0, kind='stable')
+    columns = np.arange(k)
+    z = np.take_along_axis(x, order, axis=0)
+    z[np.isnan(z)] = 0
+
+    # centre the samples to keep the running sums accurate
+    z = z - np.where(missing[order, columns], 0,
+            z.sum(axis=0) / np.maximum(count, 1))
+
+    s1 = z.sum(axis=0)
+    s2 = (z*z).sum(axis=0)
+    lo = np.zeros(k, dtype=int)
+    hi = count - 1
+    remaining = count.astype(float)
+
+    statistics = np.full((steps,k), -np.inf)
+    crvals = np.full((steps,k), np.inf)
+    removed = np.zeros((steps,k), dtype=int)
+
+    for c in np.unique(count):
+        crval = esd_critical_values(int(c), sgnf)[:steps]
+        crvals[:len(crval), count == c] = crval[:,None]
+
+    for i in range(steps):
+        active = (i < bound) & (remaining >= 7)
+
+        m = s1 / np.maximum(remaining, 1)
+        var = (s2 - s1*m) / np.maximum(remaining-1, 1)
+        sd = np.sqrt(np.maximum(var, 0))
+
+        low  = m - z[np.minimum(lo, n-1), columns]
+        high = z[np.maximum(hi, 0), columns] - m
+        upper = high >= low
+        arg = np.where(upper, hi, lo)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = np.maximum(low, high) / sd
+        statistics[i] = np.where(active & (sd > 0), r, -np.inf)
+        removed[i] = arg
+
+        value = np.where(active, z[np.clip(arg, 0, n-1), columns], 0)
+        s1 = s1 - value
+        s2 = s2 - value*value
+        remaining = remaining - active
+        hi = hi - (active & upper)
+        lo = lo + (active & ~upper)
+
+    # the number of outliers is the largest number of removed values for
+    # which the statistic exceeds its critical value
+    exceeds = statistics > crvals
+    outliers = np.zeros(k, dtype=int)
+    if steps > 0:
+        outliers = np.where(exceeds.any(axis=0),
+                steps - np.argmax(exceeds[::-1], axis=0), 0)
+
+    args = missing.copy()
+    for i in range(steps):
+        which = i < outliers
+        args[order[removed[i,which], columns[which]], columns[which]] = True
+
+    if vector:
+        return args[:,0]
+    return args
+
 def grubbs(xvec, sgnf, inplace=False):
     """
-    Iterate Grubbs' test
+    Remove outliers by the generalized ESD test
 
     Parameters
     ----------
-    xvec : ndarray, shape (n,)
+    xvec : ndarray, shape (n,) or (n,k)
     sgnf : float
     inplace : bool
 
+    Returns
+    -------
+    xvec : ndarray
+        The sample values with outliers set to NaN.
+    args : ndarray, dtype: bool
+        True for outliers.
+
     Notes
     -----
     Missigs (nan values) are set to True.
     """
     if not inplace:
         xvec = xvec.copy()
-    args = np.repeat(False, len(xvec))
-    args [ np.isnan(xvec) ] = True
-    while (sum(~np.isnan(xvec)) > 6 & np.not_equal(np.nanvar(xvec), 0)):
-        arg = grubbs_test(xvec, sgnf)
-        if arg == None:
-            break
-        xvec [arg] = np.nan
-        args [arg] = True
+    args = generalized_esd(xvec, sgnf)
+    xvec [args] = np.nan
     return xvec, args
@@ -0,0 +1,306 @@
+# Copyright 2016-2018 Thomas W. D. Möbius
+#
+# This file is part of fmristats.
+#
+# fmristats is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# fmristats is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# It is not allowed to remove this copy right statement.
+
+"""
+
+A container format for instances, from which single fields can be read
+without loading the rest.
+
+A container file starts with MAGIC, followed by the length (8 bytes,
+little endian) and the pickle of a header, followed by the data. The
+header describes the attributes of the instance:
+
+    - small attributes are stored in the header itself,
+    - arrays are stored raw in the data part, with their last axis first
+      (such that the slice of a single parameter or value is stored
+      contiguously), and are memory-mapped when loaded,
+    - large instances of classes of fmristats are stored as sections
+      (recursively in the same way as the instance), which are loaded on
+      first access only.
+
+"""
+
+from importlib import import_module
+
+from functools import reduce
+
+import numpy as np
+
+import pickle
+
+MAGIC = b'\x93FMRISTATS'
+
+ALIGNMENT = 64
+
+THRESHOLD = 65536
+"""
+Instances of classes of fmristats whose pickle is larger than this
+number of bytes are stored as sections
+"""
+
+def is_lazy(file):
+    """
+    True if the file is a container
+
+    Parameters
+    ----------
+    file : str
+        File name.
+
+    Returns
+    -------
+    bool
+    """
+    with open(file, 'rb') as input:
+        return input.read(len(MAGIC)) == MAGIC
+
+########################################################################
+#
+# Save
+#
+########################################################################
+
+def get_state(instance):
+    if isinstance(instance, LazyObject):
+        instance = instance.load()
+    if hasattr(instance, '__getstate__'):
+        state = instance.__getstate__()
+    else:
+        state = instance.__dict__
+    if state is None:
+        state = {}
+    assert isinstance(state, dict), 'state of instance must be a dict'
+    return state
+
+def get_section(instance, chunks, offset):
+    """
+    Header of the section of an instance; appends the arrays to write to
+    chunks and returns the offset after them
+    """
+    section = {
+            'class'    : (type(instance).__module__,
+                type(instance).__qualname__),
+            'state'    : {},
+            'arrays'   : {},
+            'sections' : {}}
+
+    for key, value in get_state(instance).items():
+        if isinstance(value, LazyObject):
+            value = value.load()
+
+        if isinstance(value, np.ndarray) and not value.dtype.hasobject \
+                and value.ndim > 0 and value.size > 0:
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            section['arrays'][key] = (offset, value.dtype.str,
+                    tuple(int(d) for d in value.shape))
+            chunks.append((offset, value))
+            offset += value.nbytes
+            continue
+
+        if type(value).__module__.startswith('fmristats.') and \
+                len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)) \
+                > THRESHOLD:
+            section['sections'][key], offset = get_section(value, chunks,
+                    offset)
+        else:
+            section['state'][key] = value
+
+    return section, offset
+
+def save_lazy(instance, file):
+    """
+    Save instance to disk as a container
+
+    Parameters
+    ----------
+    instance : object
+        An instance whose state is a dict.
+    file : str
+        File name.
+    """
+    chunks = []
+    section, size = get_section(instance, chunks, 0)
+    header = pickle.dumps(section, protocol=pickle.HIGHEST_PROTOCOL)
+    start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    with open(file, 'wb') as output:
+        output.write(MAGIC)
+        output.write(len(header).to_bytes(8, 'little'))
+        output.write(header)
+        for offset, chunk in chunks:
+            output.seek(start + offset)
+            # last axis first, one slice at a time
+            if chunk.ndim == 1:
+                output.write(np.ascontiguousarray(chunk).tobytes())
+            else:
+                for k in range(chunk.shape[-1]):
+                    output.write(np.ascontiguousarray(
+                        chunk[...,k]).tobytes())
+        output.truncate(start + size)
+
+########################################################################
+#
+# Load
+#
+########################################################################
+
+def load_lazy(file):
+    """
+    Load instance from a container
+
+    The arrays of the instance are memory-mapped (copy-on-write, i.e.,
+    the instance may be modified in memory, but never changes the file),
+    and large instances of classes of fmristats are returned as
+    LazyObject, which load on first access.
+
+    Parameters
+    ----------
+    file : str
+        File name.
+    """
+    with open(file, 'rb') as input:
+        assert input.read(len(MAGIC)) == MAGIC, \
+                '{} is not a container'.format(file)
+        length = int.from_bytes(input.read(8), 'little')
+        section = pickle.loads(input.read(length))
+
+    start = -(-(len(MAGIC) + 8 + length) // ALIGNMENT) * ALIGNMENT
+    return materialise(file, start, section)
+
+def read_array(file, start, entry):
+    offset, dtype, shape = entry
+    if len(shape) == 1:
+        return np.memmap(file, dtype=dtype, mode='c', offset=start+offset,
+                shape=shape)
+    array = np.memmap(file, dtype=dtype, mode='c', offset=start+offset,
+            shape=shape[-1:]+shape[:-1])
+    return np.moveaxis(array, 0, -1)
+
+def materialise(file, start, section):
+    module, name = section['class']
+    cls = reduce(getattr, name.split('.'), import_module(module))
+
+    state = dict(section['state'])
+    for key, entry in section['arrays'].items():
+        state[key] = read_array(file, start, entry)
+
+    lazy = {}
+    for key, entry in section['sections'].items():
+        lazy[key] = LazyObject(file, start, entry)
+    state.update(lazy)
+
+    instance = cls.__new__(cls)
+    if hasattr(instance, '__setstate__'):
+        instance.__setstate__(state)
+    else:
+        instance.__dict__.update(state)
+
+    for key, value in lazy.items():
+        value.parent = (instance, key)
+
+    return instance
+
+def identity(instance):
+    return instance
+
+def resolve(instance):
+    """
+    The object behind a proxy
+
+    Parameters
+    ----------
+    instance : object
+        An object or a LazyObject.
+
+    Returns
+    -------
+    object
+        The loaded object if instance is a LazyObject, otherwise the
+        instance itself. Use this before checking the type of an
+        attribute of a lazily loaded instance.
+    """
+    if isinstance(instance, LazyObject):
+        return instance.load()
+    return instance
+
+class LazyObject:
+    """
+    Proxy of an object in a container, which is loaded on first access
+
+    Attribute access (and len, iter, and item access) is forwarded to
+    the loaded object. Once loaded, the object replaces the proxy in the
+    instance it is an attribute of. Pickling a proxy pickles the loaded
+    object.
+
+    Parameters
+    ----------
+    file : str
+        File name of the container.
+    start : int
+        Start of the data part of the container.
+    section : dict
+        Header of the section of the object.
+    """
+    def __init__(self, file, start, section):
+        self.file = file
+        self.start = start
+        self.section = section
+        self.parent = None
+        self.instance = None
+
+    def load(self):
+        """
+        Load the object
+
+        Returns
+        -------
+        object
+        """
+        if self.instance is None:
+            self.instance = materialise(self.file, self.start, self.section)
+            if self.parent is not None:
+                instance, key = self.parent
+                instance.__dict__[key] = self.instance
+        return self.instance
+
+    def __getattr__(self, name):
+        if name in ['file', 'start', 'section', 'parent', 'instance'] \
+                or name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __len__(self):
+        return len(self.load())
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def __str__(self):
+        return str(self.load())
+
+    def __reduce__(self):
+        return (identity, (self.load(),))
+
+    def __repr__(self):
+        if self.instance is None:
+            return '<LazyObject of {} (not loaded)>'.format(self.file)
+        return repr(self.instance)
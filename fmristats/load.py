@@ -17,6 +17,8 @@
 #
 # It is not allowed to remove this copy right statement.
 
+from .lazy import is_lazy, load_lazy
+
 import pickle
 
 def load(file):
@@ -29,7 +31,16 @@ def load(file):
     ----------
     file : str
         File name.
+
+    Notes
+    -----
+    Instances which have been saved as a container (see fmristats.lazy)
+    are loaded lazily: arrays are memory-mapped and large attributes
+    are only read on first access.
     """
+    if is_lazy(file):
+        return load_lazy(file)
+
     with open(file, 'rb') as input:
         self = pickle.load(input)
 
@@ -23,6 +23,8 @@ Calculates the population effect field from fMRI data of the brain.
 
 import statsmodels.api as sm
 
+from numba import jit, prange, config, set_num_threads
+
 import numpy as np
 
 from numpy.linalg import solve, svd
@@ -90,7 +92,7 @@ def hedge_type_estimator(y, d, x):
     # TODO: do this with MP-pseudo inverse instead
     H  = x.dot(solve(x.T.dot(x), x.T))
     E  = np.eye(x.shape[0]) - H
-    resid_df = -np.diff(x.shape)
+    resid_df = x.shape[0] - x.shape[1]
     return float( max(0, (y.dot(E).dot(y) - np.trace(E.dot(np.diag(d)))) / resid_df) )
 
 def meta_analysis(y, d):
@@ -178,7 +180,8 @@ def meta_regression(y, d, x):
     t   = b / adj_stderr
     return b, t, h, adj_stderr, rdf
 
-def fit_field(statistics, design=None, mask=None):
+def fit_field(statistics, design=None, mask=None, backend='numba',
+        cores=None, subjects=None, block=65536):
     """
     Random effect meta regression
 
@@ -190,12 +193,27 @@ def fit_field(statistics, design=None, mask=None):
 
     Parameters
     ----------
-    statistics : ndarray, shape (x,y,z,3,k)
+    statistics : ndarray, shape (x,y,z,3,n)
         The observations. In 0: BOLD effect, 1: BOLD stderr, 2: NA
     mask : ndarray, shape 3D-image
         A mask where to fit the field
     design : ndarray, shape (k,p)
         The design matrix. If None, a meta analysis will be performed.
+    backend : str
+        Backend of the meta regression: numba, parallel, or
+        statsmodels. The parallel backend distributes the points over
+        multiple threads. A meta analysis is always fitted at all
+        points at once.
+    cores : None or int
+        Number of threads used by the parallel backend. If None, all
+        available threads are used.
+    subjects : None or ndarray, shape (k,), dtype: int
+        The subjects (positions along the last axis of statistics) in
+        the sample. If None, all n = k subjects are in the sample.
+    block : int
+        The statistics are read in slabs along the first axis of
+        roughly this number of points, such that they never need to be
+        held in memory at once (e.g. when memory-mapped).
 
     Returns
     -----
@@ -211,22 +229,42 @@ def fit_field(statistics, design=None, mask=None):
     else:
         p  = design.shape[1]
 
-    assert statistics.shape[-1] > p+1, 'model not identifiable, too many parameters to fit'
+    if subjects is None:
+        k = statistics.shape[-1]
+    else:
+        k = len(subjects)
+
+    assert k > p+1, 'model not identifiable, too many parameters to fit'
+
+    shape = statistics.shape[:3]
+    planes = max(1, block // (shape[1]*shape[2]))
+    slabs = [slice(i, min(i+planes, shape[0]))
+            for i in range(0, shape[0], planes)]
+
+    def read(slab):
+        if subjects is None:
+            return np.array(statistics[slab], dtype=float)
+        return np.asarray(statistics[slab][...,subjects], dtype=float)
 
     ###################################################################
     # Check identifiability and create mask
     ###################################################################
 
-    sample_size = np.isfinite(statistics).all(axis=-2).sum(axis=-1)
-
     # pixels are 'valid' if there exists enough data such that the meta
     # regression / analysis model is identifiable.
-    valid = sample_size > p+1
+    valid = np.zeros(shape, dtype=bool)
 
     # pixels are 'fully valid' if there are no missing values along the
     # subject axis, i.e, for all subjects in the sample there is an
     # estimate available for this pixel.
-    fully_valid = np.isfinite(statistics).all(axis=(-1,-2))
+    fully_valid = np.zeros(shape, dtype=bool)
+
+    for slab in slabs:
+        finite = np.isfinite(read(slab))
+        sample_size = finite.all(axis=-2).sum(axis=-1)
+        valid[slab] = sample_size > p+1
+        fully_valid[slab] = finite.all(axis=(-1,-2))
+
     fully_valid = fully_valid & valid
 
     if mask is None:
@@ -249,13 +287,6 @@ def fit_field(statistics, design=None, mask=None):
 
     assert mask.any(), 'no identifiable points in the mask'
 
-    ###################################################################
-    # Need the squared standard error of the BOLD estimator
-    ###################################################################
-
-    stats = statistics.copy()
-    stats[:,:,:,1] **= 2
-
     ###################################################################
     # Create result array
     ###################################################################
@@ -263,26 +294,34 @@ def fit_field(statistics, design=None, mask=None):
     result = np.zeros(mask.shape + (3, p+1), dtype=float)
     result[...] = np.nan
 
+    print("  … number of points to estimate: {}".format(mask.size))
+
+    if design is None:
+        print("  … perform a meta analysis")
+    else:
+        print("  … perform a meta regression")
+
     ###################################################################
-    # Reshape result, statistics, and mask
+    # Fit the model slab by slab
     ###################################################################
 
-    rresult = result.reshape((-1,result.shape[-2],result.shape[-1]))
-    rstats = stats.reshape((-1,stats.shape[-2],stats.shape[-1]))
-    to_fit  = mask.reshape((-1,))
+    for slab in slabs:
+        if not mask[slab].any():
+            continue
 
-    print("  … number of points to estimate: {}".format(len(to_fit)))
+        # need the squared standard error of the BOLD estimator
+        stats = read(slab)
+        stats[...,1,:] **= 2
 
-    ###################################################################
-    # Fit the model
-    ###################################################################
+        rresult = result[slab].reshape((-1,3,p+1))
+        rstats  = stats.reshape((-1,3,k))
+        to_fit  = mask[slab].reshape((-1,))
 
-    if design is None:
-        print("  … perform a meta analysis")
-        fit_meta_analysis(rresult, to_fit, rstats)
-    else:
-        print("  … perform a meta regression")
-        fit_meta_regression(rresult, to_fit, rstats, design)
+        if design is None:
+            fit_meta_analysis(rresult, to_fit, rstats)
+        else:
+            fit_meta_regression(rresult, to_fit, rstats, design,
+                    backend=backend, cores=cores)
 
     return result
 
@@ -290,30 +329,186 @@ def fit_field(statistics, design=None, mask=None):
 # Backends
 ###################################################################
 
-def fit_meta_analysis(result, to_fit, statistics):
-    for i in range(result.shape[0]):
-        if to_fit[i]:
-            b, t, h, adj_stderr, r = meta_analysis(
-                    y = statistics[i,0][np.where(np.isfinite(statistics[i,0]))],
-                    d = statistics[i,1][np.where(np.isfinite(statistics[i,1]))])
-            result[i,0,0] = b
-            result[i,1,0] = adj_stderr
-            result[i,2,0] = t
-            result[i,0,1] = h
-            result[i,1,1] = r
-            result[i,2,1] = 0
-
-def fit_meta_regression(result, to_fit, statistics, design):
-    for i in range(result.shape[0]):
-        if to_fit[i]:
-            valid = np.where(np.isfinite(statistics[i,0]))
-            b, t, h, adj_stderr, r = meta_regression(
-                    y = statistics[i,0][valid],
-                    d = statistics[i,1][valid],
-                    x = design[valid])
-            result[i,0,:-1] = b
-            result[i,1,:-1] = adj_stderr
-            result[i,2,:-1] = t
-            result[i,0,-1]  = h
-            result[i,1,-1]  = r
-            result[i,2,-1]  = 0
+def fit_meta_analysis(result, to_fit, statistics, block=65536):
+    """
+    Meta analysis at all points to fit
+
+    The same as calling meta_analysis at each point, but with all
+    quantities calculated as arrays over (blocks of) points, where
+    missing observations are masked.
+
+    Parameters
+    ----------
+    result : ndarray, shape (n,3,2)
+        The result array.
+    to_fit : ndarray, shape (n,), dtype: bool
+        The points to fit.
+    statistics : ndarray, shape (n,3,k)
+        The BOLD effect and its squared standard error.
+    block : int
+        The number of points fitted at once.
+    """
+    points = np.flatnonzero(to_fit)
+    for start in range(0, len(points), block):
+        index = points[start:start+block]
+        y = statistics[index,0]
+        d = statistics[index,1]
+
+        valid = np.isfinite(y) & np.isfinite(d)
+        y = np.where(valid, y, 0)
+        d = np.where(valid, d, 0)
+        n = valid.sum(axis=-1)
+
+        # Hedge estimator of the heterogeneity
+        residuals = np.where(valid, y - (y.sum(axis=-1) / n)[:,None], 0)
+        h = ((residuals**2).sum(axis=-1) -
+                (d - d / n[:,None]).sum(axis=-1)) / (n-1)
+        h = np.maximum(h, 0)
+
+        hd  = h[:,None] + d
+        w   = np.divide(1, hd, out=np.zeros_like(hd), where=valid)
+        v   = 1 / w.sum(axis=-1)
+        b   = (w * y).sum(axis=-1) / w.sum(axis=-1)
+        rdf = n - 1
+        adj = np.divide(residuals**2, hd, out=np.zeros_like(hd),
+                where=valid).sum(axis=-1) / rdf
+        adj_stderr = np.sqrt(v * adj)
+
+        result[index,0,0] = b
+        result[index,1,0] = adj_stderr
+        result[index,2,0] = b / adj_stderr
+        result[index,0,1] = h
+        result[index,1,1] = rdf
+        result[index,2,1] = 0
+
+def fit_meta_regression(result, to_fit, statistics, design,
+        backend='numba', cores=None):
+    """
+    Meta regression at all points to fit
+
+    Parameters
+    ----------
+    result : ndarray, shape (n,3,p+1)
+        The result array.
+    to_fit : ndarray, shape (n,), dtype: bool
+        The points to fit.
+    statistics : ndarray, shape (n,3,k)
+        The BOLD effect and its squared standard error.
+    design : ndarray, shape (k,p)
+        The design matrix.
+    backend : str
+        One of numba, parallel, or statsmodels.
+    cores : None or int
+        Number of threads used by the parallel backend.
+    """
+    assert backend in ['numba', 'jit', 'parallel', 'statsmodels'], \
+            'backend must be one of numba, parallel, or statsmodels'
+
+    if backend == 'statsmodels':
+        for i in range(result.shape[0]):
+            if to_fit[i]:
+                valid = np.where(np.isfinite(statistics[i,0]))
+                b, t, h, adj_stderr, r = meta_regression(
+                        y = statistics[i,0][valid],
+                        d = statistics[i,1][valid],
+                        x = design[valid])
+                result[i,0,:-1] = b
+                result[i,1,:-1] = adj_stderr
+                result[i,2,:-1] = t
+                result[i,0,-1]  = h
+                result[i,1,-1]  = r
+                result[i,2,-1]  = 0
+        return
+
+    design = np.ascontiguousarray(design, dtype=np.float64)
+    statistics = np.ascontiguousarray(statistics, dtype=np.float64)
+
+    # group the points by their pattern of missing subjects, such that
+    # the design needs to be factorised only once per pattern
+    points = np.flatnonzero(to_fit)
+    valid = np.isfinite(statistics[points,0]) & \
+            np.isfinite(statistics[points,1])
+    patterns, codes = np.unique(np.packbits(valid, axis=-1), axis=0,
+            return_inverse=True)
+    patterns = np.unpackbits(patterns, axis=-1,
+            count=design.shape[0]).astype(bool)
+    codes = codes.reshape((-1,))
+    order = np.argsort(codes, kind='stable')
+    offsets = np.hstack((0, np.cumsum(np.bincount(codes,
+        minlength=len(patterns))))).astype(np.int64)
+
+    if backend == 'parallel':
+        if cores is not None:
+            set_num_threads(max(1, min(cores, config.NUMBA_NUM_THREADS)))
+        kernel = meta_regression_nb_parallel
+    else:
+        kernel = meta_regression_nb
+
+    kernel(result, points[order], statistics, design, patterns, offsets)
+
+@jit(nopython=True)
+def meta_regression_point(y, d, x, q):
+    """
+    Meta regression at a single point
+
+    The same as meta_regression, but from the QR decomposition x = q⋅r of
+    the design: the leverages are the squared row norms of q, and the
+    q-profile y'⋅K⋅y equals the weighted residual sum of squares, such
+    that the Knapp-Hartung adjusted standard errors are the square
+    roots of the diagonal of (x'⋅W⋅x)⁻¹ times the scale of the weighted
+    least squares fit.
+
+    Returns None if the weighted design is singular.
+    """
+    k, p = x.shape
+    rdf = k - p
+
+    # Hedge type estimator of the heterogeneity
+    e = y - q.dot(y.dot(q))
+    leverages = (q**2).sum(axis=1)
+    h = max(0., ((e**2).sum() - (d * (1 - leverages)).sum()) / rdf)
+
+    # weighted least squares
+    sw = np.sqrt(1 / (h+d))
+    xw = x * sw.reshape((-1,1))
+    yw = y * sw
+    qw, rw = np.linalg.qr(xw)
+    for j in range(p):
+        if abs(rw[j,j]) <= 1e-12 * np.abs(rw).max():
+            return None
+
+    rinv  = np.linalg.inv(rw)
+    b     = rinv.dot(yw.dot(np.ascontiguousarray(qw)))
+    scale = ((yw - xw.dot(b))**2).sum() / rdf
+    adj_stderr = np.sqrt((rinv**2).sum(axis=1)) * scale
+    return b, b / adj_stderr, h, adj_stderr, rdf
+
+def meta_regression_kernel(result:np.array, points:np.array,
+        statistics:np.array, design:np.array, patterns:np.array,
+        offsets:np.array):
+    p = design.shape[1]
+    for g in range(patterns.shape[0]):
+        # the QR decomposition of the design is shared by all points
+        # with the same pattern of missing subjects
+        valid = patterns[g]
+        x = np.ascontiguousarray(design[valid])
+        if x.shape[0] <= p:
+            continue
+        q = np.ascontiguousarray(np.linalg.qr(x)[0])
+        for l in prange(offsets[g], offsets[g+1]):
+            i = points[l]
+            fit = meta_regression_point(statistics[i,0][valid],
+                    statistics[i,1][valid], x, q)
+            if fit is not None:
+                b, t, h, adj_stderr, rdf = fit
+                result[i,0,:-1] = b
+                result[i,1,:-1] = adj_stderr
+                result[i,2,:-1] = t
+                result[i,0,-1]  = h
+                result[i,1,-1]  = rdf
+                result[i,2,-1]  = 0
+
+meta_regression_nb = jit(nopython=True)(meta_regression_kernel)
+
+meta_regression_nb_parallel = jit(nopython=True, parallel=True)(
+        meta_regression_kernel)
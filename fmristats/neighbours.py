@@ -0,0 +1,349 @@
+# Copyright 2016-2018 Thomas W. D. Möbius
+#
+# This file is part of fmristats.
+#
+# fmristats is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# fmristats is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# It is not allowed to remove this copy right statement.
+
+"""
+
+Spatial index for the look up of observations in the neighbourhood of a
+point.
+
+"""
+
+from .affines import Affines
+
+from numba import jit
+
+import numpy as np
+
+import pickle
+
+class CellIndex:
+    """
+    A uniform cell grid over a cloud of points
+
+    The bounding box of the points is partitioned into cubic cells of
+    side length `width`. The points are sorted by cell, such that all
+    points that fall into a given cell are stored contiguously.
+    Neighbourhood queries only need to visit the cells that intersect
+    the ball of the given radius around the query point.
+
+    Parameters
+    ----------
+    points : ndarray, shape (…,3), dtype: float
+        The points to index. Only the first three entries in the last
+        dimension are used, such that the observation matrix of a
+        SignalModel may be passed directly. Points with non-finite
+        coordinates are never returned by a query.
+    width : float
+        Side length of a cell. A good choice is the radius of the
+        queries, as then each query visits at most 27 cells.
+
+    Notes
+    -----
+    Within each cell the points are kept in ascending order of their
+    position in `points`, and queries return the indices in ascending
+    order, too. A query will thus return exactly the same rows (and in
+    the same order) as a brute force search over all points.
+    """
+    def __init__(self, points, width):
+        assert width > 0, 'width must be strictly positive'
+
+        points = np.asarray(points)[...,:3].reshape((-1,3))
+        finite = np.isfinite(points).all(axis=-1)
+
+        if finite.any():
+            origin = points[finite].min(axis=0)
+            extent = points[finite].max(axis=0) - origin
+        else:
+            origin = np.zeros(3)
+            extent = np.zeros(3)
+
+        # prevent an excessive number of (mostly empty) cells when the
+        # width is small compared to the spread of the points
+        while np.prod(np.floor(extent / width) + 1) > max(8*finite.sum(), 1):
+            width = 2*width
+
+        shape = (np.floor(extent / width) + 1).astype(np.int64)
+        ncells = int(np.prod(shape))
+
+        cells = np.zeros((len(points),3), dtype=np.int64)
+        cells[finite] = np.floor((points[finite] - origin) / width)
+        cells = np.minimum(cells, shape-1)
+
+        keys = np.full(len(points), ncells, dtype=np.int64)
+        keys[finite] = np.ravel_multi_index(cells[finite].T, shape)
+
+        order = np.argsort(keys, kind='stable')
+        counts = np.bincount(keys, minlength=ncells+1)
+
+        self.points  = points
+        self.origin  = origin
+        self.width   = float(width)
+        self.shape   = shape
+        self.order   = order.astype(np.int64)
+        self.offsets = np.hstack((0, np.cumsum(counts))).astype(np.int64)
+        self.n       = len(points)
+
+    def query(self, coordinate, radius):
+        """
+        Points within radius of a coordinate
+
+        Parameters
+        ----------
+        coordinate : ndarray, shape (3,), dtype: float
+            The query point.
+        radius : float
+            Only points at a distance strictly less than `radius` are
+            returned.
+
+        Returns
+        -------
+        indices : ndarray, shape (m,), dtype: int
+            Indices (in ascending order) of the points in the
+            neighbourhood.
+        squared_distances : ndarray, shape (m,), dtype: float
+            Squared distances of these points to the coordinate.
+        """
+        return cell_query(np.asarray(coordinate, dtype=float),
+                self.points, self.origin, self.width, self.shape,
+                self.offsets, self.order, radius**2)
+
+    def arrays(self):
+        """
+        The arrays which define the index
+
+        Returns
+        -------
+        tuple
+            (origin, width, shape, offsets, order); the form in which the
+            index is passed to compiled kernels.
+        """
+        return self.origin, self.width, self.shape, self.offsets, self.order
+
+    def save(self, file, **kwargs):
+        """
+        Save instance to disk
+
+        Parameters
+        ----------
+        file : str
+            A file name.
+        """
+        with open(file, 'wb') as output:
+            pickle.dump(self, output, **kwargs)
+
+class ScannerIndex:
+    """
+    Index of the observations in the index space of the scanner
+
+    Each scan cycle samples the brain at a regular lattice which has
+    been moved by a rigid body transformation. The observations of a
+    scan cycle within some radius of a point can therefore be found by
+    mapping the point into the index space of the lattice and
+    enumerating the small box of indices around it. There is no need to
+    know the coordinates of all observations in advance.
+
+    Parameters
+    ----------
+    valid : ndarray, shape (n,x,y,z), dtype: bool
+        True for each observation (scan cycle and lattice point) that is
+        valid. Valid observations are numbered in C order, which is the
+        order of the rows in `observations[valid]`.
+    affines : Affines or ndarray, shape (n,4,4)
+        For each scan cycle, the affine transformation which maps an
+        index of the lattice to the coordinates of the point in the
+        target space (e.g. the subject reference space).
+
+    Notes
+    -----
+    Queries return rows in ascending order, i.e. in the same order as a
+    brute force search over the observations. The coordinates of the
+    observations are calculated on the fly and may differ from the
+    materialised coordinates by rounding error.
+    """
+    def __init__(self, valid, affines):
+        if type(affines) is not Affines:
+            affines = Affines(affines)
+
+        assert valid.dtype == bool, 'valid must be of dtype bool'
+        assert valid.ndim == 4, 'valid must be of shape (n,x,y,z)'
+        assert valid.shape[0] == affines.n, \
+                'number of scan cycles and affines do not match'
+
+        self.n = int(valid.sum())
+
+        if self.n < np.iinfo(np.int32).max:
+            dtype = np.int32
+        else:
+            dtype = np.int64
+
+        rows = np.full(valid.shape, -1, dtype=dtype)
+        rows[valid] = np.arange(self.n, dtype=dtype)
+
+        self.rows = rows
+        self.affines = np.ascontiguousarray(affines.affines, dtype=float)
+        self.inverses = np.ascontiguousarray(affines.inv().affines, dtype=float)
+
+    def query(self, coordinate, radius):
+        """
+        Observations within radius of a coordinate
+
+        Parameters
+        ----------
+        coordinate : ndarray, shape (3,), dtype: float
+            The query point.
+        radius : float
+            Only observations at a distance strictly less than `radius`
+            are returned.
+
+        Returns
+        -------
+        indices : ndarray, shape (m,), dtype: int
+            Rows (in ascending order) of the observations in the
+            neighbourhood.
+        squared_distances : ndarray, shape (m,), dtype: float
+            Squared distances of these observations to the coordinate.
+        """
+        rows, squared_distances, _ = scanner_query(
+                np.asarray(coordinate, dtype=float), self.rows,
+                self.affines, self.inverses, radius**2)
+        return rows, squared_distances
+
+    def arrays(self):
+        """
+        The arrays which define the index
+
+        Returns
+        -------
+        tuple
+            (rows, affines, inverses); the form in which the index is
+            passed to compiled kernels.
+        """
+        return self.rows, self.affines, self.inverses
+
+    def save(self, file, **kwargs):
+        """
+        Save instance to disk
+
+        Parameters
+        ----------
+        file : str
+            A file name.
+        """
+        with open(file, 'wb') as output:
+            pickle.dump(self, output, **kwargs)
+
+########################################################################
+#
+# Backend
+#
+########################################################################
+
+@jit(nopython=True)
+def cell_query(coordinate, points, origin, width, shape, offsets, order, r):
+    """
+    Indices and squared distances of all points within a squared radius
+    r of a coordinate, sorted by index
+    """
+    span = int(np.ceil(np.sqrt(r) / width))
+    lower = np.empty(3, dtype=np.int64)
+    upper = np.empty(3, dtype=np.int64)
+    for a in range(3):
+        c = int(np.floor((coordinate[a] - origin[a]) / width))
+        lower[a] = max(c - span, 0)
+        upper[a] = min(c + span, shape[a] - 1)
+
+    size = 0
+    for i in range(lower[0], upper[0]+1):
+        for j in range(lower[1], upper[1]+1):
+            start = (i*shape[1] + j)*shape[2]
+            if lower[2] <= upper[2]:
+                size += offsets[start+upper[2]+1] - offsets[start+lower[2]]
+
+    candidates = np.empty(size, dtype=np.int64)
+    m = 0
+    for i in range(lower[0], upper[0]+1):
+        for j in range(lower[1], upper[1]+1):
+            start = (i*shape[1] + j)*shape[2]
+            if lower[2] > upper[2]:
+                continue
+            # cells along the last axis are contiguous in `order`
+            for l in range(offsets[start+lower[2]], offsets[start+upper[2]+1]):
+                candidates[m] = order[l]
+                m += 1
+
+    # the squared distances are calculated by the very same expression
+    # as in a brute force search, such that results agree to the bit
+    candidates = np.sort(candidates)
+    squared_distances = ((points[candidates] - coordinate)**2).sum(axis=1)
+    valid = np.where(squared_distances < r)
+    return candidates[valid], squared_distances[valid]
+
+@jit(nopython=True)
+def scanner_query(coordinate, rows, affines, inverses, r):
+    """
+    Rows, squared distances, and flat lattice positions of all valid
+    observations within a squared radius r of a coordinate, sorted by
+    row
+    """
+    n, dx, dy, dz = rows.shape
+    radius = np.sqrt(r)
+
+    lower = np.empty((n,3), dtype=np.int64)
+    upper = np.empty((n,3), dtype=np.int64)
+    size = 0
+    for t in range(n):
+        volume = 1
+        for a in range(3):
+            # position of the coordinate in the index space of scan
+            # cycle t, and the half width of the box which contains the
+            # preimage of the ball of the given radius
+            u = inverses[t,a,0]*coordinate[0] + inverses[t,a,1]*coordinate[1] \
+                    + inverses[t,a,2]*coordinate[2] + inverses[t,a,3]
+            h = radius * np.sqrt(inverses[t,a,0]**2 + inverses[t,a,1]**2
+                    + inverses[t,a,2]**2)
+            lower[t,a] = max(int(np.ceil(u - h)), 0)
+            upper[t,a] = min(int(np.floor(u + h)), rows.shape[a+1] - 1)
+            volume *= max(upper[t,a] - lower[t,a] + 1, 0)
+        size += volume
+
+    found     = np.empty(size, dtype=np.int64)
+    distances = np.empty(size)
+    positions = np.empty(size, dtype=np.int64)
+    m = 0
+    for t in range(n):
+        a = affines[t]
+        for i in range(lower[t,0], upper[t,0]+1):
+            for j in range(lower[t,1], upper[t,1]+1):
+                for k in range(lower[t,2], upper[t,2]+1):
+                    row = rows[t,i,j,k]
+                    if row < 0:
+                        continue
+                    x = a[0,0]*i + a[0,1]*j + a[0,2]*k + a[0,3] - coordinate[0]
+                    y = a[1,0]*i + a[1,1]*j + a[1,2]*k + a[1,3] - coordinate[1]
+                    z = a[2,0]*i + a[2,1]*j + a[2,2]*k + a[2,3] - coordinate[2]
+                    d = x*x + y*y + z*z
+                    if d < r:
+                        found[m]     = row
+                        distances[m] = d
+                        positions[m] = ((t*dx + i)*dy + j)*dz + k
+                        m += 1
+
+    # rows are numbered in C order of (t,i,j,k) and have been visited in
+    # this order, hence they are already sorted
+    return found[:m], distances[:m], positions[:m]
@@ -0,0 +1,373 @@
+# Copyright 2016-2018 Thomas W. D. Möbius
+#
+# This file is part of fmristats.
+#
+# fmristats is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# fmristats is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# It is not allowed to remove this copy right statement.
+
+"""
+
+A compact store for the valid observations of an FMRI session.
+
+"""
+
+from .affines import Affines
+
+from pandas import DataFrame
+
+from itertools import product
+
+import numpy as np
+
+import pickle
+
+import os
+
+class Observations:
+    """
+    Columnar store of the valid observations of a session
+
+    Only the valid observations are stored, and for each of them only
+    its position on the acquisition lattice and its MR signal. The time,
+    task, block, cycle, and slice of an observation are the same for
+    all observations in a scan; they are stored once per scan and looked
+    up on demand. The coordinates of the observations are calculated on
+    demand from the affine transformations of the scan cycles.
+
+    Parameters
+    ----------
+    signal : ndarray, shape (n,x,y,z), dtype: float
+        The MR signal on the acquisition lattice of the n scan cycles.
+    valid : ndarray, shape (n,x,y,z), dtype: bool
+        True for the observations to store.
+    scans : ndarray, shape (n,s,5), dtype: float
+        The covariates of the scans (see SignalModel.get_scans):
+            - [..., 0] = time of observation
+            - [..., 1] = task during time of observation
+            - [..., 2] = block number during time of observation
+            - [..., 3] = scan cycle
+            - [..., 4] = slice number
+    references : Affines
+        For each scan cycle, the affine transformation which maps an
+        index of the lattice to subject reference space.
+    ep : int
+        The axis of the lattice (in [0,1,2]) along which the slices have
+        been acquired.
+    dtype : dtype
+        The data type in which the signal is stored.
+    directory : None or str
+        If given, the positions and the signal of the observations are
+        written to positions.npy and signal.npy in this directory, and
+        are memory-mapped from there (read only).
+
+    Notes
+    -----
+    Observations are stored in C order of the lattice (n,x,y,z), i.e.
+    in the same order as `observations[valid]` for an array of shape
+    (n,x,y,z,…).
+    """
+    def __init__(self, signal, valid, scans, references, ep,
+            dtype=np.float32, directory=None):
+        assert signal.shape == valid.shape, \
+                'shapes of signal and valid do not match'
+        assert scans.shape[:2] == (signal.shape[0], signal.shape[ep+1]), \
+                'shape of scans does not match the shape of the signal'
+        assert type(references) is Affines, 'references must be Affines'
+        assert references.n == signal.shape[0], \
+                'number of scan cycles and references do not match'
+
+        if valid.size < np.iinfo(np.int32).max:
+            itype = np.int32
+        else:
+            itype = np.int64
+
+        if directory is None:
+            positions = np.flatnonzero(valid).astype(itype)
+            values = signal[valid].astype(dtype)
+        else:
+            # write the arrays scan cycle by scan cycle, such that they
+            # never need to be held in memory
+            os.makedirs(directory, exist_ok=True)
+            counts = valid.reshape((valid.shape[0],-1)).sum(axis=1)
+            bounds = np.hstack((0, np.cumsum(counts)))
+            positions = np.lib.format.open_memmap(
+                    os.path.join(directory, 'positions.npy'), mode='w+',
+                    dtype=itype, shape=(int(bounds[-1]),))
+            values = np.lib.format.open_memmap(
+                    os.path.join(directory, 'signal.npy'), mode='w+',
+                    dtype=dtype, shape=(int(bounds[-1]),))
+            volume = np.prod(valid.shape[1:])
+            for t in range(valid.shape[0]):
+                positions[bounds[t]:bounds[t+1]] = \
+                        t*volume + np.flatnonzero(valid[t])
+                values[bounds[t]:bounds[t+1]] = signal[t][valid[t]]
+            positions.flush()
+            values.flush()
+            del positions, values
+            positions = np.load(os.path.join(directory, 'positions.npy'),
+                    mmap_mode='r')
+            values = np.load(os.path.join(directory, 'signal.npy'),
+                    mmap_mode='r')
+
+        self.shape = signal.shape
+        self.ep = ep
+        self.positions = positions
+        self.signal = values
+        self.scans = np.asarray(scans, dtype=float)
+        self.references = references
+        self.n = len(positions)
+
+    def __len__(self):
+        return self.n
+
+    def select(self, keep):
+        """
+        Subset of the observations
+
+        Parameters
+        ----------
+        keep : ndarray, shape (n,), dtype: bool
+            True for the observations to keep.
+
+        Returns
+        -------
+        Observations
+        """
+        assert keep.shape == (self.n,), 'keep must be of shape (n,)'
+
+        new = Observations.__new__(Observations)
+        new.shape = self.shape
+        new.ep = self.ep
+        new.positions = self.positions[keep]
+        new.signal = self.signal[keep]
+        new.scans = self.scans
+        new.references = self.references
+        new.n = len(new.positions)
+        return new
+
+    def take(self, rows):
+        """
+        Observations in the given rows
+
+        Parameters
+        ----------
+        rows : ndarray, shape (m,), dtype: int
+            Rows (in ascending order) of the observations to take.
+
+        Returns
+        -------
+        Observations
+            An in-memory store, even if this store is memory-mapped.
+        """
+        new = Observations.__new__(Observations)
+        new.shape = self.shape
+        new.ep = self.ep
+        new.positions = np.asarray(self.positions[rows])
+        new.signal = np.asarray(self.signal[rows])
+        new.scans = self.scans
+        new.references = self.references
+        new.n = len(new.positions)
+        return new
+
+    def within(self, lower, upper):
+        """
+        Rows of the observations within a box
+
+        Only the positions of observations in scan cycles and lattice
+        planes which may intersect the box are read, such that this is
+        cheap for a memory-mapped store.
+
+        Parameters
+        ----------
+        lower : ndarray, shape (3,), dtype: float
+            Lower corner of the box in subject reference space.
+        upper : ndarray, shape (3,), dtype: float
+            Upper corner of the box in subject reference space.
+
+        Returns
+        -------
+        ndarray, shape (m,), dtype: int
+            Rows (in ascending order) of the observations within the
+            box.
+        """
+        lower = np.asarray(lower, dtype=float)
+        upper = np.asarray(upper, dtype=float)
+
+        # tolerate rounding errors in the coordinates of observations
+        tolerance = 1e-6 * max(np.abs(lower).max(), np.abs(upper).max(), 1)
+        lower = lower - tolerance
+        upper = upper + tolerance
+
+        corners = np.array(list(product(*zip(lower, upper))))
+        inverses = self.references.inv().affines
+        affines = self.references.affines
+
+        dims = np.array(self.shape[1:])
+        volume = dims.prod()
+        stride = dims[1] * dims[2]
+
+        rows = []
+        for t in range(self.shape[0]):
+            indices = corners.dot(inverses[t,:3,:3].T) + inverses[t,:3,3]
+            first = np.maximum(np.floor(indices.min(axis=0)), 0).astype(int)
+            last = np.minimum(np.ceil(indices.max(axis=0)), dims-1).astype(int)
+            if (first > last).any():
+                continue
+
+            start, stop = np.searchsorted(self.positions,
+                    [t*volume + first[0]*stride, t*volume + (last[0]+1)*stride])
+            if start == stop:
+                continue
+
+            local = np.asarray(self.positions[start:stop]) - t*volume
+            index = np.stack(np.unravel_index(local, dims), axis=-1)
+            inside = ((index >= first) & (index <= last)).all(axis=-1)
+            x = index.dot(affines[t,:3,:3].T) + affines[t,:3,3]
+            inside = inside & ((x >= lower) & (x <= upper)).all(axis=-1)
+            rows.append(start + np.flatnonzero(inside))
+
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        return np.concatenate(rows)
+
+    def valid(self):
+        """
+        Lattice mask of the stored observations
+
+        Returns
+        -------
+        ndarray, shape (n,x,y,z), dtype: bool
+        """
+        valid = np.zeros(self.shape, dtype=bool)
+        valid.reshape((-1,))[self.positions] = True
+        return valid
+
+    def cycle(self):
+        """
+        Scan cycle of each observation
+
+        Returns
+        -------
+        ndarray, shape (n,), dtype: int
+        """
+        return self.positions // np.prod(self.shape[1:], dtype=np.int64)
+
+    def slice(self):
+        """
+        Slice number of each observation
+
+        Returns
+        -------
+        ndarray, shape (n,), dtype: int
+        """
+        stride = np.prod(self.shape[self.ep+2:], dtype=np.int64)
+        return (self.positions // stride) % self.shape[self.ep+1]
+
+    def covariates(self):
+        """
+        Covariates of each observation
+
+        Returns
+        -------
+        ndarray, shape (n,5), dtype: float
+            Time, task, block, cycle, and slice of each observation.
+        """
+        return self.scans[self.cycle(), self.slice()]
+
+    def coordinates(self):
+        """
+        Coordinates of each observation in subject reference space
+
+        Returns
+        -------
+        ndarray, shape (n,3), dtype: float
+        """
+        coordinates = np.empty((self.n,3))
+        volume = np.prod(self.shape[1:], dtype=np.int64)
+        bounds = np.searchsorted(self.positions,
+                np.arange(self.shape[0]+1) * volume)
+        # the lattice of a single scan cycle is small, and calculating the
+        # coordinates on the full lattice gives the same result to the bit
+        # as SignalModel.coordinates()
+        indices = tuple(slice(0,d) for d in self.shape[1:])
+        for t in range(self.shape[0]):
+            lower, upper = bounds[t], bounds[t+1]
+            if lower == upper:
+                continue
+            lattice = self.references.index(t).apply_to_indices(indices)
+            coordinates[lower:upper] = lattice.reshape((-1,3))[
+                    self.positions[lower:upper] - t*volume]
+        return coordinates
+
+    def to_array(self):
+        """
+        The observations as an observation matrix
+
+        Returns
+        -------
+        ndarray, shape (n,9), dtype: float
+            [...,:3] = coordinates of observation
+            [..., 3] = MR signal response
+            [..., 4] = time of observation
+            [..., 5] = task during time of observation
+            [..., 6] = block number during time of observation
+            [..., 7] = scan cycle
+            [..., 8] = slice number
+        """
+        data = np.empty((self.n,9))
+        data[:,:3] = self.coordinates()
+        data[:, 3] = self.signal
+        data[:,4:] = self.covariates()
+        return data
+
+    def dataframe(self, coordinates=False):
+        """
+        The observations as a data frame
+
+        Parameters
+        ----------
+        coordinates : bool
+            If True, include the coordinates (x, y, z) of the
+            observations.
+
+        Returns
+        -------
+        DataFrame
+        """
+        covariates = self.covariates()
+        columns = {
+            'signal' : self.signal.astype(float),
+            'time'   : covariates[:,0],
+            'task'   : covariates[:,1],
+            'block'  : covariates[:,2],
+            'cycle'  : covariates[:,3],
+            'slice'  : covariates[:,4]}
+        if coordinates:
+            x = self.coordinates()
+            columns.update({'x' : x[:,0], 'y' : x[:,1], 'z' : x[:,2]})
+        return DataFrame(columns)
+
+    def save(self, file, **kwargs):
+        """
+        Save instance to disk
+
+        Parameters
+        ----------
+        file : str
+            A file name.
+        """
+        with open(file, 'wb') as output:
+            pickle.dump(self, output, **kwargs)
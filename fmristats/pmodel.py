@@ -68,7 +68,6 @@ class PopulationModel:
 
         self.sample     = sample
         self.covariates = sample.covariates
-        self.statistics = sample.statistics
 
         if (formula is not None) and (design is None):
             dmat = dmatrix(formula, self.covariates, eval_env=-1)
@@ -81,10 +80,31 @@ class PopulationModel:
         self.parameter_names = parameter_names
         self.design = design
 
-    def fit(self, mask=True):
+    @property
+    def statistics(self):
+        """
+        The statistics field of the subjects in the sample
+
+        The sample may refer to only some of the fields in its
+        (memory-mapped) statistics field, so the field is read through
+        the sample, and only when needed.
+        """
+        return self.sample.get_statistics()
+
+    def fit(self, mask=True, backend='numba', cores=None):
         """
         Fit the model to the data
 
+        Parameters
+        ----------
+        mask : bool or str or ndarray
+            The mask where to fit the model.
+        backend : str
+            Backend of the meta regression: numba, parallel, or
+            statsmodels (see meta.fit_field).
+        cores : None or int
+            Number of threads used by the parallel backend.
+
         Returns
         -------
         PopulationResult
@@ -116,10 +136,15 @@ class PopulationModel:
 
         self.mask = mask
 
+        # the statistics are read from the sample in blocks of points,
+        # and only for the subjects in the sample
         result = fit_field(
-                statistics=self.statistics,
+                statistics=self.sample.statistics,
+                subjects=self.sample.subjects,
                 design=self.design,
-                mask=mask)
+                mask=mask,
+                backend=backend,
+                cores=cores)
 
         return PopulationResult(statistics=result, model=self)
 
@@ -57,7 +57,7 @@ from .tau import tau
 
 from .affines import Affine, Affines
 
-from .grubbs import grubbs
+from .grubbs import generalized_esd
 
 from .tracking import fit_by_pcm
 
@@ -85,7 +85,7 @@ class ReferenceMaps:
         self.outlying_cycles = None
         self.outlying = None
 
-    def fit(self, session, use_raw=True):
+    def fit(self, session, use_raw=True, cores=1):
         """
         Fit head movement
 
@@ -99,6 +99,9 @@ class ReferenceMaps:
             The FMRI session data of the subject.
         use_raw : bool
             Use the raw data or only the data in the foreground.
+        cores : None or int
+            Number of threads over which the scan cycles are
+            distributed. If None, the number of cores on the machine.
 
         Notes
         -----
@@ -115,11 +118,13 @@ class ReferenceMaps:
         if use_raw:
             acquisition_maps, w = fit_by_pcm(
                     data=session.raw,
-                    reference=session.reference)
+                    reference=session.reference,
+                    cores=cores)
         else:
             acquisition_maps, w = fit_by_pcm(
                     data=session.data,
-                    reference=session.reference)
+                    reference=session.reference,
+                    cores=cores)
 
         self.reference       = session.reference
         self.semi_axis_norms = w
@@ -286,9 +291,9 @@ class ReferenceMaps:
         other scan cycles, as this likely is the result of severe head
         movement during the measurement of this cycle.
 
-        Grubbs' test is used recursively for the outlier detection. The
+        The generalized ESD test is used for the outlier detection. The
         norm of all three semi axis length and each single semi axis
-        length is tested for outlier separately.
+        length is tested for outlier separately (all in a single call).
 
         It should simply give you an idea on how severe head movements
         might have been, and allow you to remove the most obvious
@@ -302,42 +307,18 @@ class ReferenceMaps:
         # 3. Use as the reference distribution for grubbs only scans
         #    within blocks of stimulus
 
-        if hasattr(self, 'semi_axis_norms'):
-            # Look at the length of the semi axis norms
-            w0 = self.semi_axis_norms[...,0]
-            w1 = self.semi_axis_norms[...,1]
-            w2 = self.semi_axis_norms[...,2]
-            _, args0 = grubbs(w0, sgnf)
-            _, args1 = grubbs(w1, sgnf)
-            _, args2 = grubbs(w2, sgnf)
-
         # Look at the bary centres of the scan cycles
-        x0 = self.acquisition_maps.affines[:,0,3]
-        x1 = self.acquisition_maps.affines[:,1,3]
-        x2 = self.acquisition_maps.affines[:,2,3]
-        _, args3 = grubbs(x0, sgnf)
-        _, args4 = grubbs(x1, sgnf)
-        _, args5 = grubbs(x2, sgnf)
-
-        euler = self.acquisition_maps.euler().T
+        samples = [self.acquisition_maps.affines[:,:3,3]]
 
+        euler = self.acquisition_maps.euler()
         euler[ abs(euler) > tau / 5 ] = np.nan
-
-        _, args6 = grubbs(euler[0], sgnf)
-        _, args7 = grubbs(euler[1], sgnf)
-        _, args8 = grubbs(euler[2], sgnf)
+        samples.append(euler)
 
         if hasattr(self, 'semi_axis_norms'):
-            outlying = np.vstack((
-                args0, args1, args2,
-                args3, args4, args5,
-                args6, args7, args8))
-        else:
-            outlying = np.vstack((
-                args3, args4, args5,
-                args6, args7, args8))
+            # Look at the length of the semi axis norms
+            samples.insert(0, self.semi_axis_norms[...,:3])
 
-        #self.outlying = outlying
+        outlying = generalized_esd(np.hstack(samples), sgnf).T
 
         self.outlying_cycles = outlying.any(axis=0)
 
@@ -29,17 +29,84 @@ from .diffeomorphisms import Image
 
 from .study import Study
 
+from .lazy import save_lazy
+
 import numpy as np
 
 import pickle
 
+import os
+
+import hashlib
+
 from pandas import DataFrame
 
+def fingerprint(file, settings=None):
+    """
+    Fingerprint of a file
+
+    The fingerprint changes whenever the file is rewritten, but is
+    obtained without reading the file.
+
+    Parameters
+    ----------
+    file : str
+        File name.
+    settings : None or str
+        If given, the fingerprint of the settings under which a field
+        has been extracted from the file (see settings_fingerprint),
+        which is appended to the fingerprint.
+
+    Returns
+    -------
+    None or tuple
+        (file, size, time of last modification in ns[, settings]), or
+        None if the file does not exist.
+    """
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return None
+    if settings is None:
+        return (file, stat.st_size, stat.st_mtime_ns)
+    return (file, stat.st_size, stat.st_mtime_ns, settings)
+
+def settings_fingerprint(vb, vb_ati, mask):
+    """
+    Fingerprint of the settings under which fields are extracted
+
+    The fields of a subject do not only depend on its result, but also
+    on the population space and ATI reference field of the study and on
+    the mask applied to the result.
+
+    Parameters
+    ----------
+    vb : Image
+        The template in the population space.
+    vb_ati : Image
+        The ATI reference field in the population space.
+    mask : bool or str
+        The mask applied to the results.
+
+    Returns
+    -------
+    str
+        A hash of the templates (data and reference) and the mask.
+    """
+    settings = hashlib.sha1()
+    for image in [vb, vb_ati]:
+        settings.update(repr(image.shape).encode())
+        settings.update(np.ascontiguousarray(image.data).tobytes())
+        settings.update(np.ascontiguousarray(image.reference.affine).tobytes())
+    settings.update(repr(mask).encode())
+    return settings.hexdigest()
+
 class Sample:
     """
     Sampled activation fields of a FMRI study
     """
-    def __init__(self, covariates, statistics, study):
+    def __init__(self, covariates, statistics, study, subjects=None,
+            fingerprints=None):
         """
         Parameters
         ----------
@@ -47,10 +114,24 @@ class Sample:
             Should have an integer index (with start=0,
             stop=len(covariates)) of the same length as the number of
             statistics that are saved in statistics.
-        statistics : ndarray, shape (…,3)
-            The statistics field.
+        statistics : ndarray, shape (…,3,n)
+            The statistics field. May be memory-mapped.
         study : Study
             The study.
+        subjects : None or ndarray, shape (k,), dtype: int
+            The positions of the subjects of the sample along the last
+            axis of statistics (and in the same order as covariates).
+            If None, all n = k fields in statistics are in the sample.
+        fingerprints : None or ndarray, shape (n,), dtype: object
+            For each field in statistics, the fingerprint (see
+            fingerprint) of the file it has been extracted from, or
+            None. Used to update a sample incrementally.
+
+        Notes
+        -----
+        Samples which share the statistics field with another sample,
+        but only contain some of its subjects (see filter), refer to the
+        field by the attribute .subjects rather than hold a copy.
         """
         assert type(study) is Study, 'study must be of type Study'
 
@@ -61,8 +142,28 @@ class Sample:
         assert type(covariates) is DataFrame
         self.covariates = covariates
 
-        assert statistics.shape == self.vb.shape + (3,len(covariates))
+        if subjects is None:
+            assert statistics.shape == self.vb.shape + (3,len(covariates))
+        else:
+            subjects = np.asarray(subjects, dtype=np.int64)
+            assert subjects.shape == (len(covariates),), \
+                    'subjects must be of the same length as covariates'
+            assert statistics.shape[:-1] == self.vb.shape + (3,)
+
+        if fingerprints is not None:
+            assert fingerprints.shape == statistics.shape[-1:], \
+                    'there must be one fingerprint for each field'
+
         self.statistics = statistics
+        self.subjects = subjects
+        self.fingerprints = fingerprints
+
+    def __setstate__(self, state):
+        # samples saved before samples could refer to subjects or kept
+        # fingerprints
+        state.setdefault('subjects', None)
+        state.setdefault('fingerprints', None)
+        self.__dict__.update(state)
 
     def filter(self, b=None):
         """
@@ -71,19 +172,74 @@ class Sample:
         Here, b should be a slice object, you cannot work with the index
         of the covariate data frame, but must use integer location
         indices instead.
+
+        The statistics field is not copied, the new sample refers to
+        the subjects in the field instead.
         """
         if b is None:
             b = self.covariates.valid
 
+        b = np.asarray(b)
         if b.dtype == np.dtype(bool):
-            covariates = self.covariates.ix[b]
+            positions = np.flatnonzero(b)
+        else:
+            positions = np.arange(len(self.covariates))[b]
+
+        if self.subjects is None:
+            subjects = positions
         else:
-            covariates = self.covariates.iloc[b]
+            subjects = self.subjects[positions]
 
         return Sample(
-                covariates = covariates.ix[b],
-                statistics = self.statistics[...,b],
-                study      = self.study)
+                covariates   = self.covariates.iloc[positions],
+                statistics   = self.statistics,
+                study        = self.study,
+                subjects     = subjects,
+                fingerprints = self.fingerprints)
+
+    def get_statistics(self, index=Ellipsis):
+        """
+        Returns the statistics field of the subjects in the sample
+
+        Parameters
+        ----------
+        index : Ellipsis or slice or tuple
+            Index into the spatial axes of the field. Only this part of
+            the field is read.
+
+        Returns
+        -------
+        ndarray, shape (…,3,k)
+        """
+        statistics = self.statistics[index]
+        if self.subjects is None:
+            return np.array(statistics)
+        return statistics[...,self.subjects]
+
+    def get_fields(self):
+        """
+        Fields of the subjects in the sample by fingerprint
+
+        Returns
+        -------
+        dict
+            Maps the file name in the fingerprint of each subject in
+            the sample to the position of its field in statistics and
+            its fingerprint.
+        """
+        if self.fingerprints is None:
+            return {}
+
+        if self.subjects is None:
+            subjects = range(len(self.fingerprints))
+        else:
+            subjects = self.subjects
+
+        fields = {}
+        for j in subjects:
+            if self.fingerprints[j] is not None:
+                fields[self.fingerprints[j][0]] = (j, self.fingerprints[j])
+        return fields
 
     def at_index(self, index):
         """
@@ -101,9 +257,10 @@ class Sample:
         -------
         DataFrame
         """
+        statistics = self.get_statistics((index[0],index[1],index[2]))
         df = self.covariates.copy()
-        df['task'] = self.statistics[index[0],index[1],index[2],0]
-        df['stderr'] = self.statistics[index[0],index[1],index[2],1]
+        df['task'] = statistics[0]
+        df['stderr'] = statistics[1]
         return df
 
     ###################################################################
@@ -124,7 +281,7 @@ No. of samples: {:d}
     # Save nstance to and from disk
     ####################################################################
 
-    def save(self, file, **kwargs):
+    def save(self, file, lazy=True, **kwargs):
         """
         Save model instance to disk
 
@@ -134,7 +291,16 @@ No. of samples: {:d}
         ----------
         file : str
             File name.
+        lazy : bool
+            If True, save as a container (see fmristats.lazy), in which
+            the statistics field is stored subject by subject and from
+            which fmristats.load memory-maps it. Otherwise pickle the
+            instance.
         """
+        if lazy:
+            save_lazy(self, file)
+            return
+
         with open(file, 'wb') as output:
             pickle.dump(self, output, **kwargs)
 
@@ -192,9 +192,9 @@ class Session:
     # Foreground detection
     ####################################################################
 
-    def fit_foreground(self):
+    def fit_foreground(self, cores=1):
         self.data = self.raw.astype(float).copy()
-        self.thresholds = fit_foreground(self.data, ep=self.ep)
+        self.thresholds = fit_foreground(self.data, ep=self.ep, cores=cores)
 
     def set_foreground(self, foreground, is_mask=True):
         assert foreground.shape == self.data.shape, \
@@ -208,6 +208,21 @@ class Session:
         else:
             self.data = foreground
 
+    def any_finite(self):
+        """
+        Lattice points with data
+
+        Returns
+        -------
+        ndarray, shape (x,y,z), dtype: bool
+            True for each point of the acquisition lattice at which the
+            data are finite in at least one scan cycle.
+        """
+        finite = np.zeros(self.shape, dtype=bool)
+        for t in range(self.numob):
+            finite |= np.isfinite(self.data[t])
+        return finite
+
     ###################################################################
     # Descriptive statistics of this session
     ###################################################################
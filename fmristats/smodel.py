@@ -37,21 +37,35 @@ from .pmap import PopulationMap
 
 from .stimulus import Stimulus
 
-from .fit import fit_field, extract_field, \
+from .fit import fit_field, extract_field, convolution_error_bound, \
         fit_at, model_at, data_at, \
         fit_AT, model_AT, design_AT
 
+from .neighbours import CellIndex, ScannerIndex
+
+from .observations import Observations
+
+from .lazy import save_lazy, resolve
+
 import time
 
+import re
+
+import os
+
 import numpy as np
 
 from numpy.linalg import inv
 
 from numpy.linalg import norm
 
+from numpy.lib.format import open_memmap
+
 import scipy.stats.distributions as dist
 
-from patsy import dmatrix
+from scipy.ndimage import map_coordinates
+
+from patsy import dmatrix, ModelDesc, EvalEnvironment
 
 from pandas import DataFrame
 
@@ -59,6 +73,13 @@ import pickle
 
 import math
 
+import weakref
+
+# Approximate number of bytes needed per observation when fitting a slab
+# of coordinates: the in-memory store of observations (position, signal,
+# code), their coordinates, and the cell index over these coordinates.
+BYTES_PER_OBSERVATION = 128
+
 class SignalModel:
     """
     The signal model
@@ -112,8 +133,25 @@ class SignalModel:
         self.parameter = parameter
         self.parameter_dict = None
 
+        self.observations = None
+        self.valid = None
         self.data = None
         self.dataframe = None
+        self.design = None
+        self.codes = None
+        self.index = None
+        self.fallback = None
+        self.masks = {}
+
+    def __getstate__(self):
+        # data masks are cheap to recompute and not saved
+        state = self.__dict__.copy()
+        state.pop('masks', None)
+        return state
+
+    def __setstate__(self, state):
+        state['masks'] = {}
+        self.__dict__.update(state)
 
     #######################################################################
     # Set hyperparameters for the fit
@@ -213,12 +251,7 @@ class SignalModel:
         """
         n,x,y,z = self.session.data.shape
         indices = ((slice(0,x), slice(0,y), slice(0,z)))
-
-        coordinates = np.empty((n,x,y,z,3))
-        for t in range(n):
-            coordinates[t] = self.references.index(t).apply_to_indices(indices)
-
-        return coordinates
+        return self.references.apply_to_indices(indices)
 
     def set_stimulus_design(self, **kwargs):
         """
@@ -269,19 +302,99 @@ class SignalModel:
 
         return observations
 
+    def get_scans(self, burn_in=4, dropna=True):
+        """
+        Covariates and validity of the scans
+
+        Returns the covariates of each scan (i.e. of each slice in each
+        scan cycle), which are shared by all observations in this scan.
+
+        Parameters
+        ----------
+        burn_in : int
+            Number of scan cycles at the beginning of the session which
+            are not valid.
+        dropna : bool
+            If True, scans with missing task or block are not valid.
+
+        Returns
+        -------
+        scans : ndarray, shape (n,s,5), dtype: float
+            [..., 0] = time of observation
+            [..., 1] = task during time of observation
+            [..., 2] = block number during time of observation
+            [..., 3] = scan cycle
+            [..., 4] = slice number
+        valid : ndarray, shape (n,s), dtype: bool
+            False for scans which are outlying, within the burn in, or
+            which have missing covariates.
+        """
+        if self.stimulus_design is None:
+            print('first run .set_stimulus_design()')
+            return
+
+        scans = np.empty(self.shape + (5,))
+        scans[...,0] = self.slice_timing
+        scans[...,1:3] = self.stimulus_design
+        scans[...,3:5] = np.moveaxis(np.mgrid[:self.shape[0], :self.shape[1]], 0, -1)
+
+        if dropna:
+            valid = np.isfinite(scans).all(axis=-1)
+        else:
+            valid = np.isfinite(scans[...,0])
+
+        if hasattr(self.reference_maps, 'outlying_scans'):
+            valid = valid & ~self.reference_maps.outlying_scans
+
+        if burn_in:
+            valid[:burn_in] = False
+
+        return scans, valid
+
     def set_data(self, burn_in=4, demean=False, dropna=True,
-            include_background=False, verbose=True):
+            include_background=False, dtype=np.float32, directory=None,
+            verbose=True):
         """
-        Set the observation matrix
+        Set the observations
 
-        This will set the attributes .observations, .valid, .data, and
-        .dataframe.
+        This will set the attributes .observations and .valid, and
+        reset .data, .dataframe, .design, and the index of the
+        observations.
+
+        Parameters
+        ----------
+        burn_in : int
+            Number of scan cycles to discard at the beginning of the
+            session.
+        demean : bool
+            Demean the time of observation.
+        dropna : bool
+            Drop observations with missing task or block.
+        include_background : bool
+            Use the raw data of the session.
+        dtype : dtype
+            The data type in which the MR signal is stored.
+        directory : None or str
+            If given, the observations are written to this directory
+            and memory-mapped from there (see Observations). Together
+            with fit(memory=…), this allows to fit sessions which would
+            not fit into memory otherwise.
+        verbose : bool
+            Increase output verbosity.
 
         Notes
         -----
-        The observations are an array of the following shape:
+        The observations are kept in a compact store (see
+        Observations), which only holds the MR signal and the lattice
+        position of each valid observation, while time, task, block,
+        cycle, and slice are stored once per scan. An observation is
+        valid if its MR signal is finite and not zero, and it has not
+        been acquired in an outlying scan or during the burn in.
 
-            ndarray, shape (n,x,y,z,9), dtype: float
+        The observation matrix of the valid observations is available
+        from .get_data(), which is an array of the following shape:
+
+            ndarray, shape (…,9), dtype: float
                 [...,:3] = coordinates of observation
                 [..., 3] = the MR signal response
                 [..., 4] = time of observation
@@ -290,50 +403,32 @@ class SignalModel:
                 [..., 7] = scan cycle
                 [..., 8] = slice number
 
-        The data in this array are the basis of all model fits.
+        The data in this store are the basis of all model fits.
         """
         self.burn_in = burn_in
 
-        observations = self.get_observations(include_background)
-
-        # remove outlying scans due to severe movements of the subject
-        # in the scanner
-
-        if hasattr(self.reference_maps, 'outlying_scans'):
-            scans = self.reference_maps.outlying_scans
-            if scans.any():
-                tmp = np.moveaxis(observations, self.ep+1, 1)
-                tmp [scans] = np.nan
-
-                if verbose:
-                    print('{}: Removed {} ({:.2f}%) outlying scans'.format(
-                        self.name.name(), scans.sum(), 100*scans.mean()))
-
-        # these observations have no response as they are missing
-        # (they may lie outside of the brain)
-        none = np.isnan(observations[...,3])
+        if include_background:
+            signal = self.session.raw
+        else:
+            signal = self.session.data
 
-        # these observations have no response as they are zero
-        null = np.isclose(observations[...,3], 0)
+        scans, valid_scans = self.get_scans(burn_in=burn_in, dropna=dropna)
 
-        # put them together and set all observations to NAN when
-        # anything is missing or invalid
-        missings = none | null
-        observations[missings] = np.nan
+        if verbose and hasattr(self.reference_maps, 'outlying_scans'):
+            outlying = self.reference_maps.outlying_scans
+            if outlying.any():
+                print('{}: Removed {} ({:.2f}%) outlying scans'.format(
+                    self.name.name(), outlying.sum(), 100*outlying.mean()))
 
-        # scan cycles that we do not need to process
-        if burn_in:
-            observations[:burn_in] = np.nan
+        # these observations have no response as they are missing (they
+        # may lie outside of the brain) or as they are zero
+        valid = np.isfinite(signal) & ~np.isclose(signal, 0)
 
-        # set all observations no NaN that have any missing data OR drop
-        # all observations that only have missing data in the first five
-        # array dimensions (coordinates, signal, and time).
-        if dropna:
-            invalid = np.isnan(observations).any(axis=-1)
-        else:
-            invalid = np.isnan(observations[...,:5]).any(axis=-1)
+        # observations in scans that we do not need to process
+        valid = valid & np.expand_dims(valid_scans, (2,3)).swapaxes(1, self.ep+1)
 
-        observations[ invalid ] = np.nan
+        observations = Observations(signal, valid, scans, self.references,
+                self.ep, dtype=dtype, directory=directory)
 
         # it is more numerically stable to work with a demeaned time
         # vector. This has also the consequence that the intercept will
@@ -342,27 +437,20 @@ class SignalModel:
         # have the least variance.
 
         if demean:
-            self.midpoint = np.nanmean(observations[...,4])
-            observations[...,4] = observations[...,4] - self.midpoint
-
-        if dropna:
-            valid = np.isfinite(observations).all(axis=-1)
-        else:
-            valid = np.isfinite(observations[...,:5]).all(axis=-1)
+            counts = np.bincount(
+                    observations.cycle()*self.shape[1] + observations.slice(),
+                    minlength=np.prod(self.shape)).reshape(self.shape)
+            self.midpoint = (counts * np.where(counts > 0, scans[...,0], 0)
+                    ).sum() / counts.sum()
+            observations.scans[...,0] = scans[...,0] - self.midpoint
 
         self.observations = observations
         self.valid = valid
-        self.data = observations[valid]
-        self.dataframe = DataFrame({
-            'x'      : self.data[...,0],
-            'y'      : self.data[...,1],
-            'z'      : self.data[...,2],
-            'signal' : self.data[...,3],
-            'time'   : self.data[...,4],
-            'task'   : self.data[...,5],
-            'block'  : self.data[...,6],
-            'cycle'  : self.data[...,7],
-            'slice'  : self.data[...,8]})
+        self.data = None
+        self.dataframe = None
+        self.design = None
+        self.codes = None
+        self.index = None
 
         if verbose:
             if demean:
@@ -380,24 +468,49 @@ class SignalModel:
 
         return
 
+    def get_data(self):
+        """
+        The observation matrix
+
+        Materialises (and caches) the observation matrix of the valid
+        observations from the store in .observations.
+
+        Returns
+        -------
+        ndarray, shape (…,9), dtype: float
+            [...,:3] = coordinates of observation
+            [..., 3] = the MR signal response
+            [..., 4] = time of observation
+            [..., 5] = task during time of observation
+            [..., 6] = block number during time of observation
+            [..., 7] = scan cycle
+            [..., 8] = slice number
+        """
+        if self.observations is None:
+            print('first run .set_data()')
+            return
+
+        if self.data is None:
+            self.data = self.observations.to_array()
+
+        return self.data
+
     def set_design(self, formula=None, parameter=None,
             return_design_matrix=False, verbose=True):
         """
         Set or create the design matrix
 
-        This will set the attribute .design, and it will overwrite the
-        attributes .valid, .data, .dataframe, and potentially .formula,
-        and .parameter_dict.
+        This will set the attributes .design, .codes, and .dataframe,
+        and it may drop observations with missing covariates from
+        .observations and .valid. It will potentially overwrite
+        .formula and .parameter_dict.
 
         Parameters
         ----------
-        design : ndarray, shape (m,n,x,y,z,p) or (m,n,p) or (m,p)
-            Design matrix for the m scan cycles with n scans per cycle
-            on the grid x, y, z with p number of parameters
         formula : None or str
-            If X is None, this formula will be used to create the design
-            matrix. If formula is None, the default stored in .formula
-            will be used. Otherwise .formula will be overwritten
+            This formula will be used to create the design matrix. If
+            formula is None, the default stored in .formula will be
+            used. Otherwise .formula will be overwritten
         parameter : list(str)
             A list of parameter names
         return_design_matrix : bool
@@ -406,39 +519,103 @@ class SignalModel:
         Returns
         -------
         None or DesignMatrix
-        """
-        observations = self.observations
-        valid = np.isfinite(observations).all(axis=-1)
-
-        self.valid = valid
-        self.data = observations[valid]
-
-        self.dataframe = DataFrame({
-            'x'      : self.data[...,0],
-            'y'      : self.data[...,1],
-            'z'      : self.data[...,2],
-            'signal' : self.data[...,3],
-            'time'   : self.data[...,4],
-            'task'   : self.data[...,5],
-            'block'  : self.data[...,6],
-            'cycle'  : self.data[...,7],
-            'slice'  : self.data[...,8]})
 
+        Notes
+        -----
+        The design matrix is stored in factorised form: .design holds
+        the distinct rows of the design matrix, and .codes the row of
+        .design for each observation. The full design matrix is
+        available from .get_design().
+
+        If the formula only refers to the covariates of the scans
+        (time, task, block, cycle, slice) and contains no stateful
+        transforms (like center or standardize), it is evaluated once
+        per scan rather than once per observation. The data frame in
+        .dataframe (and the returned design matrix) then has one row per
+        scan which contains valid observations.
+        """
         if formula is None:
             formula = self.formula
 
         if parameter is None:
             parameter = self.parameter
 
-        dmat = dmatrix(formula, self.dataframe, eval_env=-1)
+        observations = self.observations
+
+        variables = set(re.findall(r'[A-Za-z_]\w*', formula))
+
+        # stateful transforms need to learn from all observations
+        description = ModelDesc.from_formula(formula)
+        environment = EvalEnvironment.capture(1)
+        stateful = any(factor.memorize_passes_needed({}, environment) > 0
+                for term in description.rhs_termlist
+                for factor in term.factors)
+
+        if stateful or (variables & {'x', 'y', 'z', 'signal'}):
+            dataframe = observations.dataframe(
+                    coordinates = bool(variables & {'x', 'y', 'z'}))
+
+            # drop observations with missing covariates
+            finite = np.isfinite(dataframe.values).all(axis=-1)
+            if not finite.all():
+                observations = observations.select(finite)
+                dataframe = dataframe[finite].reset_index(drop=True)
+
+            dmat = dmatrix(formula, dataframe, eval_env=-1)
+            design, codes = np.unique(np.asarray(dmat), axis=0,
+                    return_inverse=True)
+        else:
+            scan = observations.cycle()*self.shape[1] + observations.slice()
+            used, = np.where(np.bincount(scan, minlength=np.prod(self.shape)))
+
+            scans = observations.scans.reshape((-1,5))[used]
+            dataframe = DataFrame({
+                'time'   : scans[:,0],
+                'task'   : scans[:,1],
+                'block'  : scans[:,2],
+                'cycle'  : scans[:,3],
+                'slice'  : scans[:,4]})
+
+            # drop observations with missing covariates
+            finite = np.isfinite(scans).all(axis=-1)
+            if not finite.all():
+                keep = np.zeros(np.prod(self.shape), dtype=bool)
+                keep[used[finite]] = True
+                observations = observations.select(keep[scan])
+                scan = scan[keep[scan]]
+                used = used[finite]
+                dataframe = dataframe[finite].reset_index(drop=True)
+
+            dmat = dmatrix(formula, dataframe, eval_env=-1)
+            design, inverse = np.unique(np.asarray(dmat), axis=0,
+                    return_inverse=True)
+
+            lookup = np.zeros(np.prod(self.shape), dtype=np.int64)
+            lookup[used] = inverse.reshape((-1,))
+            codes = lookup[scan]
+
+        if observations is not self.observations:
+            self.observations = observations
+            self.valid = observations.valid()
+            self.data = None
+            self.index = None
+
+        self.dataframe = dataframe
+
         names = dmat.design_info.column_names
         parameter_dict = { p : [p in n.lower() for n in names].index(True)
                 for p in parameter}
 
-        self.design  = np.asarray(dmat)
+        self.design  = design
+        self.codes   = codes.reshape((-1,)).astype(
+                np.promote_types(np.min_scalar_type(len(design)), np.uint8))
         self.formula = formula
         self.parameter_dict = parameter_dict
 
+        if verbose:
+            print('{}: Design matrix with {:,d} distinct rows'.format(
+                self.name.name(), len(design)))
+
         if return_design_matrix:
             return dmat
         else:
@@ -448,7 +625,7 @@ class SignalModel:
         """
         Set or create the design matrix
 
-        This will set the attribute .design.
+        This will set the attributes .design and .codes.
 
         Parameters
         ----------
@@ -466,30 +643,85 @@ class SignalModel:
         assert design.shape[0] == self.session.numob, \
                 'first dimension of design must equal number of scan cycles'
 
-        mat = np.ones(self.observations.shape[:-1] + (design.shape[-1],))
+        observations = self.observations
 
         if len(design.shape) == 2:
             if verbose:
                 print('Design has one entry per scan cycles')
-            mat[...] = design[:,None,None,None]
+            codes = observations.cycle()
 
         elif len(design.shape) == 3:
             assert design.shape[1] == self.session.shape [ self.session.ep ], \
                     'second dimension of design must equal number of scans per cycles'
             if verbose:
                 print('Design has one entry per scan')
-
-            # TODO: this is not correct, yet!
-            mat[...] = design[:,None,None]
+            codes = observations.cycle()*design.shape[1] + observations.slice()
 
         else:
             if verbose:
                 print('Design has one entry per acquisition grid voxel')
-            mat[...] = design
+            codes = observations.positions
 
-        self.design = mat [ self.valid ]
+        self.design = np.asarray(design, dtype=float).reshape((-1, design.shape[-1]))
+        self.codes = codes
         self.hasconst = hasconst
 
+    def get_design(self):
+        """
+        The design matrix
+
+        Returns
+        -------
+        ndarray, shape (…,p), dtype: float
+            The row of the design matrix for each observation.
+        """
+        if self.design is None:
+            print('first set the design using .set_design()')
+            return
+
+        return self.design[self.codes]
+
+    def get_index(self, engine='cells'):
+        """
+        Spatial index of the observations
+
+        Creates (and caches) the index which is used to look up the
+        observations in the neighbourhood of a point. The index is
+        reset whenever the valid observations change.
+
+        Parameters
+        ----------
+        engine : str
+            If cells, a cell grid over the coordinates of the
+            observations. If scanner, an index of the valid
+            observations in the index space of the scanner, which needs
+            no coordinates of observations at all.
+
+        Returns
+        -------
+        CellIndex or ScannerIndex
+        """
+        assert engine in ['cells', 'scanner'], \
+                'engine must be one of cells or scanner'
+
+        if engine == 'scanner':
+            if self.valid is None:
+                print('first run .set_data()')
+                return
+            if type(self.index) is not ScannerIndex:
+                self.index = ScannerIndex(self.valid, self.references)
+            return self.index
+
+        if self.observations is None:
+            print('first run .set_data()')
+            return
+
+        if type(self.index) is not CellIndex:
+            self.index = CellIndex(self.observations.coordinates(),
+                    width=self.radius)
+
+        return self.index
+
     ####################################################################
     # Fit at one coordinate by formula
     ####################################################################
@@ -509,15 +741,16 @@ class SignalModel:
             print('first run .set_hyperparameters()')
             return
 
-        if self.data is None:
+        if self.observations is None:
             print('first run .set_data()')
             return
 
         return data_at(coordinate=x,
-                data=self.data,
+                data=self.get_data(),
                 epi_code=self.epi_code,
                 scale=self.scale,
-                radius=self.radius)
+                radius=self.radius,
+                index=self.get_index())
 
     def data_at_index(self, index):
         """
@@ -564,7 +797,7 @@ class SignalModel:
             print('first run .set_hyperparameters()')
             return
 
-        if self.data is None:
+        if self.observations is None:
             print('first run .set_data()')
             return
 
@@ -573,10 +806,11 @@ class SignalModel:
 
         return model_at(formula=formula,
                 coordinate=x,
-                data=self.data,
+                data=self.get_data(),
                 epi_code=self.epi_code,
                 scale=self.scale,
-                radius=self.radius)
+                radius=self.radius,
+                index=self.get_index())
 
     def model_at_index(self, index, **kwargs):
         """
@@ -620,7 +854,7 @@ class SignalModel:
             print('first run .set_hyperparameters()')
             return
 
-        if self.data is None:
+        if self.observations is None:
             print('first run .set_data()')
             return
 
@@ -630,9 +864,10 @@ class SignalModel:
         return fit_at(formula=formula,
                 coordinate=x,
                 epi_code=self.epi_code,
-                data=self.data,
+                data=self.get_data(),
                 scale=self.scale,
-                radius=self.radius)
+                radius=self.radius,
+                index=self.get_index())
 
     def fit_at_index(self, index, **kwargs):
         """
@@ -678,7 +913,7 @@ class SignalModel:
             print('first run .set_hyperparameters()')
             return
 
-        if self.data is None:
+        if self.observations is None:
             print('first run .set_data()')
             return
 
@@ -687,10 +922,11 @@ class SignalModel:
             return
 
         return design_AT(coordinate=x,
-                data=self.data,
-                design=self.design,
+                data=self.get_data(),
+                design=self.get_design(),
                 scale=self.scale,
-                radius=self.radius)
+                radius=self.radius,
+                index=self.get_index())
 
     def design_AT_index(self, index):
         """
@@ -737,7 +973,7 @@ class SignalModel:
             print('first run .set_hyperparameters()')
             return
 
-        if self.data is None:
+        if self.observations is None:
             print('first run .set_data()')
             return
 
@@ -746,10 +982,11 @@ class SignalModel:
             return
 
         return model_AT(coordinate=x,
-                data=self.data,
-                design=self.design,
+                data=self.get_data(),
+                design=self.get_design(),
                 scale=self.scale,
                 radius=self.radius,
+                index=self.get_index(),
                 hasconst=self.hasconst)
 
     def model_AT_index(self, index):
@@ -794,7 +1031,7 @@ class SignalModel:
             print('first run .set_hyperparameters()')
             return
 
-        if self.data is None:
+        if self.observations is None:
             print('first run .set_data()')
             return
 
@@ -803,10 +1040,11 @@ class SignalModel:
             return
 
         return fit_AT(coordinate=x,
-                data=self.data,
-                design=self.design,
+                data=self.get_data(),
+                design=self.get_design(),
                 scale=self.scale,
                 radius=self.radius,
+                index=self.get_index(),
                 hasconst=self.hasconst)
 
     def fit_AT_index(self, index, **kwargs):
@@ -838,29 +1076,78 @@ class SignalModel:
     # Fit at many coordinates
     ####################################################################
 
-    def get_mask(self, verbose=True):
+    def get_mask(self, verbose=True, trilinear=False):
         """
         Creates a data mask
-        """
-        coordinates = self.population_map.diffeomorphism.coordinates()
-        to_index = self.mean_index_affine()
-        idx = to_index.apply(coordinates)
-        idx = idx.round().astype(int)
 
-        mdx = idx.reshape((-1,3))
+        A coordinate in standard space is in the data mask if the point
+        it is mapped to in the (mean) index space of the acquisition
+        lattice has data in at least one scan cycle.
 
-        di, dj, dk = self.session.shape
+        Parameters
+        ----------
+        verbose : bool
+            Increase output verbosity
+        trilinear : bool
+            If False, the point is rounded to the nearest lattice point.
+            If True, the point is in the data mask if any of the lattice
+            points which enter its trilinear interpolation (with
+            non-zero weight) has data; this avoids holes in the mask for
+            non-affine diffeomorphisms.
+
+        Returns
+        -------
+        ndarray, dtype: bool
+            True for coordinates in the data mask.
 
-        for x in iter(mdx):
-            i,j,k = x
-            if i < 0 or j < 0 or k < 0 or i >= di or j >= dj or k >= dk:
-                x[...] = 0
-            elif np.isfinite(self.session.data[:,i,j,k]).any():
-                x[...] = 1
+        Notes
+        -----
+        Masks are cached in the attribute .masks (which is not saved).
+        A cached mask is only used as long as the diffeomorphism of the
+        population map, the session and its data (which are replaced
+        by Session.fit_foreground and Session.set_foreground), and the
+        reference maps are the same objects as when it has been
+        computed.
+        """
+        if getattr(self, 'masks', None) is None:
+            self.masks = {}
+
+        # the objects the mask has been computed from; the cache only
+        # refers to them weakly, such that it neither keeps them alive
+        # nor mistakes a new object for a freed one
+        session = resolve(self.session)
+        sources = (resolve(self.population_map).diffeomorphism, session,
+                session.data, self.references)
+
+        cached = self.masks.get(trilinear)
+        if cached is None or any(reference() is not source
+                for reference, source in zip(cached[0], sources)):
+            coordinates = self.population_map.diffeomorphism.coordinates()
+            to_index = self.mean_index_affine()
+            idx = to_index.apply(coordinates)
+
+            finite = self.session.any_finite()
+            shape = np.array(finite.shape)
+
+            if trilinear:
+                inside = np.isfinite(idx).all(-1) & \
+                        (idx > -1).all(-1) & (idx < shape).all(-1)
+                support = map_coordinates(finite.astype(float),
+                        idx[inside].T, order=1, mode='grid-constant', cval=0)
+                mask = np.zeros(idx.shape[:-1], dtype=bool)
+                mask[inside] = support > 0
             else:
-                x[...] = 0
+                idx = idx.round()
+                inside = np.isfinite(idx).all(-1) & \
+                        (idx >= 0).all(-1) & (idx < shape).all(-1)
+                i, j, k = idx[inside].astype(int).T
+                mask = np.zeros(idx.shape[:-1], dtype=bool)
+                mask[inside] = finite[i,j,k]
+
+            self.masks[trilinear] = (
+                    [weakref.ref(source) for source in sources], mask)
 
-        mask = (idx > 0).any(-1)
+        mask = self.masks[trilinear][1].copy()
 
         if verbose:
             print("""{}:
@@ -939,8 +1226,123 @@ class SignalModel:
 
         return coordinates, mask
 
+    def fit_by_slabs(self, coordinates, mask, memory, directory=None,
+            verbose=True, **kwargs):
+        """
+        Fit the signal model to data slab by slab
+
+        The coordinates are split into slabs along their first axis. For
+        each slab, only the observations within the bounding box of the
+        slab (enlarged by the radius) are loaded from the store of
+        observations, and the fits of the slab are written to the
+        output arrays.
+
+        Parameters
+        ----------
+        coordinates : ndarray, shape (…,3), dtype: float
+            The coordinates at which to fit the model
+        mask : None or ndarray, shape (…), dtype: bool
+            Where to fit the model.
+        memory : int
+            Budget (in bytes) for the observations of a slab. The number
+            of slabs is chosen such that the observations of a slab will
+            approximately not need more memory than this.
+        directory : None or str
+            If given, the output arrays are memory-mapped from
+            params.npy, cov_params.npy, mse.npy, and fallback.npy in this
+            directory.
+        **kwargs
+            Passed on to fit_field.
+
+        Returns
+        -------
+        params, cov_params, mse, fallback
+
+        Notes
+        -----
+        If the store of observations is memory-mapped (see set_data),
+        peak memory is bounded by the budget rather than by the size of
+        the session. For the cells engine, estimates are bit-identical
+        to those of a fit of all coordinates at once. The scanner engine
+        is not available, as its index spans the full acquisition
+        lattice.
+        """
+        assert kwargs.get('engine', 'cells') == 'cells', \
+                'fits by slabs are only available for the cells engine'
+        kwargs.pop('engine', None)
+
+        shape = coordinates.shape[:-1]
+        p = self.design.shape[-1]
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+        def allocate(name, trailing, dtype, value):
+            if directory is None:
+                array = np.empty(shape + trailing, dtype=dtype)
+            else:
+                array = open_memmap(os.path.join(directory, name + '.npy'),
+                        mode='w+', dtype=dtype, shape=shape + trailing)
+            array[...] = value
+            return array
+
+        params     = allocate('params', (p,), float, np.nan)
+        cov_params = allocate('cov_params', (p,p), float, np.nan)
+        mse        = allocate('mse', (2,), float, np.nan)
+        fallback   = allocate('fallback', (), bool, False)
+
+        if mask is None:
+            mask = np.ones(shape, dtype=bool)
+
+        # number of planes per slab; half of the budget is reserved for
+        # the observations in the margin of the slab
+        planes = mask.reshape((shape[0],-1)).any(axis=-1).sum()
+        per_plane = BYTES_PER_OBSERVATION * self.observations.n / max(planes, 1)
+        planes = max(1, int(memory / 2 / max(per_plane, 1)))
+
+        for first in range(0, shape[0], planes):
+            last = min(first + planes, shape[0])
+            slab = mask[first:last]
+            if not slab.any():
+                continue
+
+            x = coordinates[first:last][slab]
+            rows = self.observations.within(
+                    x.min(axis=0) - self.radius, x.max(axis=0) + self.radius)
+
+            if verbose:
+                print('{}: Fit slab {:d}-{:d} of {:d} with {:,d} observations'.format(
+                    self.name.name(), first, last, shape[0], len(rows)))
+
+            if len(rows) == 0:
+                continue
+
+            fit = fit_field(
+                    coordinates = coordinates[first:last],
+                    mask        = slab,
+                    data        = self.observations.take(rows),
+                    design      = self.design,
+                    codes       = self.codes[rows],
+                    epi_code    = self.epi_code,
+                    scale       = self.scale,
+                    radius      = self.radius,
+                    verbose     = verbose,
+                    return_fallback = True,
+                    **kwargs)
+
+            for array, value in zip((params, cov_params, mse, fallback), fit):
+                array[first:last] = value
+
+        if directory is not None:
+            for array in (params, cov_params, mse, fallback):
+                array.flush()
+
+        return params, cov_params, mse, fallback
+
     def fit_at_subject_coordinates(self, coordinates, mask=None,
-            verbose=True, backend='numba'):
+            verbose=True, backend='numba', cores=None, solver='pinv',
+            engine='cells', memory=None, directory=None, checkpoint=None,
+            interval=600):
         """
         Fit the signal model to data
 
@@ -950,16 +1352,53 @@ class SignalModel:
             The coordinates at which to fit the model
         verbose : bool
             increase output verbosity
+        backend : str
+            One of numba (or jit), parallel, convolution, or
+            statsmodels. The convolution backend is approximate: it
+            convolves sufficient statistics on a grid, and its
+            standard errors, error variances, and degrees of freedom
+            may differ considerably from those of the exact backends
+            (see fit_field_by_convolution).
+        cores : None or int
+            Number of threads used by the parallel backend.
+        solver : str
+            Either pinv or cholesky. Coordinates at which the cholesky
+            solver had to fall back to the pseudo-inverse are stored in
+            the attribute .fallback.
+        engine : str
+            Either cells or scanner. The scanner engine looks up the
+            observations in the neighbourhood of a coordinate in the
+            index space of each scan cycle, and reads the signal
+            from the store of observations. The coordinates of
+            observations are then calculated on the fly, such that
+            estimates may differ from those of the cells engine by
+            rounding error.
+        memory : None or int
+            If given, fit slab by slab such that the observations of a
+            slab need approximately at most this many bytes (see
+            fit_by_slabs).
+        directory : None or str
+            If given (and memory is given), the fitted fields are
+            memory-mapped from this directory.
+        checkpoint : None or str
+            If given, save the progress of the fit to this file every
+            interval seconds, and resume from it if it exists (see
+            fit_field). Not available for fits by slabs.
+        interval : float
+            Seconds between two checkpoints.
 
         Returns
         -------
         Result
         """
+        assert (memory is None) or (checkpoint is None), \
+                'checkpoints are not available for fits by slabs'
+
         if (self.scale is None) or (self.radius is None):
             print('first run .set_hyperparameters()')
             return
 
-        if (self.data is None) or (self.observations is None):
+        if self.observations is None:
             if verbose:
                 print('{}! Set observations to default'.format(self.name.name()))
             self.set_data()
@@ -980,23 +1419,52 @@ class SignalModel:
             Number of coordinates not to: {:>10,d}""".format(
                 self.name.name(), mask.sum(), (~mask).sum()))
 
+        if verbose and backend == 'convolution':
+            print('{}: The convolution backend only approximates the fit'.format(
+                self.name.name()))
+            print('{}: Bound on the error of the weights (not of the estimates): {:.4f}'.format(
+                self.name.name(), convolution_error_bound(
+                    self.scale, self.radius)))
+
         old_settings = np.seterr(divide='raise', invalid='raise')
         time0 = time.time()
 
-        params, cov_params, mse = fit_field(
-                coordinates = coordinates,
-                mask        = mask,
-                data        = self.data,
-                design      = self.design,
-                epi_code    = self.epi_code,
-                scale       = self.scale,
-                radius      = self.radius,
-                verbose     = verbose,
-                backend     = backend)
+        if memory is None:
+            params, cov_params, mse, fallback = fit_field(
+                    coordinates = coordinates,
+                    mask        = mask,
+                    data        = self.observations,
+                    design      = self.design,
+                    codes       = self.codes,
+                    epi_code    = self.epi_code,
+                    scale       = self.scale,
+                    radius      = self.radius,
+                    verbose     = verbose,
+                    backend     = backend,
+                    index       = None if backend == 'convolution' \
+                            else self.get_index(engine),
+                    cores       = cores,
+                    solver      = solver,
+                    return_fallback = True,
+                    checkpoint  = checkpoint,
+                    interval    = interval)
+        else:
+            params, cov_params, mse, fallback = self.fit_by_slabs(
+                    coordinates = coordinates,
+                    mask        = mask,
+                    memory      = memory,
+                    directory   = directory,
+                    verbose     = verbose,
+                    backend     = backend,
+                    cores       = cores,
+                    solver      = solver,
+                    engine      = engine)
 
         time1 = time.time()
         np.seterr(**old_settings)
 
+        self.fallback = fallback
+
         if verbose:
             time_spend = time1 - time0
             print('{}: Time needed for the fit: {:.2f} min'.format(
@@ -1019,7 +1487,9 @@ class SignalModel:
         coordinates = self.population_map.diffeomorphism.apply_to_indices(indices)
         return self.fit_at_subject_coordinates(coordinates = coordinates, **kwargs)
 
-    def fit(self, mask=True, verbose=True, backend='numba'):
+    def fit(self, mask=True, verbose=True, backend='numba', cores=None,
+            solver='pinv', engine='cells', memory=None, directory=None,
+            checkpoint=None, interval=600):
         """
         Fit the signal model to data
 
@@ -1032,17 +1502,51 @@ class SignalModel:
             'foreground'.
         verbose : bool
             increase output verbosity
+        backend : str
+            One of numba (or jit), parallel, convolution, or
+            statsmodels. The convolution backend is approximate: it
+            convolves sufficient statistics on a grid, and its
+            standard errors, error variances, and degrees of freedom
+            may differ considerably from those of the exact backends
+            (see fit_field_by_convolution).
+        cores : None or int
+            Number of threads used by the parallel backend.
+        solver : str
+            Either pinv or cholesky.
+        engine : str
+            Either cells or scanner.
+        memory : None or int
+            If given, fit slab by slab within this memory budget (in
+            bytes).
+        directory : None or str
+            Directory for the memory-mapped fitted fields of a fit by
+            slabs.
+        checkpoint : None or str
+            File in which to save the progress of the fit. Not
+            available for fits by slabs.
+        interval : float
+            Seconds between two checkpoints.
 
         Returns
         -------
         Result : Fitted field.
         """
+        assert (memory is None) or (checkpoint is None), \
+                'checkpoints are not available for fits by slabs'
+
         coordinates, mask = self.get_roi(mask=mask, verbose=verbose)
 
         return self.fit_at_subject_coordinates(
                 coordinates = coordinates,
                 mask        = mask,
-                backend     = backend)
+                backend     = backend,
+                cores       = cores,
+                solver      = solver,
+                engine      = engine,
+                memory      = memory,
+                directory   = directory,
+                checkpoint  = checkpoint,
+                interval    = interval)
 
     ###################################################################
     # Descriptive statistics of this session
@@ -1081,7 +1585,7 @@ class SignalModel:
                 2*hyperparameters['radius'],
                 )
 
-    def save(self, file, **kwargs):
+    def save(self, file, lazy=False, **kwargs):
         """
         Save instance to disk
 
@@ -1091,7 +1595,16 @@ class SignalModel:
         ----------
         file : str
             File name.
-        """
+        lazy : bool
+            If True, save as a container (see fmristats.lazy), such that
+            fmristats.load memory-maps the arrays of the model and loads
+            the session, the observations, and the spatial index only on
+            first access. Otherwise (the default) pickle the instance.
+        """
+        if lazy:
+            save_lazy(self, file)
+            return
+
         with open(file, 'wb') as output:
             pickle.dump(self, output, **kwargs)
 
@@ -1103,6 +1616,44 @@ class SignalModel:
 #######################################################################
 #######################################################################
 
+def pack_symmetric(a):
+    """
+    Packed upper triangle of symmetric matrices
+
+    Parameters
+    ----------
+    a : ndarray, shape (…,p,p)
+        Symmetric matrices.
+
+    Returns
+    -------
+    ndarray, shape (…,p*(p+1)/2)
+        The entries on and above the diagonal, row by row.
+    """
+    i, j = np.triu_indices(a.shape[-1])
+    return a[...,i,j]
+
+def unpack_symmetric(packed, p):
+    """
+    Symmetric matrices from their packed upper triangle
+
+    Parameters
+    ----------
+    packed : ndarray, shape (…,p*(p+1)/2)
+        The entries on and above the diagonal, row by row.
+    p : int
+        Number of rows (and columns) of the matrices.
+
+    Returns
+    -------
+    ndarray, shape (…,p,p)
+    """
+    i, j = np.triu_indices(p)
+    a = np.empty(packed.shape[:-1] + (p,p), dtype=packed.dtype)
+    a[...,i,j] = packed
+    a[...,j,i] = packed
+    return a
+
 class SignalFit:
     """
     Result of a FMRI fitting
@@ -1110,9 +1661,17 @@ class SignalFit:
     Defines a class for the result, i.e., the estimated effect field of
     an FMRI experiments, fitted by the function attribute of the `FMRI`
     class.
+
+    Notes
+    -----
+    The covariance matrices of the parameters are stored in packed form,
+    i.e., only their upper triangle (see pack_symmetric), in the
+    attribute .cov_packed. The attribute .cov_params unpacks them on
+    demand.
     """
     def __init__(self, coordinates, params, cov_params, mse,
-            population_map, hyperparameters, parameter_dict):
+            population_map, hyperparameters, parameter_dict,
+            cov_dtype=None):
         assert isinstance(coordinates, np.ndarray), 'coordinates must be ndarray'
         assert isinstance(params, np.ndarray), 'params must be ndarray'
         assert isinstance(cov_params, np.ndarray), 'cov_params must be ndarray'
@@ -1127,7 +1686,7 @@ class SignalFit:
 
         self.coordinates     = coordinates
         self.params          = params
-        self.cov_params      = cov_params
+        self.cov_packed      = pack_symmetric(cov_params)
         self.mse             = mse
         self.population_map  = population_map
         self.hyperparameters = hyperparameters
@@ -1138,6 +1697,44 @@ class SignalFit:
         self.p = self.params.shape[-1]
         self.shape = self.params.shape[:-1]
 
+        self.cache = {}
+
+        if cov_dtype is not None:
+            self.set_cov_dtype(cov_dtype)
+
+    def __getstate__(self):
+        # evaluated contrasts are cheap to recompute and not saved
+        state = self.__dict__.copy()
+        state.pop('cache', None)
+        return state
+
+    def __setstate__(self, state):
+        # fits saved before the covariance matrices were packed
+        if 'cov_params' in state:
+            state['cov_packed'] = pack_symmetric(state.pop('cov_params'))
+        state['cache'] = {}
+        self.__dict__.update(state)
+
+    @property
+    def cov_params(self):
+        """
+        The covariance matrices of the parameters, shape (…,p,p)
+        """
+        return unpack_symmetric(self.cov_packed, self.p)
+
+    def set_cov_dtype(self, dtype):
+        """
+        Set the data type of the packed covariance matrices
+
+        Parameters
+        ----------
+        dtype : dtype
+            E.g. np.float32, which halves the size of the covariance
+            matrices once more.
+        """
+        self.cov_packed = self.cov_packed.astype(dtype)
+        self.cache = {}
+
     ####################################################################
     # Norm to ATI
     ####################################################################
@@ -1157,6 +1754,7 @@ class SignalFit:
         intecept = self.get_field('intercept', 'point').data
         intensity_correction = reference_field.data / intercept
         self.params *= intensity_correction
+        self.cache = {}
 
     def norm_to_ati(self):
         """
@@ -1169,6 +1767,97 @@ class SignalFit:
     # Extract summary statistics
     ####################################################################
 
+    def get_contrast(self, parameter):
+        """
+        Return the contrast vector for the parameter
+
+        Parameters
+        ----------
+        parameter : int or str or list(int) or np.array
+            Must int or a key in the parameter_dict.
+
+        Returns
+        -------
+        ndarray, shape (p,), dtype: float
+        """
+        if isinstance(parameter, str):
+            parameter = self.parameter_dict[parameter]
+
+        if isinstance(parameter, (int, np.integer)):
+            r = np.zeros(self.p)
+            r[parameter] = 1
+        else:
+            r = np.array(parameter, dtype=float)
+
+        assert r.shape == (self.p,), \
+                'contrast does not match number of parameter in design'
+
+        return r
+
+    def evaluate_contrasts(self, parameters=None):
+        """
+        Point estimates and variances of many contrasts at once
+
+        Parameters
+        ----------
+        parameters : None or list
+            List of parameters or contrasts (see get_field). If None,
+            all entries in the parameter_dict are evaluated.
+
+        Returns
+        -------
+        point : ndarray, shape (…,k), dtype: float
+            The point estimates r'⋅b of the k contrasts.
+        varerr : ndarray, shape (…,k), dtype: float
+            The variances r'⋅C⋅r of the point estimates.
+
+        Notes
+        -----
+        All contrasts that have not been evaluated before are evaluated
+        in a single pass over the parameter and covariance fields. The
+        results are cached in the attribute .cache, such that repeated
+        queries (e.g. for the point estimate, the standard error and the
+        t-statistic of the same contrast) are for free. The cache is
+        cleared whenever the fields change.
+        """
+        if parameters is None:
+            parameters = list(self.parameter_dict.keys())
+
+        contrasts = [self.get_contrast(parameter) for parameter in parameters]
+        keys = [r.tobytes() for r in contrasts]
+
+        missing = {}
+        for key, r in zip(keys, contrasts):
+            if key not in self.cache:
+                missing[key] = r
+
+        if missing:
+            R = np.array(list(missing.values()))
+
+            # r'⋅C⋅r from the upper triangle of C, where the off-diagonal
+            # entries appear twice
+            i, j = np.triu_indices(self.p)
+            W = R[:,i] * R[:,j] * np.where(i == j, 1., 2.)
+
+            # only read the parameters and covariances which enter the
+            # contrasts; for a fit loaded from a container, these are
+            # the only parts of the fields that are read from disk
+            a = np.flatnonzero((R != 0).any(axis=0))
+            c = np.flatnonzero((W != 0).any(axis=0))
+
+            n = int(np.prod(self.shape))
+            point = self.params[...,a].reshape((n,len(a))).dot(R[:,a].T)
+            varerr = self.cov_packed[...,c].reshape((n,len(c))).dot(W[:,c].T)
+
+            for l, key in enumerate(missing.keys()):
+                self.cache[key] = (
+                        point[:,l].reshape(self.shape),
+                        varerr[:,l].reshape(self.shape))
+
+        point = np.stack([self.cache[key][0] for key in keys], axis=-1)
+        varerr = np.stack([self.cache[key][1] for key in keys], axis=-1)
+        return point, varerr
+
     def get_field(self, parameter, value=None):
         """
         Return the scalar field for the parameter
@@ -1199,6 +1888,8 @@ class SignalFit:
         and so on.
 
         The value string can be either point, stderr, or tstatistic.
+
+        Contrasts are evaluated by evaluate_contrasts and cached.
         """
         if isinstance(parameter, str):
             if parameter == 'mse':
@@ -1209,34 +1900,13 @@ class SignalFit:
                 return Image(reference=self.reference,
                         data=self.mse[...,1],
                         name=self.name)
-            else:
-                parameter = self.parameter_dict[parameter]
-
-        if isinstance(parameter, int):
-            r = np.zeros(self.p)
-            r[parameter] = 1
-        else:
-            r = np.array(parameter)
-
-        assert len(r) == self.p, \
-                'contrast does not match number of parameter in design'
 
         assert value in ['point', 'varerr', 'stderr', 'tstatistic', 'all'], \
                 'value must be one of point, stderr, tstatistic, or all'
 
-        if value in ['point', 'tstatistic', 'all']:
-            point = np.zeros(self.shape)
-            a = point.reshape((-1,1))
-            b = self.params.reshape((-1,self.p))
-            for i in range(len(a)):
-                a[i] = r.dot(b[i])
-
-        if value in ['varerr', 'stderr', 'tstatistic', 'all']:
-            varerr = np.zeros(self.shape)
-            a = varerr.reshape((-1,1))
-            b = self.cov_params.reshape((-1,self.p,self.p))
-            for i in range(len(a)):
-                a[i] = r.dot(b[i]).dot(r)
+        point, varerr = self.evaluate_contrasts([parameter])
+        point = point[...,0]
+        varerr = varerr[...,0]
 
         if value in ['tstatistic', 'all']:
             tstats = point / np.sqrt(varerr)
@@ -1269,9 +1939,22 @@ class SignalFit:
     # Descriptive statistics of this session
     ###################################################################
 
-    def mask(self, mask=True, verbose=False):
+    def get_mask(self, mask=True, verbose=False):
         """
-        Apply mask to parameter fields
+        The mask to apply to the parameter fields
+
+        Parameters
+        ----------
+        mask : None or bool or str or ndarray, dtype: bool
+            See mask.
+        verbose : bool
+            Increase output verbosity
+
+        Returns
+        -------
+        None or ndarray, dtype: bool
+            True for the points to keep; None if there is no mask to
+            apply.
         """
         if (mask is None) or (mask is False):
             mask = None
@@ -1319,9 +2002,30 @@ class SignalFit:
         if isinstance(mask, np.ndarray):
             assert mask.dtype == bool, 'mask must be of dtype bool'
             assert mask.shape == self.shape, 'mask shape must match image shape'
+            return mask
+
+        return None
+
+    def mask(self, mask=True, verbose=False):
+        """
+        Apply mask to parameter fields
+
+        Parameters
+        ----------
+        mask : None or bool or str or ndarray, dtype: bool
+            True will apply both vb_mask and vb of the population map,
+            a string one of 'vb', 'vb_background', 'vb_estimate', or
+            'vb_mask'. None or False will not apply any mask.
+        verbose : bool
+            Increase output verbosity
+        """
+        mask = self.get_mask(mask=mask, verbose=verbose)
+
+        if mask is not None:
             self.params [ ~mask ] = np.nan
-            self.cov_params [ ~mask ] = np.nan
+            self.cov_packed [ ~mask ] = np.nan
             self.mse [ ~mask ] = np.nan
+            self.cache = {}
 
         else:
             if verbose:
@@ -1371,7 +2075,7 @@ class SignalFit:
     # Save instance to disk
     #######################################################################
 
-    def save(self, file, **kwargs):
+    def save(self, file, lazy=True, **kwargs):
         """
         Save instance to disk
 
@@ -1381,7 +2085,16 @@ class SignalFit:
         ----------
         file : str
             File name.
-        """
+        lazy : bool
+            If True, save as a container (see fmristats.lazy), such that
+            fmristats.load reads the fields of the fit only on demand
+            and the population map only on first access. Otherwise
+            pickle the instance.
+        """
+        if lazy:
+            save_lazy(self, file)
+            return
+
         with open(file, 'wb') as output:
             pickle.dump(self, output, **kwargs)
 
@@ -1509,9 +2222,22 @@ class Result:
     # Descriptive statistics of this session
     ###################################################################
 
-    def mask(self, mask=True, verbose=False):
+    def get_mask(self, mask=True, verbose=False):
         """
-        Apply mask to parameter fields
+        The mask to apply to the parameter fields
+
+        Parameters
+        ----------
+        mask : None or bool or str or ndarray, dtype: bool
+            See mask.
+        verbose : bool
+            Increase output verbosity
+
+        Returns
+        -------
+        None or ndarray, dtype: bool
+            True for the points to keep; None if there is no mask to
+            apply.
         """
         if (mask is None) or (mask is False):
             mask = None
@@ -1553,6 +2279,9 @@ class Result:
         else:
             maskname = 'user defined'
 
+        if mask is True:
+            mask = None
+
         if mask is not None:
             assert type(mask) is np.ndarray, 'mask must be an ndarray'
             assert mask.dtype == bool, 'mask must be of dtype bool'
@@ -1561,10 +2290,24 @@ class Result:
         if verbose:
             print('Statistics field is restricted to: {}'.format(maskname))
 
+        return mask
+
+    def mask(self, mask=True, verbose=False):
+        """
+        Apply mask to parameter fields
+
+        Parameters
+        ----------
+        mask : None or bool or str or ndarray, dtype: bool
+            True will apply both vb_mask and vb of the population map,
+            a string one of 'vb', 'vb_background', 'vb_estimate', or
+            'vb_mask'. None or False will not apply any mask.
+        verbose : bool
+            Increase output verbosity
+        """
+        mask = self.get_mask(mask=mask, verbose=verbose)
+
         if mask is not None:
-            assert type(mask) is np.ndarray, 'mask must be an ndarray'
-            assert mask.dtype == bool, 'mask must be of dtype bool'
-            assert mask.shape == self.statistics.shape[:-2], 'mask shape must match image shape'
             self.statistics [ ~mask ] = np.nan
 
     def descriptive_statistics(self):
@@ -1616,7 +2359,7 @@ class Result:
     # Save instance to disk
     #######################################################################
 
-    def save(self, file, **kwargs):
+    def save(self, file, lazy=True, **kwargs):
         """
         Save instance to disk
 
@@ -1626,6 +2369,15 @@ class Result:
         ----------
         file : str
             File name.
-        """
+        lazy : bool
+            If True, save as a container (see fmristats.lazy), such that
+            fmristats.load reads the statistics only on demand and the
+            population map only on first access. Otherwise pickle the
+            instance.
+        """
+        if lazy:
+            save_lazy(self, file)
+            return
+
         with open(file, 'wb') as output:
             pickle.dump(self, output, **kwargs)
@@ -24,11 +24,13 @@ in :math:`ℝ^3` by the principle axis method.
 
 """
 
+from multiprocessing.dummy import Pool as ThreadPool
+
 import numpy as np
 
 from fmristats.affines import Affine, Affines, cartesian2homogeneous
 
-def fit_by_pcm(data, reference):
+def fit_by_pcm(data, reference, cores=1):
     """
     Tracking a rigid body
 
@@ -41,6 +43,9 @@ def fit_by_pcm(data, reference):
         Matrix of observations
     reference : Affine
         Affine transformation that maps an index to (physical) position
+    cores : None or int
+        Number of threads over which the scan cycles are distributed. If
+        None, the number of cores on the machine.
 
     Returns
     -------
@@ -63,31 +68,40 @@ def fit_by_pcm(data, reference):
     to the principle axis (v) of the body.  The returned scan_inverse_references
     are affine transformations that map from the specified coordinate
     system to the coordinates of these points in the body.
+
+    The first and second moments are calculated scan cycle by scan
+    cycle, such that the working memory is of the order of a single
+    scan cycle (per thread).
     """
-    numob, i, j, k = data.shape
-    data = data.copy()
-    data [ np.isnan(data) ] = 0
+    numob, x, y, z = data.shape
 
-    n,x,y,z = data.shape
     indices = ((slice(0,x), slice(0,y), slice(0,z)))
     lattice = reference.apply_to_indices(indices)
     lattice = np.moveaxis(lattice, -1 ,0)
 
-    # centre of masses
     com = np.empty((3,numob))
-    for t in range(numob):
-        com[:,t] = (data[t] * lattice).sum(axis=(1,2,3)) / data[t].sum()
+    var = np.empty((3,3,numob))
 
-    # demeaned lattice
-    dm = np.repeat(lattice[...,None], numob, axis=-1) - com[:,None,None,None,:]
+    def moments(t):
+        observations = np.where(np.isnan(data[t]), 0., data[t])
+        mass = observations.sum()
 
-    # unweighted variance-covariance for each time point
-    cov = dm[:,None] * dm
+        # centre of mass
+        com[:,t] = (observations * lattice).sum(axis=(1,2,3)) / mass
 
-    # variance-covariance
-    var = np.empty((3,3,numob))
-    for t in range(numob):
-        var[:,:,t] = (data[t] * cov[...,t]).sum(axis=(2,3,4)) / data[t].sum()
+        # demeaned lattice and its unweighted variance-covariance
+        dm = lattice - com[:,t,None,None,None]
+        cov = dm[:,None] * dm
+
+        # variance-covariance
+        var[:,:,t] = (observations * cov).sum(axis=(2,3,4)) / mass
+
+    if (numob > 1) and ((cores is None) or (cores > 1)):
+        with ThreadPool(cores) as pool:
+            pool.map(moments, range(numob))
+    else:
+        for t in range(numob):
+            moments(t)
 
     # eigen decomposition: eigenvalues in w, eigenvectors in v
     var = np.moveaxis(var, -1, 0)
@@ -0,0 +1,86 @@
+# Copyright 2016-2018 Thomas W. D. Möbius
+#
+# This file is part of fmristats.
+#
+# fmristats is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# fmristats is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# It is not allowed to remove this copy right statement.
+
+"""
+
+Synthetic sessions and signal models for the tests.
+
+"""
+
+from fmristats import Session, ReferenceMaps, SignalModel
+from fmristats.name import Identifier
+from fmristats.stimulus import Block
+from fmristats.session import fmrisetup
+from fmristats.pmap import pmap_scanner
+
+from scipy.spatial.transform import Rotation
+
+import numpy as np
+
+import pytest
+
+def make_signal_model(n=24, shape=(14,14,10), seed=0, resolution=2.):
+    """
+    A signal model of a synthetic block design session, in which the
+    signal within an ellipsoid increases in the second half of the
+    session
+    """
+    rng = np.random.default_rng(seed)
+    name = Identifier(cohort='c', j=1, datetime='d', paradigm='p')
+
+    i, j, k = np.mgrid[:shape[0],:shape[1],:shape[2]]
+    c = (np.array(shape)-1)/2
+    ball = ((i-c[0])**2/16 + (j-c[1])**2/16 + (k-c[2])**2/9) < 1
+
+    data = np.zeros((n,)+shape)
+    data[:, ball] = 100 + rng.normal(0, 5, (n, ball.sum()))
+    data[:,~ball] = rng.uniform(0, 5, (n, (~ball).sum()))
+    data[n//2:, ball] += 3
+
+    reference = np.diag([resolution, resolution, 1.5*resolution, 1.])
+    session = Session(name, data, 3,
+            np.array([resolution, resolution, 1.5*resolution]), 2., reference)
+
+    onsets = {
+            'stimulus' : np.arange(8., 2*n, 16),
+            'control'  : np.arange(0., 2*n, 16)}
+    durations = {'stimulus' : 8., 'control' : 8.}
+    fmrisetup(session, Block(name, ['stimulus', 'control'], onsets, durations))
+    session.fit_foreground()
+
+    maps = np.tile(np.eye(4), (n,1,1))
+    maps[:,:3,:3] = Rotation.from_rotvec(rng.normal(0, 0.01, (n,3))).as_matrix()
+    maps[:,:3, 3] = rng.normal(0, 0.3, (n,3))
+    reference_maps = ReferenceMaps(name)
+    reference_maps.set_acquisition_maps(maps)
+    reference_maps.outlying_cycles = np.zeros(n, dtype=bool)
+    reference_maps.outlying_scans = np.zeros((n, shape[2]), dtype=bool)
+
+    population_map = pmap_scanner(session, None, resolution=3.)
+
+    model = SignalModel(session, reference_maps, population_map)
+    model.set_stimulus_design(s='stimulus', c='control')
+    model.set_data(burn_in=2, verbose=False)
+    model.set_design(verbose=False)
+    model.set_hyperparameters()
+    return model
+
+@pytest.fixture
+def signal_model():
+    return make_signal_model()
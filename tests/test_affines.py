@@ -0,0 +1,121 @@
+# Copyright 2016-2018 Thomas W. D. Möbius
+#
+# This file is part of fmristats.
+#
+# fmristats is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# fmristats is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# It is not allowed to remove this copy right statement.
+
+"""
+
+Compare the operations on stacks of affine transformations with the
+same operations applied to each transformation
+
+"""
+
+from fmristats.affines import Affine, Affines
+
+from nibabel.eulerangles import euler2mat
+
+import numpy as np
+
+import pytest
+
+def make_rigids(n, seed, scale=0.1, gimbal_lock=True):
+    """
+    Random rigid transformations; the first two are in gimbal lock
+    unless gimbal_lock is False
+    """
+    rng = np.random.default_rng(seed)
+    angles = rng.normal(scale=scale, size=(n,3))
+    if gimbal_lock:
+        angles[:2,1] = (np.pi/2, -np.pi/2)
+    affines = np.zeros((n,4,4))
+    for t in range(n):
+        affines[t,:3,:3] = euler2mat(*angles[t])
+    affines[:,:3,3] = rng.normal(scale=5, size=(n,3))
+    affines[:,3,3] = 1
+    return Affines(affines)
+
+def test_affines_match_loop():
+    affines = make_rigids(25, 20)
+    assert affines.are_rigid
+
+    euler = affines.euler()
+    assert euler.shape == (affines.n, 3)
+    for t in range(affines.n):
+        assert np.allclose(euler[t], affines.index(t).euler())
+
+    inverses = affines.inv()
+    for t in range(affines.n):
+        assert np.allclose(inverses.affines[t], affines.index(t).inv().affine)
+        assert np.allclose(np.matmul(inverses.affines[t], affines.affines[t]),
+                np.eye(4))
+
+    x = Affine(np.diag((2.,3.,4.,1.)))
+    products = affines.dot(x)
+    for t in range(affines.n):
+        assert np.allclose(products.affines[t], affines.index(t).dot(x).affine)
+
+    vector = np.array((1.,-2.,3.))
+    applied = affines.apply(vector)
+    indices = (slice(0,3), slice(1,4), slice(2,6))
+    grids = affines.apply_to_indices(indices)
+    assert grids.shape == (affines.n, 3, 3, 4, 3)
+    for t in range(affines.n):
+        assert np.allclose(applied[t], affines.index(t).apply(vector))
+        assert np.allclose(grids[t], affines.index(t).apply_to_indices(indices))
+
+def naive_mean_within_windows(affines, r, skip=None):
+    """
+    Mean rigid transformation within each window, one at a time
+    """
+    if skip is None:
+        skip = np.zeros(affines.n, dtype=bool)
+    mean_affines = affines.affines.copy()
+    if r > 0:
+        for t in range(affines.n):
+            window = slice(max(0,t-r), t+r+1)
+            xs = affines.affines[window][~skip[window]]
+            if xs.shape[0] > 0:
+                mean_affines[t] = Affines(xs).mean_rigid().affine
+    return mean_affines
+
+@pytest.mark.parametrize('with_skip', [False, True])
+def test_mean_within_windows_matches_loop(with_skip):
+    # the mean of rotations in opposite gimbal lock is nearly singular,
+    # and its projection onto the rotations is not well defined
+    affines = make_rigids(40, 21, gimbal_lock=False)
+
+    if with_skip:
+        rng = np.random.default_rng(21)
+        skip = rng.random(affines.n) < 0.3
+        # a window of radius 1 in which every transformation is skipped
+        skip[10:13] = True
+    else:
+        skip = None
+
+    radii = [0, 1, 3, 50]
+    means = affines.mean_within_windows(radii, skip)
+    assert len(means) == len(radii)
+
+    for r, mean in zip(radii, means):
+        expected = naive_mean_within_windows(affines, r, skip)
+        assert mean.are_rigid
+        assert np.allclose(mean.affines, expected)
+        assert np.allclose(affines.mean_within_windows(r, skip).affines,
+                expected)
+
+    if with_skip:
+        assert np.array_equal(means[1].affines[11], affines.affines[11])
@@ -0,0 +1,102 @@
+# Copyright 2016-2018 Thomas W. D. Möbius
+#
+# This file is part of fmristats.
+#
+# fmristats is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# fmristats is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# It is not allowed to remove this copy right statement.
+
+"""
+
+Compare the convolution backend with the exact numba backend
+
+"""
+
+from fmristats.fit import fit_field, fit_field_by_convolution, \
+        convolution_error_bound, ConvolutionGrid
+
+import fmristats.fit as fit
+
+import numpy as np
+
+import pytest
+
+scale, radius = 1.5, 4.5
+
+def make_data(n=40000, seed=1):
+    """
+    Observations of homogeneous variance, uniformly scattered in a cube
+    of side length 30, with an intercept of 100 and a task effect of 3
+    """
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0, 30, (n,3))
+    task = rng.integers(0, 2, n).astype(float)
+    design = np.stack((np.ones(n), task), axis=-1)
+    signal = 100 + 3*task + rng.normal(0, 5, n)
+    data = np.zeros((n,9))
+    data[:,:3] = points
+    data[:, 3] = signal
+    return data, design
+
+def standard_errors(cov_params):
+    return np.sqrt(np.diagonal(cov_params, axis1=-2, axis2=-1))
+
+def test_convolution_approximates_exact_fit():
+    data, design = make_data()
+    coordinates = np.stack(np.meshgrid(*3*[np.arange(8, 23, 2.)],
+        indexing='ij'), axis=-1)
+    mask = np.ones(coordinates.shape[:-1], dtype=bool)
+
+    params, cov_params, mse = fit_field(coordinates, mask, data, design,
+            3, scale, radius, verbose=False, backend='numba')
+    aparams, acov_params, amse = fit_field_by_convolution(coordinates,
+            mask, data[:,:3], data[:,3], design, scale, radius)
+
+    assert np.isfinite(aparams).all()
+
+    # the estimates are approximations only (see
+    # fit_field_by_convolution): the parameters agree up to a fifth of
+    # their standard error, the standard errors up to 3%, the error
+    # variance up to 6%, and the residual degrees of freedom up to 5%
+    stderr = standard_errors(cov_params)
+    assert (abs(aparams - params) < 0.2 * stderr).all()
+    assert (abs(standard_errors(acov_params) - stderr) < 0.03 * stderr).all()
+    assert (abs(amse - mse) < [0.06, 0.05] * mse).all()
+
+@pytest.mark.parametrize('width', [scale/4, scale/8])
+def test_convolution_weights_within_bound(width):
+    rng = np.random.default_rng(0)
+    coordinates = rng.uniform(0, 6, (200,3))
+    points = rng.uniform(-5, 11, (300,3))
+    grid = ConvolutionGrid(coordinates, points, scale, radius, width)
+
+    # the weight of each observation at each coordinate
+    weights = np.stack([grid.sums(value) for value in np.eye(len(points))],
+            axis=-1)
+
+    squared_distances = ((coordinates[:,None] - points[None])**2).sum(-1)
+    exact = np.where(squared_distances < radius**2,
+            np.exp(squared_distances / (-2*scale**2)), 0)
+
+    bound = convolution_error_bound(scale, radius, width)
+    assert bound < 0.06
+    assert (abs(weights - exact) <= bound).all()
+
+def test_convolution_grid_exceeding_memory(monkeypatch):
+    data, design = make_data(n=1000)
+    coordinates = np.array([[15., 15., 15.]])
+    monkeypatch.setattr(fit, 'available_memory', lambda: 1024)
+    with pytest.raises(MemoryError):
+        fit_field_by_convolution(coordinates, None, data[:,:3], data[:,3],
+                design, scale, radius)
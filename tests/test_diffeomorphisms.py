@@ -0,0 +1,59 @@
+# Copyright 2016-2018 Thomas W. D. Möbius
+#
+# This file is part of fmristats.
+#
+# fmristats is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# fmristats is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# It is not allowed to remove this copy right statement.
+
+from fmristats.diffeomorphisms import Warp
+from fmristats.affines import Affine
+
+import numpy as np
+
+import pickle
+
+def make_warp(seed=0):
+    rng = np.random.default_rng(seed)
+    reference = np.diag([2., 2., 2., 1.])
+    shape = (8, 9, 10)
+    warp = np.moveaxis(np.mgrid[:8,:9,:10], 0, -1) \
+            + rng.normal(0, 0.5, shape + (3,))
+    coordinates = rng.uniform(4, 12, (50,3))
+    return Warp(reference, warp), coordinates
+
+def test_warp_follows_field_and_reference():
+    warp, coordinates = make_warp()
+    a = warp.apply(coordinates)
+    assert np.array_equal(warp.apply(coordinates), a)
+
+    warp.warp = warp.warp * 2
+    assert np.allclose(warp.apply(coordinates), 2*a)
+
+    # doubling both the reference and the coordinates maps to the same
+    # indices of the field
+    warp.warp = warp.warp / 2
+    warp.reference = Affine(np.diag([4., 4., 4., 1.]))
+    assert np.allclose(warp.apply(2*coordinates), a)
+    assert np.allclose(warp.apply(2*coordinates), Warp(
+        np.diag([4., 4., 4., 1.]), warp.warp).apply(2*coordinates))
+
+def test_warp_cache_is_not_saved():
+    warp, coordinates = make_warp()
+    a = warp.apply(coordinates)
+    assert warp.cache
+
+    loaded = pickle.loads(pickle.dumps(warp))
+    assert loaded.cache == {}
+    assert np.array_equal(loaded.apply(coordinates), a)
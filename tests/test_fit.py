@@ -0,0 +1,82 @@
+# Copyright 2016-2018 Thomas W. D. Möbius
+#
+# This file is part of fmristats.
+#
+# fmristats is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# fmristats is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# It is not allowed to remove this copy right statement.
+
+"""
+
+Compare the solvers of the exact fit
+
+"""
+
+from fmristats.fit import fit_field
+
+import numpy as np
+
+scale, radius = 1.5, 4.5
+
+def make_data(n=20000, seed=2):
+    """
+    Observations uniformly scattered in a cube of side length 20. The
+    third column of the design (a covariate) vanishes in the half
+    x > 10 of the cube, such that the design is singular in the
+    neighbourhood of coordinates with x > 10 + radius.
+    """
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0, 20, (n,3))
+    task = rng.integers(0, 2, n).astype(float)
+    covariate = rng.normal(0, 1, n) * (points[:,0] < 10)
+    design = np.stack((np.ones(n), task, covariate), axis=-1)
+    signal = 100 + 3*task + covariate + rng.normal(0, 5, n)
+    data = np.zeros((n,9))
+    data[:,:3] = points
+    data[:, 3] = signal
+    return data, design
+
+def test_cholesky_agrees_with_pinv():
+    data, design = make_data()
+    coordinates = np.stack(np.meshgrid(np.arange(4, 17, 1.),
+        np.arange(6, 15, 2.), np.arange(6, 15, 2.), indexing='ij'), axis=-1)
+    mask = np.ones(coordinates.shape[:-1], dtype=bool)
+
+    params, cov_params, mse, fallback = fit_field(coordinates, mask, data,
+            design, 3, scale, radius, verbose=False, solver='pinv',
+            return_fallback=True)
+    cparams, ccov_params, cmse, cfallback = fit_field(coordinates, mask,
+            data, design, 3, scale, radius, verbose=False,
+            solver='cholesky', return_fallback=True)
+
+    # the pseudo-inverse solver never falls back
+    assert not fallback.any()
+
+    # the cholesky solver falls back where the third column vanishes in
+    # the neighbourhood, and agrees with pinv where it does not
+    singular = coordinates[...,0] >= 10 + radius
+    regular = coordinates[...,0] < 10
+    assert cfallback[singular].all()
+    assert not cfallback[regular].any()
+
+    assert np.isfinite(cparams[regular]).all()
+    assert np.allclose(cparams[regular], params[regular], rtol=1e-8)
+    assert np.allclose(ccov_params[regular], cov_params[regular], rtol=1e-8)
+    assert np.allclose(cmse[regular], mse[regular], rtol=1e-8)
+
+    # after the fallback, the estimates are those of pinv (which cannot
+    # fit a singular design)
+    assert np.array_equal(cparams[cfallback], params[cfallback],
+            equal_nan=True)
+    assert np.array_equal(cmse[cfallback], mse[cfallback], equal_nan=True)
@@ -0,0 +1,95 @@
+# Copyright 2016-2018 Thomas W. D. Möbius
+#
+# This file is part of fmristats.
+#
+# fmristats is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# fmristats is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# It is not allowed to remove this copy right statement.
+
+"""
+
+Compare the generalized ESD test with a naive implementation
+
+"""
+
+from fmristats.grubbs import generalized_esd, esd_critical_values
+
+import numpy as np
+
+import pytest
+
+def naive_esd(xvec, sgnf, max_outliers=None):
+    """
+    Rosner's generalized ESD test, one value removed at a time
+    """
+    xvec = np.array(xvec, dtype=float)
+    args = np.isnan(xvec)
+    count = (~args).sum()
+    bound = count // 2 if max_outliers is None else min(max_outliers, count)
+    crvals = esd_critical_values(int(count), sgnf)
+
+    removed = []
+    outliers = 0
+    for i in range(bound):
+        if count - i < 7:
+            break
+        m = np.nanmean(xvec)
+        sd = np.nanstd(xvec, ddof=1)
+        candidates = abs(xvec - m)
+        arg = np.nanargmax(candidates)
+        if sd > 0 and candidates[arg] / sd > crvals[i]:
+            outliers = i + 1
+        removed.append(arg)
+        xvec[arg] = np.nan
+
+    args[removed[:outliers]] = True
+    return args
+
+@pytest.mark.parametrize('max_outliers', [None, 0, 1, 3])
+def test_generalized_esd_matches_naive_loop(max_outliers):
+    rng = np.random.default_rng(22)
+    n, k = 40, 30
+    x = rng.normal(size=(n,k))
+
+    # plant outliers of different sizes and signs
+    for j in range(k):
+        planted = rng.choice(n, size=j % 5, replace=False)
+        x[planted,j] += rng.choice([-1,1], size=len(planted)) \
+                * rng.uniform(2, 8, size=len(planted))
+
+    # pad samples of different sizes with missings, down to too short
+    # samples that must not be tested
+    for j in range(k):
+        x[rng.choice(n, size=rng.integers(0, n-3), replace=False),j] = np.nan
+    x[:,0] = np.nan
+
+    args = generalized_esd(x, 0.05, max_outliers)
+    expected = np.stack([naive_esd(x[:,j], 0.05, max_outliers)
+        for j in range(k)], axis=1)
+
+    assert args.shape == x.shape
+    assert (args == expected).all()
+    assert args[np.isnan(x)].all()
+    assert (args & ~np.isnan(x)).any() == (max_outliers != 0)
+
+    # a single sample gives the same answer as a column
+    for j in range(k):
+        assert (generalized_esd(x[:,j], 0.05, max_outliers)
+                == expected[:,j]).all()
+
+def test_generalized_esd_constant_sample():
+    x = np.ones(20)
+    x[3] = np.nan
+    args = generalized_esd(x, 0.05)
+    assert (args == np.isnan(x)).all()
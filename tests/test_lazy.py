@@ -0,0 +1,48 @@
+# Copyright 2016-2018 Thomas W. D. Möbius
+#
+# This file is part of fmristats.
+#
+# fmristats is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# fmristats is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# It is not allowed to remove this copy right statement.
+
+from fmristats import load
+
+import fmristats.lazy as lazy
+
+import numpy as np
+
+def fit(model):
+    result = model.fit(mask=True, verbose=False)
+    return result.params, result.cov_params, result.mse
+
+def test_signal_model_is_pickled_by_default(signal_model, tmp_path):
+    file = str(tmp_path / 'model')
+    signal_model.save(file)
+    assert not lazy.is_lazy(file)
+
+def test_fit_loaded_signal_model(signal_model, tmp_path, monkeypatch):
+    expected = fit(signal_model)
+
+    # store all fmristats instances as sections, such that the loaded
+    # model holds proxies of its session, observations, and index
+    monkeypatch.setattr(lazy, 'THRESHOLD', 0)
+    file = str(tmp_path / 'model')
+    signal_model.save(file, lazy=True)
+
+    loaded = load(file)
+    assert isinstance(loaded.__dict__['observations'], lazy.LazyObject)
+
+    for a, b in zip(fit(loaded), expected):
+        assert np.array_equal(a, b, equal_nan=True)
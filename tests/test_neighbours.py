@@ -0,0 +1,59 @@
+# Copyright 2016-2018 Thomas W. D. Möbius
+#
+# This file is part of fmristats.
+#
+# fmristats is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# fmristats is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# It is not allowed to remove this copy right statement.
+
+"""
+
+Compare the neighbourhood queries of a cell index with brute force
+
+"""
+
+from fmristats.neighbours import CellIndex
+
+import numpy as np
+
+import pytest
+
+def brute_force(coordinate, points, radius):
+    squared_distances = ((points - coordinate)**2).sum(axis=1)
+    valid, = np.where(squared_distances < radius**2)
+    return valid, squared_distances[valid]
+
+@pytest.mark.parametrize('width', [0.05, 1., 2.5, 40.])
+def test_cell_query_matches_brute_force(width):
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0, 20, (2000,3))
+    points[::97] = np.nan
+    index = CellIndex(points, width)
+
+    # query points inside, at the border of, and outside the bounding
+    # box of the points
+    coordinates = rng.uniform(-5, 25, (200,3))
+    for coordinate in coordinates:
+        for radius in [0.5, 2.5, 6.]:
+            indices, squared_distances = index.query(coordinate, radius)
+            expected, expected_distances = brute_force(coordinate, points,
+                    radius)
+            assert np.array_equal(indices, expected)
+            assert np.array_equal(squared_distances, expected_distances)
+
+def test_cell_query_without_finite_points():
+    index = CellIndex(np.full((10,3), np.nan), 1.)
+    indices, squared_distances = index.query(np.zeros(3), 5.)
+    assert len(indices) == 0
+    assert len(squared_distances) == 0
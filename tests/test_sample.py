@@ -0,0 +1,41 @@
+# Copyright 2016-2018 Thomas W. D. Möbius
+#
+# This file is part of fmristats.
+#
+# fmristats is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# fmristats is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# It is not allowed to remove this copy right statement.
+
+from fmristats.sample import fingerprint, settings_fingerprint
+from fmristats.diffeomorphisms import Image
+
+import numpy as np
+
+def make_image(value):
+    return Image(reference=np.eye(4), data=np.full((4,5,6), value))
+
+def test_settings_fingerprint():
+    vb, vb_ati = make_image(1.), make_image(100.)
+    settings = settings_fingerprint(vb, vb_ati, True)
+    assert settings == settings_fingerprint(make_image(1.),
+            make_image(100.), True)
+    assert settings != settings_fingerprint(vb, vb_ati, False)
+    assert settings != settings_fingerprint(vb, vb_ati, 'vb_mask')
+    assert settings != settings_fingerprint(vb, make_image(50.), True)
+
+def test_fingerprint_with_settings(tmp_path):
+    file = str(tmp_path / 'result')
+    assert fingerprint(file, 'settings') is None
+    open(file, 'wb').write(b'result')
+    assert fingerprint(file, 'settings') == fingerprint(file) + ('settings',)
@@ -0,0 +1,67 @@
+# Copyright 2016-2018 Thomas W. D. Möbius
+#
+# This file is part of fmristats.
+#
+# fmristats is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# fmristats is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# It is not allowed to remove this copy right statement.
+
+from fmristats.pmap import pmap_scanner
+
+import numpy as np
+
+import pickle
+
+import pytest
+
+def test_data_mask_follows_population_map(signal_model):
+    mask = signal_model.get_mask(verbose=False)
+    assert np.array_equal(signal_model.get_mask(verbose=False), mask)
+
+    signal_model.population_map = pmap_scanner(signal_model.session, None,
+            resolution=2.)
+    coordinates = signal_model.population_map.diffeomorphism.coordinates()
+    assert signal_model.get_mask(verbose=False).shape == \
+            coordinates.shape[:-1]
+
+def test_data_mask_follows_foreground(signal_model):
+    mask = signal_model.get_mask(verbose=False)
+
+    # keep only the lower half of the acquisition lattice
+    session = signal_model.session
+    foreground = np.isfinite(session.data)
+    foreground[...,session.shape[-1]//2:] = False
+    session.set_foreground(foreground)
+
+    smaller = signal_model.get_mask(verbose=False)
+    assert smaller.sum() < mask.sum()
+    assert not (smaller & ~mask).any()
+
+def test_data_mask_is_not_saved(signal_model):
+    mask = signal_model.get_mask(verbose=False)
+    assert signal_model.masks
+
+    loaded = pickle.loads(pickle.dumps(signal_model))
+    assert loaded.masks == {}
+    assert np.array_equal(loaded.get_mask(verbose=False), mask)
+
+@pytest.mark.parametrize('method', ['fit', 'fit_at_subject_coordinates'])
+def test_no_checkpoints_for_fits_by_slabs(signal_model, method, tmp_path):
+    kwargs = {'verbose' : False, 'memory' : 2**20,
+            'checkpoint' : str(tmp_path / 'checkpoint.npz')}
+    if method == 'fit_at_subject_coordinates':
+        kwargs['coordinates'], kwargs['mask'] = signal_model.get_roi(
+                verbose=False)
+    with pytest.raises(AssertionError):
+        getattr(signal_model, method)(**kwargs)